@@ -5,7 +5,8 @@ from jose import JWTError, ExpiredSignatureError
 
 from app.db import database, models, schemas
 from app.core import security
-from app.services import user_service, session_service
+from app.core.revocation import session_revocations
+from app.services import user_service
 
 # Эта строка создает "схему" для FastAPI.
 # "tokenUrl" указывает, что токен можно получить по адресу "/api/v1/auth/token".
@@ -23,8 +24,9 @@ def get_current_user(
     1. Принимает 'token' из заголовка (через oauth2_scheme).
     2. Принимает сессию 'db' (через get_db).
     3. Проверяет токен.
-    4. Загружает пользователя из БД.
-    5. Возвращает объект models.User или выбрасывает ошибку 401.
+    4. Проверяет, что сессия токена не отозвана (реестр в памяти, без БД).
+    5. Загружает пользователя из БД.
+    6. Возвращает объект models.User или выбрасывает ошибку 401.
     """
 
     # Исключение, если токен невалидный (включая протухший)
@@ -52,14 +54,22 @@ def get_current_user(
         # Любая другая ошибка (неверная подпись и т.д.)
         raise credentials_exception
 
-    # 2. Загружаем пользователя из БД
-    user = user_service.get_user(db, user_id=token_data.user_id)
+    # 2. Сессия могла быть завершена (выход, "завершить сессию", вход с того же устройства)
+    if session_revocations.is_revoked(token_data):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Сессия была завершена",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # 3. Загружаем пользователя (из кэша, при промахе - из БД)
+    user = user_service.get_user_cached(db, user_id=token_data.user_id)
 
     if user is None:
         # Если токен верный, но юзера уже удалили из БД
         raise credentials_exception
 
-    # 3. Возвращаем полную модель пользователя
+    # 4. Возвращаем полную модель пользователя
     return user
 
 
@@ -71,7 +81,6 @@ def get_current_user_and_session(
     Зависимость для получения пользователя с проверкой активности сессии.
     
     Дополнительно к get_current_user:
-    - Проверяет, что сессия (session_id из токена) все еще активна
     - Прикрепляет session_id к объекту пользователя для дальнейшего использования
     
     Используется в эндпоинтах управления сессиями.
@@ -98,24 +107,21 @@ def get_current_user_and_session(
     except JWTError:
         raise credentials_exception
 
+    # Сессия была отозвана (проверка по реестру в памяти, без запроса к user_sessions)
+    if session_revocations.is_revoked(token_data):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Сессия была завершена",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
     # Загружаем пользователя
-    user = user_service.get_user(db, user_id=token_data.user_id)
+    user = user_service.get_user_cached(db, user_id=token_data.user_id)
 
     if user is None:
         raise credentials_exception
 
-    # Проверяем активность сессии (если session_id есть в токене)
     if token_data.session_id:
-        session = session_service.get_session_by_id(
-            db, token_data.session_id, token_data.user_id
-        )
-        if not session:
-            # Сессия была отозвана или истекла
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Сессия была завершена",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
         # Прикрепляем session_id к объекту пользователя
         user._current_session_id = token_data.session_id
 
@@ -123,12 +129,11 @@ def get_current_user_and_session(
 
 
 def get_current_active_user(
-        current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(database.get_db)
+        current_user: models.User = Depends(get_current_user)
 ) -> models.User:
     """
     Эта зависимость вызывает get_current_user и обновляет last_seen для актуального статуса онлайн.
     """
-    # Обновляем last_seen при каждом запросе
-    user_service.update_last_seen(db, current_user.id)
+    # Обновляем last_seen при каждом запросе (в буфер, без запроса к БД)
+    user_service.update_last_seen(current_user.id)
     return current_user
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Ограничение частоты запросов к дорогим эндпоинтам (Argon2, SMS, поиск).
+
+Правила задаются в настройках строкой "N/секунд" (RATE_LIMIT_*), бэкенд -
+RATE_LIMIT_BACKEND: "memory" (лимит на воркер) или "shared" (общая память
+для всех воркеров машины, app/core/rate_limit.py).
+
+- По IP и по пользователю лимиты проверяет RateLimitMiddleware (чистый ASGI,
+  до разбора тела и зависимостей) - отказ стоит одного обращения к ведру.
+- По номеру телефона - check_limit() в самих эндпоинтах, после разбора тела.
+
+Отказ - 429 с заголовком Retry-After.
+"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from app.core import security
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter, SharedRateLimiter, parse_rate
+
+RATE_LIMIT_DETAIL = "Слишком много запросов, повторите попытку позже"
+
+# Правило -> настройка с лимитом
+RULES = {
+    "login_ip": "RATE_LIMIT_LOGIN_IP",
+    "login_phone": "RATE_LIMIT_LOGIN_PHONE",
+    "send_code_ip": "RATE_LIMIT_SEND_CODE_IP",
+    "send_code_phone": "RATE_LIMIT_SEND_CODE_PHONE",
+    "verify_code_ip": "RATE_LIMIT_VERIFY_CODE_IP",
+    "search": "RATE_LIMIT_SEARCH",
+}
+
+# Путь -> [(правило, ключ)]; ключ "ip" или "user" (для анонимного запроса - IP)
+PATH_RULES: Dict[str, List[Tuple[str, str]]] = {
+    "/api/v1/auth/token": [("login_ip", "ip")],
+    "/api/v1/auth/send-code": [("send_code_ip", "ip")],
+    "/api/v1/auth/verify-code": [("verify_code_ip", "ip")],
+    "/api/v1/users/search": [("search", "user")],
+}
+PREFIX_RULES: List[Tuple[str, List[Tuple[str, str]]]] = [
+    ("/api/v1/users/check-username/", [("search", "user")]),
+]
+
+
+def _create_limiter(rule: str):
+    capacity, per_seconds = parse_rate(getattr(settings, RULES[rule]))
+    if settings.RATE_LIMIT_BACKEND == "shared":
+        return SharedRateLimiter(rule, capacity, per_seconds, settings.RATE_LIMIT_SHARED_SLOTS)
+    if settings.RATE_LIMIT_BACKEND != "memory":
+        raise ValueError(f"Неизвестный RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+    return RateLimiter(capacity, per_seconds)
+
+
+limiters = {rule: _create_limiter(rule) for rule in RULES} if settings.RATE_LIMIT_ENABLED else {}
+
+
+def _retry_after_header(retry_after: float) -> str:
+    return str(int(retry_after) + 1)
+
+
+def check_limit(rule: str, key) -> None:
+    """Для эндпоинтов: списывает запрос из ведра rule/key или выбрасывает 429."""
+    limiter = limiters.get(rule)
+    if limiter is None or not key:
+        return
+    retry_after = limiter.hit(key)
+    if retry_after:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            RATE_LIMIT_DETAIL,
+            headers={"Retry-After": _retry_after_header(retry_after)}
+        )
+
+
+def _user_key(scope) -> Optional[str]:
+    """user_id из Bearer токена. Проверка токена кэшируется, deps потом возьмет ее из кэша."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return f"u{security.verify_and_decode_token(token).user_id}"
+            except Exception:
+                return None  # Невалидный токен отклонит сама зависимость авторизации
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not limiters:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        rules = PATH_RULES.get(path)
+        if rules is None:
+            for prefix, prefix_rules in PREFIX_RULES:
+                if path.startswith(prefix):
+                    rules = prefix_rules
+                    break
+            else:
+                await self.app(scope, receive, send)
+                return
+
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        for rule, key_kind in rules:
+            key = (_user_key(scope) if key_kind == "user" else None) or ip
+            retry_after = limiters[rule].hit(key)
+            if retry_after:
+                await self._reject(send, retry_after)
+                return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, retry_after: float):
+        body = json.dumps({"detail": RATE_LIMIT_DETAIL}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_429_TOO_MANY_REQUESTS,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", _retry_after_header(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -3,20 +3,21 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import Dict
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-import random
+import secrets
 import logging
 
 from app.db import schemas, database
 from app.services import auth_service, user_service, session_service
 from app.core.security import create_access_token
+from app.core.geoip import geoip
+from app.core.user_agent import parse_user_agent
+from app.core.verification_codes import CodeCheck, verification_codes
+from app.core.phone import normalize_phone
+from app.api.rate_limits import check_limit
 
 # Настройка логирования для вывода SMS кода
 logger = logging.getLogger("uvicorn.error")
 
-# In-memory хранилище SMS кодов: {phone_number: {"code": str, "expires_at": datetime}}
-sms_codes_storage: Dict[str, dict] = {}
-
 
 class PhoneCheckRequest(BaseModel):
     phone_number: str
@@ -43,68 +44,22 @@ router = APIRouter(
 
 
 def _get_device_info(request: Request) -> dict:
-    """Извлекает информацию об устройстве из запроса"""
+    """Извлекает информацию об устройстве из запроса (без обращений к внешним сервисам)"""
     user_agent = request.headers.get("user-agent", "Unknown")
     
-    # Определяем тип устройства по User-Agent
-    device_type = "desktop"
-    if "Mobile" in user_agent or "Android" in user_agent:
-        device_type = "mobile"
-    elif "Tablet" in user_agent or "iPad" in user_agent:
-        device_type = "tablet"
-    
-    # Формируем читаемое название устройства
-    if "Windows" in user_agent:
-        os_name = "Windows"
-    elif "Mac" in user_agent:
-        os_name = "macOS"
-    elif "Linux" in user_agent:
-        os_name = "Linux"
-    elif "Android" in user_agent:
-        os_name = "Android"
-    elif "iPhone" in user_agent or "iPad" in user_agent:
-        os_name = "iOS"
-    else:
-        os_name = "Unknown OS"
-    
-    if "Chrome" in user_agent and "Edg" not in user_agent:
-        browser = "Chrome"
-    elif "Firefox" in user_agent:
-        browser = "Firefox"
-    elif "Safari" in user_agent and "Chrome" not in user_agent:
-        browser = "Safari"
-    elif "Edg" in user_agent:
-        browser = "Edge"
-    elif "Electron" in user_agent:
-        browser = "Dialect Desktop"
-    else:
-        browser = "Unknown Browser"
-    
-    device_name = f"{browser} on {os_name}"
+    # Тип и читаемое название устройства (разбор кэшируется)
+    device_name, device_type = parse_user_agent(user_agent)
     
     # Получаем IP адрес
     ip_address = request.client.host if request.client else None
     
-    # Определяем локацию
+    # Определяем локацию по локальной базе GeoIP (mmap + бинарный поиск, микросекунды)
     location = "Unknown Location"
     if ip_address:
         if ip_address in ["127.0.0.1", "::1", "localhost"]:
              location = "Local System"
         else:
-            try:
-                # Используем urllib для избежания внешних зависимостей типа requests
-                from urllib.request import urlopen
-                import json
-                # Тайм-аут 2 секунды чтобы не блокировать надолго
-                with urlopen(f"http://ip-api.com/json/{ip_address}?fields=status,city,country", timeout=2) as url:
-                    data = json.loads(url.read().decode())
-                    if data.get("status") == "success":
-                        city = data.get("city", "")
-                        country = data.get("country", "")
-                        location = f"{city}, {country}" if city and country else city or country
-            except Exception as e:
-                logger.warning(f"Failed to resolve location for IP {ip_address}: {e}")
-                pass
+            location = geoip.lookup(ip_address) or location
 
     return {
         "device_name": device_name,
@@ -168,7 +123,7 @@ def send_sms_code(
     """
     Отправляет SMS код для входа (MOCK - выводит в консоль).
     
-    Генерирует 6-значный код, сохраняет в памяти с истечением через 5 минут,
+    Генерирует 6-значный код, сохраняет в хранилище кодов с истечением через 5 минут,
     и выводит в консоль uvicorn.
     """
     phone = code_request.phone_number
@@ -179,6 +134,9 @@ def send_sms_code(
             detail="Номер телефона обязателен"
         )
     
+    # Не больше RATE_LIMIT_SEND_CODE_PHONE SMS на номер
+    check_limit("send_code_phone", normalize_phone(phone))
+    
     # Проверяем, существует ли пользователь (только для входа, не для регистрации)
     user = user_service.get_user_by_phone(db, phone_number=phone)
     if not code_request.for_registration and not user:
@@ -195,13 +153,10 @@ def send_sms_code(
         )
     
     # Генерируем 6-значный код
-    code = str(random.randint(100000, 999999))
+    code = str(secrets.randbelow(900000) + 100000)
     
-    # Сохраняем код с временем истечения (5 минут)
-    sms_codes_storage[phone] = {
-        "code": code,
-        "expires_at": datetime.now() + timedelta(minutes=5)
-    }
+    # Сохраняем код с временем истечения (VERIFICATION_CODE_TTL_SECONDS, общее хранилище воркеров)
+    verification_codes.issue(phone, code)
     
     # Выводим код в консоль uvicorn
     logger.info("=" * 50)
@@ -235,33 +190,33 @@ def verify_sms_code(
             detail="Номер телефона и код обязательны"
         )
     
-    # Проверяем, есть ли код для этого номера
-    stored = sms_codes_storage.get(phone)
+    # Проверяем код (верный код удаляется из хранилища, неверный - увеличивает счетчик попыток)
+    result = verification_codes.check(phone, code)
     
-    if not stored:
+    if result == CodeCheck.missing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Код не был запрошен для этого номера"
         )
     
-    # Проверяем, не истек ли код
-    if datetime.now() > stored["expires_at"]:
-        del sms_codes_storage[phone]
+    if result == CodeCheck.expired:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Код истек. Запросите новый код."
         )
     
-    # Проверяем совпадение кода
-    if stored["code"] != code:
+    if result == CodeCheck.too_many_attempts:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много неверных попыток. Запросите новый код."
+        )
+    
+    if result == CodeCheck.wrong:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный код"
         )
     
-    # Код верный - удаляем из хранилища
-    del sms_codes_storage[phone]
-    
     # Для регистрации - просто возвращаем успех, не нужны токены
     if for_registration:
         return {"success": True, "message": "Код подтвержден"}
@@ -314,6 +269,8 @@ def login_for_access_token(
     # ВАЖНО: Мы используем `form_data.username` как `phone_number`
     # для аутентификации, т.к. OAuth2PasswordRequestForm
     # ожидает поле 'username' по стандарту.
+    # Подбор пароля к одному номеру с разных IP ограничен отдельно (RATE_LIMIT_LOGIN_PHONE)
+    check_limit("login_phone", normalize_phone(form_data.username))
     user = auth_service.authenticate_user(
         db=db, 
         phone_number=form_data.username, 
@@ -394,7 +351,7 @@ def logout(
     
     После этого:
     - Refresh токен больше не будет работать
-    - Access токен продолжит работать до истечения (15 мин)
+    - Access токен этой сессии тоже перестает работать (реестр отозванных сессий)
     """
     session = session_service.validate_refresh_token(db, token_request.refresh_token)
     
@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Body
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, object_session
+from typing import List, Optional
+from datetime import datetime
 
 from app.db import database, models, schemas
 from app.api.deps import get_current_active_user
-from app.services import chat_service
+from app.services import chat_service, message_service, purge_service
 
 router = APIRouter(
     prefix="/v1/chats",
@@ -19,7 +23,17 @@ def _format_chat_response(chat: models.Chat, current_user_id: int) -> schemas.Ch
     - Private: Имя = Имя собеседника, Аватар = Аватар собеседника.
     - Group: Имя = Название группы, Аватар = Аватар группы.
     """
-    participants = [link.user for link in chat.participant_links]
+    is_supergroup = chat.chat_type == models.ChatTypeEnum.supergroup
+    if is_supergroup and "participant_links" in inspect(chat).unloaded:
+        # Не грузим тысячи участников ради одной своей записи (create / upgrade / avatar)
+        participants = []
+        my_link = object_session(chat).query(models.ChatParticipant).filter_by(
+            chat_id=chat.id, user_id=current_user_id
+        ).first()
+    else:
+        links = chat.participant_links
+        participants = [] if is_supergroup else [link.user for link in links]
+        my_link = next((link for link in links if link.user_id == current_user_id), None)
     
     # 1. По умолчанию берем данные из самой группы (для Group)
     display_name = chat.chat_name
@@ -36,6 +50,7 @@ def _format_chat_response(chat: models.Chat, current_user_id: int) -> schemas.Ch
             display_name = "Неизвестный"
 
     # Формируем список участников с актуальным онлайн-статусом из WebSocket менеджера
+    # (у супергрупп список не встраивается - GET /chats/{chat_id}/members)
     participants_list = []
     
     # Ленивый импорт внутри функции или в начале файла (лучше в начале, но тут уже есть импорт в конце файла)
@@ -47,13 +62,28 @@ def _format_chat_response(chat: models.Chat, current_user_id: int) -> schemas.Ch
         p_dto.is_online = manager.is_user_online(p.id)
         participants_list.append(p_dto)
 
+    # Превью последнего сообщения (скрываем, если пользователь очистил историю у себя)
+    last_message = None
+    last_msg = chat.last_message
+    if last_msg and not (my_link and my_link.last_cleared_at and last_msg.sent_at <= my_link.last_cleared_at):
+        last_message = schemas.LastMessagePreview(
+            id=last_msg.id,
+            sender_id=last_msg.sender_id,
+            message_type=last_msg.message_type,
+            content=message_service.make_snippet(last_msg.content),
+            sent_at=last_msg.sent_at
+        )
+
     return schemas.Chat(
         id=chat.id,
         chat_type=chat.chat_type,
         chat_name=display_name,   # Итоговое имя
         avatar_url=display_avatar, # Итоговая аватарка
         owner_id=chat.owner_id,
-        participants=participants_list
+        participants=participants_list,
+        member_count=chat.member_count if is_supergroup else len(participants),
+        last_message=last_message,
+        last_activity_at=chat.last_activity_at
     )
 
 
@@ -79,13 +109,23 @@ def create_group_chat(
     return _format_chat_response(new_chat, current_user.id)
 
 
-# 3. ПОЛУЧИТЬ СПИСОК (С правильными именами)
+# 3. ПОЛУЧИТЬ СПИСОК (С правильными именами, по активности)
 @router.get("/", response_model=List[schemas.Chat])
 def get_my_chats(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before_activity: Optional[datetime] = None, # last_activity_at последнего чата предыдущей страницы
+    before_id: Optional[int] = None,            # id последнего чата предыдущей страницы
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(database.get_db)
 ):
-    chats = chat_service.get_user_chats(db, user_id=current_user.id)
+    """
+    Список чатов, отсортированный по последней активности.
+    Без limit возвращает все чаты (совместимость со старыми клиентами).
+    """
+    chats = chat_service.get_user_chats(
+        db, user_id=current_user.id,
+        limit=limit, before_activity=before_activity, before_id=before_id
+    )
     # Применяем форматирование ко всем чатам
     return [_format_chat_response(chat, current_user.id) for chat in chats]
 
@@ -109,27 +149,90 @@ def upload_group_avatar(
 
 
 @router.post("/{chat_id}/users", status_code=status.HTTP_201_CREATED)
-def add_user(
+async def add_user(
+    chat_id: int,
+    user_id: Optional[int] = None, # Один пользователь: ?user_id=... (старые клиенты)
+    body: Optional[schemas.ChatAddUsers] = Body(None), # Пачка: {"user_ids": [...]}
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """Добавить пользователя (или сразу нескольких) в группу."""
+    if body is None and user_id is None:
+        raise HTTPException(422, "Передайте user_id или user_ids")
+
+    def _add():
+        # Работа с БД блокирующая - уводим ее из event loop
+        if body is not None:
+            added = chat_service.add_users_to_chat(db, chat_id, body.user_ids, requester_id=current_user.id)
+        else:
+            chat_service.add_user_to_chat(db, chat_id, user_id, requester_id=current_user.id)
+            added = [user_id]
+        if not added:
+            return added, []
+        chat = chat_service.get_active_chat(db, chat_id)
+        return added, message_service.get_broadcast_recipients(db, chat)
+
+    added, recipients = await asyncio.to_thread(_add)
+    if added:
+        await manager.broadcast({
+            "type": "chat_members_added",
+            "chat_id": chat_id,
+            "user_ids": added,
+            "added_by": current_user.id
+        }, recipients)
+    return {"message": "User added successfully", "added_user_ids": added}
+
+@router.get("/{chat_id}/members", response_model=List[schemas.UserPublic])
+def get_members(
     chat_id: int,
-    user_id: int, # Кого добавляем (передаем через Query параметр ?user_id=...)
+    limit: int = Query(100, ge=1, le=500),
+    after_user_id: int = 0,  # Курсор: id последнего участника предыдущей страницы
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(database.get_db)
 ):
-    """Добавить пользователя в группу."""
-    chat_service.add_user_to_chat(db, chat_id, user_id, requester_id=current_user.id)
-    return {"message": "User added successfully"}
+    """Участники чата постранично (для супергрупп список не встраивается в чат)."""
+    from app.services.connection_manager import manager
+
+    links = chat_service.get_chat_members(db, chat_id, current_user.id, limit, after_user_id)
+    result = []
+    for link in links:
+        dto = schemas.UserPublic.model_validate(link.user)
+        dto.is_online = manager.is_user_online(link.user_id)
+        result.append(dto)
+    return result
+
+@router.post("/{chat_id}/upgrade", response_model=schemas.Chat)
+def upgrade_to_supergroup(
+    chat_id: int,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """Превратить группу в супергруппу (только владелец)."""
+    chat = chat_service.upgrade_to_supergroup(db, chat_id, current_user.id)
+    return _format_chat_response(chat, current_user.id)
 
 @router.delete("/{chat_id}/users/{target_user_id}", status_code=status.HTTP_200_OK)
-def remove_user(
+async def remove_user(
     chat_id: int,
     target_user_id: int,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(database.get_db)
 ):
     """Удалить участника (или выйти самому)."""
-    chat_service.remove_user_from_chat(
-        db, chat_id, user_id_to_remove=target_user_id, requester_id=current_user.id
-    )
+    def _remove():
+        chat_service.remove_user_from_chat(
+            db, chat_id, user_id_to_remove=target_user_id, requester_id=current_user.id
+        )
+        chat = chat_service.get_active_chat(db, chat_id)
+        return message_service.get_broadcast_recipients(db, chat) if chat else []
+
+    members = await asyncio.to_thread(_remove)
+    await manager.broadcast({
+        "type": "chat_member_removed",
+        "chat_id": chat_id,
+        "user_id": target_user_id,
+        "removed_by": current_user.id
+    }, members + [target_user_id])
     return {"message": "User removed/left"}
 
 @router.put("/{chat_id}/users/{user_id}/nickname", status_code=status.HTTP_200_OK)
@@ -173,22 +276,23 @@ async def delete_chat_endpoint(
     """
     Удалить чат целиком.
     - for_everyone=false (default): Удалить у себя (выйти).
-    - for_everyone=true: Удалить у всех (удалить чат физически).
+    - for_everyone=true: Удалить у всех. Чат скрывается сразу, данные удаляются
+      в фоне (прогресс: GET /chats/{chat_id}/purge).
     """
-    affected_users = chat_service.delete_chat(db, chat_id, current_user.id, for_everyone)
+    affected_users, purge_job = chat_service.delete_chat(db, chat_id, current_user.id, for_everyone)
+    purge_job_id = purge_job.id if purge_job else None
     
     # Отправляем уведомления
     notify_payload = {
         "type": "chat_deleted",
         "chat_id": chat_id,
-        "for_everyone": for_everyone
+        "for_everyone": for_everyone,
+        "purge_job_id": purge_job_id
     }
     
-    for uid in affected_users:
-        if manager.is_user_online(uid):
-            await manager.send_personal_message(notify_payload, uid)
+    await manager.broadcast(notify_payload, affected_users)
             
-    return {"message": "Chat deleted"}
+    return {"message": "Chat deleted", "purge_job_id": purge_job_id}
 
 
 @router.delete("/{chat_id}/messages", status_code=status.HTTP_200_OK)
@@ -201,21 +305,54 @@ async def clear_history_endpoint(
     """
     Очистить историю сообщений.
     - for_everyone=false: Скрыть старые сообщения только для себя.
-    - for_everyone=true: Удалить сообщения физически.
+    - for_everyone=true: Скрыть сообщения у всех сразу и удалить их в фоне
+      (прогресс: GET /chats/{chat_id}/purge).
     """
-    affected_users = chat_service.clear_chat_history(db, chat_id, current_user.id, for_everyone)
+    affected_users, purge_job = chat_service.clear_chat_history(db, chat_id, current_user.id, for_everyone)
+    purge_job_id = purge_job.id if purge_job else None
     
     notify_payload = {
         "type": "chat_history_cleared",
         "chat_id": chat_id,
-        "for_everyone": for_everyone
+        "for_everyone": for_everyone,
+        "purge_job_id": purge_job_id
     }
     
-    for uid in affected_users:
-        if manager.is_user_online(uid):
-            await manager.send_personal_message(notify_payload, uid)
+    await manager.broadcast(notify_payload, affected_users)
             
-    return {"message": "History cleared"}
+    return {"message": "History cleared", "purge_job_id": purge_job_id}
+
+@router.get("/{chat_id}/pinned", response_model=List[schemas.Message])
+def get_pinned_messages(
+    chat_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,  # Курсор: id самого старого полученного сообщения
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """Закрепленные сообщения чата (от новых к старым)."""
+    return message_service.get_pinned_messages(db, chat_id, current_user.id, limit, before_id)
+
+@router.get("/{chat_id}/media", response_model=List[schemas.Message])
+def get_chat_media(
+    chat_id: int,
+    type: models.MessageTypeEnum = Query(models.MessageTypeEnum.image),
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """Медиа-галерея чата: ?type=image|video|audio|file, пагинация курсором before_id."""
+    return message_service.get_chat_media(db, chat_id, current_user.id, type, limit, before_id)
+
+@router.get("/{chat_id}/purge", response_model=List[schemas.PurgeJobInfo])
+def get_purge_progress(
+    chat_id: int,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """Прогресс фоновой очистки истории / удаления чата (последние задачи)."""
+    return purge_service.get_chat_purge_jobs(db, chat_id, current_user.id)
 
 @router.delete("/{chat_id}/avatar", response_model=schemas.Chat)
 def delete_group_avatar(
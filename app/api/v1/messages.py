@@ -1,6 +1,6 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, UploadFile, File, HTTPException
 from sqlalchemy.orm import Session
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from pydantic import ValidationError
 import uuid
 import os
@@ -10,6 +10,7 @@ from app.db import database, schemas, models
 from app.services import message_service, user_service, notification_service, chat_service
 from app.services.connection_manager import manager
 from app.core import security
+from app.core.revocation import session_revocations
 from app.api.deps import get_current_active_user
 
 router = APIRouter(
@@ -22,6 +23,9 @@ def get_user_from_token(token: str, db: Session):
     """Проверяет токен из URL и возвращает user_id."""
     try:
         payload = security.verify_and_decode_token(token)
+        if session_revocations.is_revoked(payload):
+            print(f"❌ ОШИБКА АВТОРИЗАЦИИ WEBSOCKET: сессия {payload.session_id} завершена")
+            return None
         return payload.user_id
     except Exception as e:
         print(f"❌ ОШИБКА АВТОРИЗАЦИИ WEBSOCKET: {e}")
@@ -50,8 +54,70 @@ async def broadcast_status_change(db: Session, user_id: int, is_online: bool):
         "is_online": is_online
     }
     
-    for rid in recipient_ids:
-        await manager.send_personal_message(payload, rid)
+    await manager.broadcast(payload, recipient_ids)
+
+
+def _chat_recipients(db: Session, chat_id: int) -> List[int]:
+    """Получатели событий чата (в супергруппе - только онлайн-участники)."""
+    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    return message_service.get_broadcast_recipients(db, chat) if chat else []
+
+
+def _push_body(msg: models.Message) -> str:
+    """Текст пуша зависит от типа сообщения."""
+    if msg.message_type == models.MessageTypeEnum.text:
+        try:
+            return msg.content.decode('utf-8')
+        except:
+            return "Текст"
+    elif msg.message_type == models.MessageTypeEnum.image:
+        return "📷 Изображение"
+    elif msg.message_type == models.MessageTypeEnum.file:
+        return "📁 Файл"
+    elif msg.message_type == models.MessageTypeEnum.audio:
+        return "🎤 Голосовое сообщение"
+    return "Новое сообщение"
+
+
+async def deliver_new_message(db: Session, new_msg: models.Message, response_data: dict):
+    """
+    Рассылка нового сообщения (WS + Push).
+    Супергруппа: WS только онлайн-участникам, пуш - через PushBatcher (склейка по чату).
+    Остальные чаты: WS и пуш каждому участнику.
+    """
+    chat = new_msg.chat
+    sender_id = new_msg.sender_id
+    recipient_ids = message_service.get_broadcast_recipients(db, chat)
+
+    # 1. WebSocket (мгновенно, одна сериализация на всех)
+    await manager.broadcast(response_data, recipient_ids)
+
+    # Получаем инфо об отправителе для Пуша
+    sender = db.query(models.User).filter(models.User.id == sender_id).first()
+    sender_name = f"{sender.first_name} {sender.last_name or ''}".strip()
+    push_body = _push_body(new_msg)
+
+    # 2. Push-уведомления (кроме отправителя)
+    if chat.chat_type == models.ChatTypeEnum.supergroup:
+        notification_service.push_batcher.add(
+            chat.id, title=chat.chat_name or sender_name, body=f"{sender_name}: {push_body}",
+            sender_id=sender_id, message_id=new_msg.id
+        )
+        return
+
+    # Не будим пушем тех, кто заблокировал отправителя (сообщение в группе они все равно видят)
+    blockers = user_service.get_blockers_among(db, sender_id, recipient_ids) \
+        if chat.chat_type == models.ChatTypeEnum.group else set()
+
+    for pid in recipient_ids:
+        if pid != sender_id and pid not in blockers:
+            # Отправляем пуш (Fire-and-forget)
+            notification_service.send_push_to_user(
+                db, pid, 
+                title=sender_name, 
+                body=push_body,
+                data={"chat_id": str(new_msg.chat_id)}
+            )
 
 
 # 🔵 HTTP Эндпоинт: Загрузка истории
@@ -60,10 +126,11 @@ def get_chat_history(
     chat_id: int,
     limit: int = 50,
     offset: int = 0,
+    before_id: Optional[int] = None, # Курсор: id самого старого полученного сообщения
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(database.get_db)
 ):
-    return message_service.get_chat_history(db, chat_id, current_user.id, limit, offset)
+    return message_service.get_chat_history(db, chat_id, current_user.id, limit, offset, before_id)
 
 
 # 🔵 HTTP Эндпоинт: Детали прочтения
@@ -164,17 +231,7 @@ async def websocket_endpoint(
                     )
 
                     # Формируем ответ для WebSocket
-                    # Получаем данные ответа на сообщение если есть
-                    reply_to_data = None
-                    if new_msg.reply_to_id:
-                        replied_msg = db.query(models.Message).filter(models.Message.id == new_msg.reply_to_id).first()
-                        if replied_msg:
-                            reply_to_data = {
-                                "id": replied_msg.id,
-                                "content": replied_msg.content.decode('utf-8') if isinstance(replied_msg.content, bytes) else replied_msg.content,
-                                "sender_id": replied_msg.sender_id
-                            }
-                    
+                    # Превью цитаты уже сохранено в сообщении (без запроса исходного)
                     response_data = {
                         "type": "new_message",
                         "id": new_msg.id,
@@ -185,44 +242,12 @@ async def websocket_endpoint(
                         "sent_at": new_msg.sent_at.isoformat(),
                         "status": "sent",
                         "reply_to_id": new_msg.reply_to_id,
-                        "reply_to": reply_to_data,
+                        "reply_to": new_msg.reply_to,
                         "is_edited": new_msg.is_edited
                     }
 
-                    participant_ids = message_service.get_chat_participants(db, chat_id=new_msg.chat_id)
-                    
-                    # Получаем инфо об отправителе для Пуша
-                    sender = db.query(models.User).filter(models.User.id == user_id).first()
-                    sender_name = f"{sender.first_name} {sender.last_name or ''}".strip()
-
                     # Рассылка (WS + Push)
-                    for pid in participant_ids:
-                        # 1. WebSocket (мгновенно)
-                        await manager.send_personal_message(response_data, pid)
-                        
-                        # 2. Push-уведомление (если это не мы сами)
-                        if pid != user_id:
-                            # Текст пуша зависит от типа
-                            push_body = "Новое сообщение"
-                            if new_msg.message_type == models.MessageTypeEnum.text:
-                                try:
-                                    push_body = new_msg.content.decode('utf-8')
-                                except:
-                                    push_body = "Текст"
-                            elif new_msg.message_type == models.MessageTypeEnum.image:
-                                push_body = "📷 Изображение"
-                            elif new_msg.message_type == models.MessageTypeEnum.file:
-                                push_body = "📁 Файл"
-                            elif new_msg.message_type == models.MessageTypeEnum.audio:
-                                push_body = "🎤 Голосовое сообщение"
-
-                            # Отправляем пуш (Fire-and-forget)
-                            notification_service.send_push_to_user(
-                                db, pid, 
-                                title=sender_name, 
-                                body=push_body,
-                                data={"chat_id": str(new_msg.chat_id)}
-                            )
+                    await deliver_new_message(db, new_msg, response_data)
                         
                 except Exception as e:
                     # Если ошибка (например, ЧС), отправляем её только отправителю
@@ -242,10 +267,16 @@ async def websocket_endpoint(
                         "user_id": user_id,
                         "last_read_id": msg_id
                     }
-                    parts = message_service.get_chat_participants(db, chat_id=chat_id)
-                    for pid in parts:
-                        # Broadcast to EVERYONE (including self) to sync read status across devices
-                        await manager.send_personal_message(read_notification, pid)
+                    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+                    if chat and chat.chat_type == models.ChatTypeEnum.supergroup:
+                        # Супергруппа: watermark получают только свои устройства и автор сообщения
+                        # (если он онлайн), остальные участники события не видят
+                        author_id = db.query(models.Message.sender_id).filter(models.Message.id == msg_id).scalar()
+                        parts = [user_id] + ([author_id] if author_id else [])
+                    else:
+                        # ЛС и группы: всем участникам (включая себя - синхронизация между устройствами)
+                        parts = message_service.get_chat_participants(db, chat_id=chat_id)
+                    await manager.broadcast(read_notification, parts)
 
 
             # === 3. РЕДАКТИРОВАНИЕ (EDIT) ===
@@ -260,7 +291,7 @@ async def websocket_endpoint(
                     if isinstance(msg_id, float): msg_id = int(msg_id)
                     if isinstance(new_text, str): new_text = new_text.encode('utf-8')
 
-                    updated_msg = message_service.update_message(db, msg_id, user_id, new_text)
+                    updated_msg = message_service.update_message(db, msg_id, user_id, new_text, data.get("chat_id"))
                     
                     if updated_msg:
                         edit_notify = {
@@ -269,9 +300,7 @@ async def websocket_endpoint(
                             "message_id": updated_msg.id,
                             "new_content": updated_msg.content.decode('utf-8')
                         }
-                        parts = message_service.get_chat_participants(db, chat_id=updated_msg.chat_id)
-                        for pid in parts:
-                            await manager.send_personal_message(edit_notify, pid)
+                        await manager.broadcast(edit_notify, _chat_recipients(db, updated_msg.chat_id))
                     else:
                         await websocket.send_json({"error": "Edit failed: Not found or forbidden"})
                 
@@ -288,7 +317,7 @@ async def websocket_endpoint(
                         
                     if isinstance(msg_id, float): msg_id = int(msg_id)
 
-                    msg_obj = db.query(models.Message).filter(models.Message.id == msg_id).first()
+                    msg_obj = message_service.get_mutable_message(db, msg_id, data.get("chat_id"))
 
                     if msg_obj and msg_obj.sender_id == user_id:
                         target_chat_id = msg_obj.chat_id
@@ -300,9 +329,7 @@ async def websocket_endpoint(
                                 "chat_id": target_chat_id,
                                 "message_id": msg_id
                             }
-                            parts = message_service.get_chat_participants(db, chat_id=target_chat_id)
-                            for pid in parts:
-                                await manager.send_personal_message(delete_notify, pid)
+                            await manager.broadcast(delete_notify, _chat_recipients(db, target_chat_id))
                     else:
                          await websocket.send_json({"error": "Delete failed: Not found or forbidden"})
 
@@ -320,7 +347,7 @@ async def websocket_endpoint(
                          
                     if isinstance(msg_id, float): msg_id = int(msg_id)
 
-                    success = message_service.pin_message(db, msg_id, user_id, is_pinned)
+                    success = message_service.pin_message(db, msg_id, user_id, is_pinned, data.get("chat_id"))
                     
                     if success:
                         msg_obj = db.query(models.Message).filter(models.Message.id == msg_id).first()
@@ -330,9 +357,7 @@ async def websocket_endpoint(
                             "message_id": msg_id,
                             "is_pinned": is_pinned
                         }
-                        parts = message_service.get_chat_participants(db, msg_obj.chat_id)
-                        for pid in parts:
-                            await manager.send_personal_message(pin_notify, pid)
+                        await manager.broadcast(pin_notify, _chat_recipients(db, msg_obj.chat_id))
                     else:
                         await websocket.send_json({"error": "Pin failed"})
                         
@@ -346,13 +371,13 @@ async def websocket_endpoint(
     except WebSocketDisconnect:
         manager.disconnect(websocket, user_id)
         # При разрыве соединения сразу ставим статус "Офлайн"
-        user_service.update_last_seen(db, user_id, force_offline=True)
+        user_service.update_last_seen(user_id, force_offline=True)
         # 📢 Уведомляем всех, что мы ОФЛАЙН
         await broadcast_status_change(db, user_id, is_online=False)
         
     except Exception as e:
         print(f"WebSocket Error: {e}")
         manager.disconnect(websocket, user_id)
-        user_service.update_last_seen(db, user_id, force_offline=True)
+        user_service.update_last_seen(user_id, force_offline=True)
         # 📢 Уведомляем всех, что мы ОФЛАЙН
         await broadcast_status_change(db, user_id, is_online=False)
\ No newline at end of file
@@ -13,6 +13,24 @@ router = APIRouter(
     tags=["Users"]
 )
 
+@router.get("", response_model=schemas.UserBatch)
+def read_users_by_ids(
+    ids: str = Query(..., description="ID через запятую: 1,2,3"),
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Профили нескольких пользователей одним запросом (вместо GET /users/{id} на каждого).
+    Порядок - как в запросе; ненайденные id - в not_found.
+    """
+    try:
+        user_ids = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "ids: ожидаются целые числа через запятую")
+
+    users, not_found = user_service.get_users_by_ids(db, user_ids)
+    return {"users": users, "not_found": not_found}
+
 @router.get("/me", response_model=schemas.UserPublic)
 def read_users_me(
     current_user: models.User = Depends(get_current_active_user)
@@ -101,6 +119,41 @@ def search_for_users(
     # Для каждого найденного проверяем онлайн статус через свойство is_online
     return users
 
+@router.get("/autocomplete", response_model=List[schemas.UserPublic])
+def autocomplete_users(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Автодополнение юзернейма при наборе "@ali".
+    Только префикс username (без нечеткого поиска) - отвечает из индекса в памяти.
+    """
+    return user_service.autocomplete_usernames(
+        db,
+        prefix=prefix,
+        exclude_user_id=current_user.id,
+        limit=limit
+    )
+
+@router.post("/contacts/sync", response_model=List[schemas.ContactMatch])
+def sync_contacts(
+    sync_data: schemas.ContactSyncRequest,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Синхронизация адресной книги: до CONTACT_SYNC_MAX_NUMBERS номеров (или их SHA-256 хешей)
+    за один вызов. Возвращает только найденные контакты.
+    """
+    return user_service.sync_contacts(
+        db,
+        user_id=current_user.id,
+        phone_numbers=sync_data.phone_numbers,
+        phone_hashes=sync_data.phone_hashes
+    )
+
 @router.get("/{user_id}", response_model=schemas.UserPublic)
 def read_user_by_id(
     user_id: int, 
@@ -0,0 +1,108 @@
+"""
+Буфер отметок активности (write-behind).
+
+Отметки "пользователь активен" (users.last_seen_at) и "сессия использована"
+(user_sessions.last_used_at) приходят на каждый запрос и каждый refresh.
+Вместо UPDATE + COMMIT на каждую отметку в памяти хранится последнее значение
+на пользователя / сессию, а задача планировщика раз в
+ACTIVITY_FLUSH_INTERVAL_SECONDS пишет все накопленное одной транзакцией
+(и еще раз при остановке приложения).
+
+Чтения статуса (User.is_online, last_seen_at / last_used_at в ответах API)
+сначала смотрят в буфер, поэтому отложенная запись не видна клиентам.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном executemany при сбросе
+FLUSH_CHUNK_SIZE = 1000
+
+
+class ActivityBuffer:
+    def __init__(self):
+        self._users: Dict[int, datetime] = {}     # user_id -> last_seen_at
+        self._sessions: Dict[int, datetime] = {}  # session_id -> last_used_at
+        # То, что сейчас пишется в БД (еще не закоммичено) - видно чтениям
+        self._flushing_users: Dict[int, datetime] = {}
+        self._flushing_sessions: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    # --- Запись отметок ---
+
+    def touch_user(self, user_id: int, at: Optional[datetime] = None):
+        """Запоминает last_seen_at (последняя отметка побеждает, в т.ч. сдвиг в прошлое при офлайне)."""
+        with self._lock:
+            self._users[user_id] = at or datetime.utcnow()
+
+    def touch_session(self, session_id: int, at: Optional[datetime] = None):
+        with self._lock:
+            self._sessions[session_id] = at or datetime.utcnow()
+
+    # --- Чтение ---
+
+    def last_seen(self, user_id: int) -> Optional[datetime]:
+        with self._lock:
+            return self._users.get(user_id) or self._flushing_users.get(user_id)
+
+    def last_used(self, session_id: int) -> Optional[datetime]:
+        with self._lock:
+            return self._sessions.get(session_id) or self._flushing_sessions.get(session_id)
+
+    def pending_count(self) -> int:
+        return len(self._users) + len(self._sessions)
+
+    # --- Сброс в БД ---
+
+    def flush(self) -> int:
+        """Пишет накопленные отметки одной транзакцией (задача планировщика). Возвращает число строк."""
+        with self._lock:
+            users, self._users = self._users, {}
+            sessions, self._sessions = self._sessions, {}
+            self._flushing_users, self._flushing_sessions = users, sessions
+        if not users and not sessions:
+            return 0
+
+        from app.db import database, models
+
+        db = database.SessionLocal()
+        try:
+            for table, column, values in (
+                (models.User.__table__, "last_seen_at", users),
+                (models.UserSession.__table__, "last_used_at", sessions),
+            ):
+                # Core executemany: строки, удаленные за это время, просто не обновятся
+                stmt = update(table).where(table.c.id == bindparam("row_id")).values(
+                    {column: bindparam("at")}
+                )
+                items = list(values.items())
+                for i in range(0, len(items), FLUSH_CHUNK_SIZE):
+                    db.execute(stmt, [
+                        {"row_id": row_id, "at": at} for row_id, at in items[i:i + FLUSH_CHUNK_SIZE]
+                    ])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка сброса отметок активности: {e}")
+            with self._lock:
+                # Возвращаем в буфер все, что не перезаписано более свежими отметками
+                for user_id, at in users.items():
+                    self._users.setdefault(user_id, at)
+                for session_id, at in sessions.items():
+                    self._sessions.setdefault(session_id, at)
+            return 0
+        finally:
+            db.close()
+            with self._lock:
+                self._flushing_users, self._flushing_sessions = {}, {}
+
+        return len(users) + len(sessions)
+
+
+# Синглтон, который импортируется во всем приложении
+activity_buffer = ActivityBuffer()
@@ -1,31 +1,105 @@
+"""
+Фильтр Блума юзернеймов с сохранением на диск.
+
+Состояние на диске - снимок (username_filter.bloom, ~1.8 МБ) и журнал
+добавленных юзернеймов (username_filter.bloom.journal). Регистрация дописывает
+в журнал одну короткую запись (O(1) вместо перезаписи всего фильтра), а
+задача планировщика compact() переносит журнал в новый снимок.
+
+Устойчивость к сбоям:
+- снимок пишется во временный файл и атомарно подменяется (os.replace);
+- запись журнала - [длина, crc32, байты]; оборванная при сбое последняя запись
+  при загрузке отбрасывается, журнал обрезается до последней целой;
+- повторное применение записей безопасно (добавление в фильтр идемпотентно),
+  поэтому сбой между записью снимка и обрезкой журнала ничего не портит.
+Журнал дописывают все воркеры (O_APPEND), доступ к нему сериализует flock
+(на Windows fcntl нет - там журнал защищает только блокировка внутри процесса).
+
+Файлы лежат в BLOOM_DATA_DIR и открываются в main.lifespan (open()), а не при
+импорте: до этого фильтр живет только в памяти и ничего не пишет на диск.
+"""
 from pybloom_live import BloomFilter
-from typing import List
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
 import os
 import logging
+import struct
+import threading
+import zlib
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Константы для нашего фильтра
 EXPECTED_USERNAMES = 1_000_000
 FALSE_POSITIVE_RATE = 0.001
-FILTER_FILEPATH = "username_filter.bloom"
+FILTER_FILENAME = "username_filter.bloom"
+JOURNAL_SUFFIX = ".journal"
+
+# Заголовок записи журнала: длина юзернейма в байтах, crc32 байтов
+JOURNAL_RECORD = struct.Struct(">HI")
+
+
+def _journal_record(item_bytes: bytes) -> bytes:
+    return JOURNAL_RECORD.pack(len(item_bytes), zlib.crc32(item_bytes)) + item_bytes
+
+
+def _parse_journal(data: bytes) -> Tuple[List[bytes], int]:
+    """Записи журнала и длина целой части (после нее - оборванная при сбое запись)."""
+    items, offset = [], 0
+    while offset + JOURNAL_RECORD.size <= len(data):
+        length, crc = JOURNAL_RECORD.unpack_from(data, offset)
+        start = offset + JOURNAL_RECORD.size
+        item = data[start:start + length]
+        if len(item) < length or zlib.crc32(item) != crc:
+            break
+        items.append(item)
+        offset = start + length
+    return items, offset
 
 
 class BloomFilterService:
-    def __init__(self, filepath: str = FILTER_FILEPATH):
-        self.filepath = filepath
+    def __init__(self, filename: str = FILTER_FILENAME):
+        self.filename = filename
+        self.filepath: Optional[str] = None
+        self.journal_path: Optional[str] = None
         self.filter: BloomFilter
+        self._journal_fd: Optional[int] = None  # None - файлы еще не открыты (open())
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()  # flock не разделяет потоки с общим fd
+        self._create_new()
+
+    def open(self, data_dir: str):
+        """Загружает снимок и журнал из data_dir и открывает журнал на дозапись (при старте)."""
+        os.makedirs(data_dir, exist_ok=True)
+        self.filepath = os.path.join(data_dir, self.filename)
+        self.journal_path = self.filepath + JOURNAL_SUFFIX
 
         # Попытка загрузить фильтр из файла
         if os.path.exists(self.filepath):
             try:
                 with open(self.filepath, 'rb') as f:
-                    self.filter = BloomFilter.fromfile(f)
+                    bloom = BloomFilter.fromfile(f)
+                with self._lock:
+                    self.filter = bloom
                 logging.info(f"Фильтр Блума загружен из {self.filepath}.")
             except Exception as e:
                 logging.warning(f"Ошибка загрузки фильтра {self.filepath}: {e}. Создаем новый.")
-                self._create_new()
         else:
             logging.info("Файл фильтра Блума не найден. Создаем новый.")
-            self._create_new()
+
+        # Журнал открыт на дозапись все время работы: одна запись - один write()
+        self._journal_fd = os.open(self.journal_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._replay_journal()
+
+    def close(self):
+        fd, self._journal_fd = self._journal_fd, None
+        if fd is not None:
+            os.close(fd)
 
     def _create_new(self):
         """Вспомогательный метод для создания пустого фильтра."""
@@ -35,23 +109,100 @@ class BloomFilterService:
             error_rate=FALSE_POSITIVE_RATE
         )
 
+    @contextmanager
+    def _journal_locked(self):
+        """Эксклюзивный доступ к журналу: потоки этого процесса и (где есть fcntl) другие воркеры."""
+        with self._journal_lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._journal_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._journal_fd, fcntl.LOCK_UN)
+
+    def _replay_journal(self):
+        """Применяет журнал поверх снимка (при старте); оборванный хвост обрезает."""
+        with self._journal_locked():
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+            items, valid_length = _parse_journal(data)
+            if valid_length < len(data):
+                logging.warning(
+                    f"Журнал фильтра Блума: отброшено {len(data) - valid_length} байт оборванной записи."
+                )
+                os.ftruncate(self._journal_fd, valid_length)
+
+        for item in items:
+            self.filter.add(item)
+        if items:
+            logging.info(f"Из журнала фильтра Блума применено записей: {len(items)}.")
+
+    def _write_snapshot(self, bloom: BloomFilter):
+        """Пишет снимок во временный файл и атомарно подменяет старый."""
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            bloom.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+
     def _save(self):
-        """Сохраняет состояние фильтра в файл."""
+        """Сохраняет весь фильтр в снимок и очищает журнал (после полной синхронизации)."""
+        if self._journal_fd is None:
+            return
         try:
-            with open(self.filepath, 'wb') as f:
-                self.filter.tofile(f)
+            with self._journal_locked():
+                with self._lock:
+                    snapshot = self.filter.copy()
+                self._write_snapshot(snapshot)
+                os.ftruncate(self._journal_fd, 0)
         except Exception as e:
             logging.error(f"Не удалось сохранить фильтр Блума: {e}")
 
     def add(self, item: str):
-        """Добавляет юзернейм в фильтр и сохраняет на диск."""
+        """Добавляет юзернейм в фильтр и дописывает его в журнал (одна короткая запись)."""
         if not item:
             return
 
         item_bytes = item.encode('utf-8')
-        if item_bytes not in self.filter:
+        with self._lock:
+            if item_bytes in self.filter:
+                return
             self.filter.add(item_bytes)
-            self._save()  # Сохраняем при каждом добавлении
+        if self._journal_fd is None:
+            return
+
+        try:
+            with self._journal_locked():
+                os.write(self._journal_fd, _journal_record(item_bytes))
+        except Exception as e:
+            # Фильтр все равно пересобирается из БД при старте - потеря записи не критична
+            logging.error(f"Не удалось записать юзернейм в журнал фильтра Блума: {e}")
+
+    def compact(self) -> int:
+        """
+        Задача планировщика: переносит журнал в новый снимок, если он вырос
+        больше BLOOM_JOURNAL_MAX_BYTES. Возвращает число перенесенных записей.
+        В снимок попадают и записи других воркеров - они берутся из журнала.
+        """
+        if self._journal_fd is None or os.fstat(self._journal_fd).st_size < settings.BLOOM_JOURNAL_MAX_BYTES:
+            return 0
+
+        with self._journal_locked():
+            with open(self.journal_path, 'rb') as f:
+                items, _ = _parse_journal(f.read())
+            with self._lock:
+                snapshot = self.filter.copy()
+            for item in items:
+                snapshot.add(item)
+            self._write_snapshot(snapshot)
+            # Снимок уже на диске: сбой после этой точки оставит журнал, который безопасно применить повторно
+            os.ftruncate(self._journal_fd, 0)
+
+        logging.info(f"Журнал фильтра Блума перенесен в снимок, записей: {len(items)}.")
+        return len(items)
 
     def contains(self, item: str) -> bool:
         """Проверяет, *возможно* ли юзернейм в фильтре."""
@@ -66,15 +217,17 @@ class BloomFilterService:
         """
         logging.info(f"Синхронизация {len(usernames)} юзернеймов в фильтр Блума...")
 
-        self.filter = BloomFilter(
+        bloom = BloomFilter(
             capacity=max(len(usernames) * 2, EXPECTED_USERNAMES),
             error_rate=FALSE_POSITIVE_RATE
         )
 
         for username in usernames:
             if username:
-                self.filter.add(username.encode('utf-8'))
+                bloom.add(username.encode('utf-8'))
 
+        with self._lock:
+            self.filter = bloom
         self._save()
         logging.info("Синхронизация фильтра Блума завершена.")
 
@@ -0,0 +1,61 @@
+"""
+LRU-кэш с временем жизни записей (TTL) в памяти процесса.
+
+Используется для горячих чтений, которые повторяются на каждый запрос
+(например, пользователь из токена в deps.get_current_user). Кэш локален для
+процесса: явная инвалидация действует только в нем, поэтому TTL должен быть
+коротким - он ограничивает устаревание данных в остальных воркерах.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: V, ttl_seconds: Optional[float] = None):
+        """ttl_seconds - собственный срок записи (не больше общего TTL кэша)."""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
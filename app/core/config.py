@@ -21,6 +21,87 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15  # 15 минут для access токена
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30    # 30 дней для refresh токена
 
+    # --- Архив старых сообщений (cold storage) ---
+    ARCHIVE_DIR: str = "archive"              # Каталог сегментных файлов
+    ARCHIVE_HORIZON_DAYS: int = 180           # Сообщения старше - уходят в архив
+    ARCHIVE_BATCH_SIZE: int = 1000            # Сообщений за одну транзакцию
+    ARCHIVE_INTERVAL_SECONDS: int = 3600      # Период запуска архиватора/компактора
+
+    # --- Фоновая очистка истории / удаление чатов ---
+    PURGE_BATCH_SIZE: int = 1000              # Строк за одну транзакцию
+    PURGE_MAX_BATCHES_PER_RUN: int = 50       # Пачек за один запуск воркера
+    PURGE_INTERVAL_SECONDS: int = 2
+
+    # --- Супергруппы ---
+    SUPERGROUP_MAX_MEMBERS: int = 200_000
+    PUSH_BATCH_INTERVAL_SECONDS: int = 3      # Окно склейки пушей (одно уведомление на чат за окно)
+
+    # --- Планировщик и обслуживание БД (app/core/scheduler.py, app/services/maintenance_service.py) ---
+    SCHEDULER_JITTER_RATIO: float = 0.1       # Интервал задачи +-10%, чтобы воркеры не стартовали разом
+    MAINTENANCE_INTERVAL_SECONDS: int = 3600
+    MAINTENANCE_BATCH_SIZE: int = 1000        # Строк в одной транзакции DELETE
+    MAINTENANCE_MAX_BATCHES: int = 100        # Пачек одной таблицы за запуск (остальное - в следующий раз)
+    USER_DEVICE_STALE_DAYS: int = 90          # FCM токены без активности дольше - удаляются
+    ORPHAN_UPLOAD_GRACE_HOURS: int = 24       # Файлы моложе не трогаем (загрузка могла еще не закоммититься)
+
+    # --- Фильтр Блума юзернеймов (app/core/bloom_filter.py) ---
+    BLOOM_DATA_DIR: str = "data"               # Снимок и журнал фильтра (username_filter.bloom*)
+    BLOOM_COMPACT_INTERVAL_SECONDS: int = 300  # Как часто проверяется размер журнала
+    BLOOM_JOURNAL_MAX_BYTES: int = 256 * 1024  # Журнал больше - переносится в новый снимок
+
+    # --- Кэши в памяти процесса ---
+    USER_CACHE_TTL_SECONDS: int = 30          # Строка пользователя для зависимостей авторизации
+    USER_CACHE_MAX_SIZE: int = 50_000
+    BLOCK_CACHE_TTL_SECONDS: int = 300        # Черный список пользователя (обновляется при block/unblock)
+    BLOCK_CACHE_MAX_SIZE: int = 100_000
+    BLOCK_CACHE_SYNC_INTERVAL_SECONDS: int = 5  # Как часто подтягиваются блокировки, сделанные в других воркерах
+    USER_INDEX_SYNC_INTERVAL_SECONDS: int = 5   # Как часто индекс поиска подтягивает регистрации и правки профилей
+    TOKEN_CACHE_MAX_SIZE: int = 100_000       # Проверенные access токены (живут до своего exp)
+
+    # --- Реестр отозванных сессий (app/core/revocation.py) ---
+    REVOCATION_SYNC_INTERVAL_SECONDS: int = 5  # Как часто подтягиваются отзывы, сделанные другими воркерами
+
+    # --- Хеширование паролей (Argon2, app/core/password_pool.py) ---
+    ARGON2_TIME_COST: int = 3                 # Проходов по памяти
+    ARGON2_MEMORY_COST_KIB: int = 65536       # Память на один хеш (64 МБ)
+    ARGON2_PARALLELISM: int = 4               # Потоков внутри одного хеша
+    PASSWORD_HASH_WORKERS: int = 2            # Процессов в пуле (0 - считать в потоке запроса)
+    PASSWORD_HASH_MAX_PENDING: int = 16       # Паролей в работе и в очереди; сверх лимита - 503
+    PASSWORD_HASH_TIMEOUT_SECONDS: int = 10
+
+    # --- SMS коды подтверждения (app/core/verification_codes.py) ---
+    VERIFICATION_CODE_BACKEND: str = "database"         # "database" - общий для воркеров, "memory" - один процесс
+    VERIFICATION_CODE_TTL_SECONDS: int = 300
+    VERIFICATION_CODE_MAX_ATTEMPTS: int = 5             # Неверных вводов до сброса кода
+    VERIFICATION_CODE_SWEEP_INTERVAL_SECONDS: int = 60  # Удаление истекших кодов
+
+    # --- Ограничение частоты запросов (app/api/rate_limits.py) ---
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"        # "shared" - общая память для всех воркеров машины
+    RATE_LIMIT_SHARED_SLOTS: int = 65_536     # Ведер в сегменте одного правила (для "shared")
+    # Правила "N/секунд": N запросов подряд, ведро пополняется до полного за указанное время
+    RATE_LIMIT_LOGIN_IP: str = "30/60"        # /auth/token с одного IP
+    RATE_LIMIT_LOGIN_PHONE: str = "10/600"    # Попытки входа в один номер
+    RATE_LIMIT_SEND_CODE_IP: str = "10/600"   # /auth/send-code с одного IP
+    RATE_LIMIT_SEND_CODE_PHONE: str = "3/300"  # SMS на один номер
+    RATE_LIMIT_VERIFY_CODE_IP: str = "30/600"  # /auth/verify-code с одного IP
+    RATE_LIMIT_SEARCH: str = "60/60"          # /users/search и /users/check-username на пользователя (аноним - IP)
+
+    # --- Местоположение сессий (app/core/geoip.py) ---
+    GEOIP_DB_PATH: str = "data/geoip.bin"     # Собирается: python -m app.core.geoip <dbip-lite.csv> data/geoip.bin
+
+    # --- Временные статусы ---
+    STATUS_EXPIRY_TICK_SECONDS: int = 5       # Как часто снимаются истекшие статусы
+    STATUS_EXPIRY_DB_SYNC_SECONDS: int = 30   # Как часто очередь подтягивает сроки, поставленные в других воркерах
+
+    # --- Синхронизация контактов ---
+    CONTACT_SYNC_MAX_NUMBERS: int = 5000      # Номеров (и хешей) за один вызов
+    CONTACT_SYNC_RATE_LIMIT: int = 10         # Вызовов на пользователя за окно
+    CONTACT_SYNC_RATE_WINDOW_SECONDS: int = 3600
+
+    # --- Отметки активности (write-behind, app/core/activity.py) ---
+    ACTIVITY_FLUSH_INTERVAL_SECONDS: int = 5  # last_seen_at / last_used_at пишутся в БД пачкой раз в N секунд
+
     @computed_field
     @property
     def DATABASE_URL(self) -> str:
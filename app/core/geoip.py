@@ -0,0 +1,156 @@
+"""
+Офлайн-определение местоположения по IP (для списка сессий).
+
+Раньше локация запрашивалась у ip-api.com прямо внутри логина (до 2 секунд
+ожидания внешнего сервиса). Теперь используется локальная база диапазонов,
+открытая через mmap: поиск - бинарный поиск по отсортированным записям,
+без сети и без загрузки файла в память целиком.
+
+Формат файла (все числа big-endian):
+    заголовок:  MAGIC (8 байт), число записей (uint32), смещение таблицы строк (uint32)
+    записи:     начало диапазона (16 байт), конец (16 байт), смещение строки локации (uint32)
+    строки:     длина (uint16) + UTF-8 ("Moscow, RU")
+IPv4 хранится как IPv4-mapped IPv6 (::ffff:a.b.c.d), поэтому адреса
+обоих семейств сравниваются как 16-байтные строки.
+
+Файл собирается из CSV базы DB-IP Lite (https://db-ip.com/db/lite.php, CC BY 4.0):
+    python -m app.core.geoip dbip-city-lite.csv data/geoip.bin
+"""
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DGEOIP1\0"
+HEADER = struct.Struct(">8sII")
+RECORD = struct.Struct(">16s16sI")
+STRING_LEN = struct.Struct(">H")
+
+
+def _ip_key(ip: str) -> Optional[bytes]:
+    """IP-адрес -> 16 байт для сравнения (None для некорректной строки)."""
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b"\0" * 10 + b"\xff\xff" + address.packed)
+    return address.packed
+
+
+class GeoIPDatabase:
+    def __init__(self):
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._count = 0
+        self._strings_offset = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._mm is not None
+
+    def load(self, path: str) -> int:
+        """Открывает файл базы (при старте). Возвращает число диапазонов."""
+        file = open(path, "rb")
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            file.close()
+            raise
+        magic, count, strings_offset = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            file.close()
+            raise ValueError(f"{path}: не файл базы GeoIP")
+
+        with self._lock:
+            old_mm, old_file = self._mm, self._file
+            self._file, self._mm = file, mm
+            self._count, self._strings_offset = count, strings_offset
+        if old_mm is not None:
+            old_mm.close()
+            old_file.close()
+        return count
+
+    def lookup(self, ip: Optional[str]) -> Optional[str]:
+        """Локация ("Moscow, RU") или None, если адрес не найден / база не загружена."""
+        mm = self._mm
+        key = _ip_key(ip) if ip else None
+        if mm is None or key is None:
+            return None
+
+        # Последний диапазон с началом <= key
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            if mm[offset:offset + 16] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        _, end, string_offset = RECORD.unpack_from(mm, HEADER.size + (lo - 1) * RECORD.size)
+        if key > end:
+            return None
+        position = self._strings_offset + string_offset
+        (length,) = STRING_LEN.unpack_from(mm, position)
+        start = position + STRING_LEN.size
+        return mm[start:start + length].decode("utf-8") or None
+
+
+def build_database(csv_path: str, out_path: str) -> int:
+    """
+    Собирает файл базы из CSV DB-IP Lite:
+    country-lite - ip_start,ip_end,country; city-lite - ip_start,ip_end,continent,country,region,city,...
+    """
+    strings: Dict[str, int] = {}
+    table = bytearray()
+    records: List[Tuple[bytes, bytes, int]] = []
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            start, end = _ip_key(row[0]), _ip_key(row[1])
+            if start is None or end is None:
+                continue  # Заголовок или мусорная строка
+            country = row[2] if len(row) < 6 else row[3]
+            city = row[5] if len(row) >= 6 else ""
+            location = f"{city}, {country}" if city and country else city or country
+
+            if location not in strings:
+                encoded = location.encode("utf-8")[:0xFFFF]
+                strings[location] = len(table)
+                table += STRING_LEN.pack(len(encoded)) + encoded
+            records.append((start, end, strings[location]))
+
+    records.sort()
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(records), HEADER.size + len(records) * RECORD.size))
+        for start, end, string_offset in records:
+            out.write(RECORD.pack(start, end, string_offset))
+        out.write(table)
+    os.replace(tmp_path, out_path)
+    return len(records)
+
+
+# Синглтон, который импортируется во всем приложении
+geoip = GeoIPDatabase()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Использование: python -m app.core.geoip <dbip-lite.csv> <geoip.bin>")
+        sys.exit(1)
+    print(f"Диапазонов: {build_database(sys.argv[1], sys.argv[2])}")
@@ -0,0 +1,133 @@
+"""
+Хеширование и проверка паролей (Argon2) в отдельном пуле процессов.
+
+Argon2 намеренно дорогой (десятки миллисекунд CPU и десятки МБ памяти на
+вызов). В общем threadpool FastAPI волна логинов занимает все потоки и
+тормозит остальные sync-эндпоинты, а из-за GIL еще и сам event loop.
+Поэтому вычисления уходят в пул из PASSWORD_HASH_WORKERS процессов, а число
+паролей в работе и в очереди ограничено PASSWORD_HASH_MAX_PENDING: сверх
+лимита запрос сразу получает 503, а не ждет, удерживая поток threadpool.
+
+Параметры Argon2 задаются в настройках (ARGON2_*). Хеши со старыми
+параметрами пересчитываются при успешном входе (verify_and_update).
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_password_context() -> CryptContext:
+    # deprecated="auto": хеши со старыми параметрами/схемой помечаются как требующие пересчета
+    return CryptContext(
+        schemes=["argon2"],
+        deprecated="auto",
+        argon2__time_cost=settings.ARGON2_TIME_COST,
+        argon2__memory_cost=settings.ARGON2_MEMORY_COST_KIB,
+        argon2__parallelism=settings.ARGON2_PARALLELISM,
+    )
+
+
+# Контекст своего процесса (в воркерах пула создается при первом вызове)
+_context: Optional[CryptContext] = None
+
+
+def _get_context() -> CryptContext:
+    global _context
+    if _context is None:
+        _context = make_password_context()
+    return _context
+
+
+# --- Функции, которые выполняются в процессах пула (должны быть на уровне модуля) ---
+
+def _hash(password: str) -> str:
+    return _get_context().hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return _get_context().verify_and_update(password, hashed_password)
+
+
+def _overloaded() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервер перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
+
+
+class PasswordHashPool:
+    def __init__(self, workers: int, max_pending: int, timeout_seconds: float):
+        self.workers = workers                  # 0 - считать в вызывающем потоке (без пула)
+        self.timeout_seconds = timeout_seconds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, а не fork: у приложения уже есть потоки (планировщик, загрузка индексов)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+
+        # Очередь ограничена: при перегрузке отказываем сразу, не занимая поток ожиданием
+        if not self._slots.acquire(blocking=False):
+            raise _overloaded()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Слот освобождается, когда задача действительно завершилась (или отменена), а не
+        # по таймауту ожидания: иначе процессы продолжали бы хешировать сверх лимита
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except TimeoutError:
+            future.cancel()  # Еще в очереди - отменится и освободит слот сразу
+            raise _overloaded()
+        except BrokenProcessPool:
+            # Воркер упал (например, OOM) - пересоздадим пул при следующем вызове
+            logger.error("Пул хеширования паролей сломан, пересоздаем")
+            with self._lock:
+                self._executor = None
+            raise _overloaded()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(пароль верный, новый хеш или None, если параметры хеша актуальны)."""
+        return self._run(_verify_and_update, password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Синглтон, который импортируется во всем приложении
+password_pool = PasswordHashPool(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    timeout_seconds=settings.PASSWORD_HASH_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,49 @@
+"""
+Нормализация телефонных номеров.
+
+Номер хранится в users.phone_number в том виде, в каком его ввели при
+регистрации ("+7 (912) 345-67-89"), а для поиска и сравнения используется
+users.phone_digits - цифры в формате E.164 без "+" ("79123456789").
+"""
+import hashlib
+from typing import List, Optional
+
+# E.164: не больше 15 цифр вместе с кодом страны
+E164_MAX_DIGITS = 15
+
+
+def normalize_phone(raw: Optional[str]) -> str:
+    """
+    "+7 (912) 345-67-89", "8 912 345 67 89", "79123456789" -> "79123456789".
+    Российский/казахстанский префикс 8 в 11-значном номере заменяется на код страны 7.
+    Для строки без цифр возвращает "".
+    """
+    if not raw:
+        return ""
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    return digits
+
+
+def hash_phone(phone_digits: str) -> str:
+    """SHA-256 (hex) нормализованного номера - так клиент может прислать контакты без самих номеров."""
+    return hashlib.sha256(phone_digits.encode("ascii")).hexdigest()
+
+
+def is_valid_phone(raw: Optional[str]) -> bool:
+    return 0 < len(normalize_phone(raw)) <= E164_MAX_DIGITS
+
+
+def phone_prefixes(raw: Optional[str]) -> List[str]:
+    """
+    Префиксы для поиска по phone_digits LIKE 'prefix%'.
+    Неполный номер с 8 в начале ("8916") может быть набран с внутренним
+    префиксом - ищем и с кодом страны 7.
+    """
+    digits = normalize_phone(raw)
+    if not digits:
+        return []
+    if digits[0] == "8" and len(digits) < 11:
+        return [digits, "7" + digits[1:]]
+    return [digits]
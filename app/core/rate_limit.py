@@ -0,0 +1,168 @@
+"""
+Ограничение частоты запросов (token bucket).
+
+У каждого ключа (например, user_id) есть "ведро" на capacity токенов, которое
+равномерно пополняется до полного за per_seconds. Запрос тратит cost токенов;
+если их не хватает - отказ с временем до следующей попытки.
+
+RateLimiter - ведра в памяти процесса (лимит на воркер).
+SharedRateLimiter - ведра в разделяемой памяти: один лимит на всех воркеров
+одной машины (uvicorn --workers N), без внешних сервисов. Только для Unix:
+fcntl и shared_memory импортируются при создании, поэтому на Windows модуль
+(и бэкенд "memory") работает, а ошибка будет только при выборе "shared".
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+
+def parse_rate(spec: str) -> Tuple[int, float]:
+    """"20/60" -> (20, 60.0): 20 запросов, ведро пополняется до полного за 60 секунд."""
+    capacity, _, per_seconds = spec.partition("/")
+    return int(capacity), float(per_seconds)
+
+
+class RateLimiter:
+    def __init__(self, capacity: int, per_seconds: float, max_keys: int = 100_000):
+        self.capacity = capacity
+        self.refill_rate = capacity / per_seconds  # Токенов в секунду
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def hit(self, key: Hashable, cost: float = 1) -> float:
+        """Списывает cost токенов. Возвращает 0, если запрос разрешен, иначе - секунд до повторной попытки."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.capacity), now]
+                # Самые давно не использованные ключи - уже полные ведра, их можно забыть
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / self.refill_rate
+
+    def reset(self, key: Hashable):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class SharedRateLimiter:
+    """
+    Тот же token bucket, но ведра лежат в сегменте shared memory ("dialect_rl_<name>"),
+    который открывают все воркеры. Ключ -> 8-байтный отпечаток (blake2b), слот ищется
+    в группе из PROBE_SLOTS слотов; если группа занята, вытесняется самое давнее ведро.
+    Группы защищены блокировками диапазонов байт (fcntl) в файле рядом с сегментом.
+
+    Сегмент переживает перезапуск воркеров (лимиты не сбрасываются при деплое).
+    """
+    SLOT = struct.Struct("<Qdd")  # отпечаток ключа (0 - пусто), токены, время обновления
+    PROBE_SLOTS = 8
+    LOCK_STRIPES = 256
+
+    def __init__(self, name: str, capacity: int, per_seconds: float, slots: int = 65_536):
+        try:
+            import fcntl
+        except ImportError:
+            raise RuntimeError(
+                'RATE_LIMIT_BACKEND="shared" доступен только на Unix (нужен fcntl), используйте "memory"'
+            ) from None
+        self._fcntl = fcntl
+        self.capacity = capacity
+        self.refill_rate = capacity / per_seconds
+        self.groups = max(1, slots // self.PROBE_SLOTS)
+        size = self.groups * self.PROBE_SLOTS * self.SLOT.size
+        self._shm = _open_shared_memory(f"dialect_rl_{name}", size)
+        self._buf = self._shm.buf
+        self._lock_fd = os.open(
+            os.path.join(tempfile.gettempdir(), f"dialect_rl_{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600
+        )
+        # Блокировки fcntl принадлежат процессу, между потоками одного процесса нужна своя
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(key: Hashable) -> int:
+        digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") | 1
+
+    def hit(self, key: Hashable, cost: float = 1) -> float:
+        """Списывает cost токенов. Возвращает 0, если запрос разрешен, иначе - секунд до повторной попытки."""
+        fingerprint = self._fingerprint(key)
+        group = fingerprint % self.groups
+        stripe = group % self.LOCK_STRIPES
+        base = group * self.PROBE_SLOTS * self.SLOT.size
+        slot, unpack_from, pack_into = self.SLOT.size, self.SLOT.unpack_from, self.SLOT.pack_into
+
+        # CLOCK_MONOTONIC общий для всех процессов машины
+        now = time.monotonic()
+        with self._thread_lock:
+            self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_EX, 1, stripe)
+            try:
+                target, tokens, oldest_at = None, float(self.capacity), None
+                for offset in range(base, base + self.PROBE_SLOTS * slot, slot):
+                    slot_fingerprint, slot_tokens, updated_at = unpack_from(self._buf, offset)
+                    if slot_fingerprint == fingerprint:
+                        target = offset
+                        tokens = min(self.capacity, slot_tokens + (now - updated_at) * self.refill_rate)
+                        break
+                    # Пустой слот или самое давнее ведро (скорее всего уже полное) - кандидат на замену
+                    if slot_fingerprint == 0:
+                        updated_at = float("-inf")
+                    if oldest_at is None or updated_at < oldest_at:
+                        target, oldest_at = offset, updated_at
+
+                if tokens >= cost:
+                    pack_into(self._buf, target, fingerprint, tokens - cost, now)
+                    return 0.0
+                pack_into(self._buf, target, fingerprint, tokens, now)
+                return (cost - tokens) / self.refill_rate
+            finally:
+                self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_UN, 1, stripe)
+
+    def reset(self, key: Hashable):
+        fingerprint = self._fingerprint(key)
+        group = fingerprint % self.groups
+        stripe = group % self.LOCK_STRIPES
+        base = group * self.PROBE_SLOTS * self.SLOT.size
+        with self._thread_lock:
+            self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_EX, 1, stripe)
+            try:
+                for offset in range(base, base + self.PROBE_SLOTS * self.SLOT.size, self.SLOT.size):
+                    if self.SLOT.unpack_from(self._buf, offset)[0] == fingerprint:
+                        self.SLOT.pack_into(self._buf, offset, 0, 0.0, 0.0)
+            finally:
+                self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_UN, 1, stripe)
+
+
+def _open_shared_memory(name: str, size: int):
+    """Создает сегмент или подключается к уже созданному другим воркером."""
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.size < size:
+            # Сегмент остался от запуска с другим RATE_LIMIT_SHARED_SLOTS - пересоздаем
+            shm.close()
+            shm.unlink()
+            return _open_shared_memory(name, size)
+    # Сегмент общий: не даем resource_tracker удалить его при выходе первого же процесса
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
@@ -0,0 +1,125 @@
+"""
+Реестр отозванных сессий в памяти процесса.
+
+Access токен живет ACCESS_TOKEN_EXPIRE_MINUTES и несет session_id ("sid").
+Чтобы отозванная сессия переставала работать сразу, а не через 15 минут,
+каждый авторизованный запрос сверяется с реестром за O(1), без запроса к БД:
+
+- множество отозванных session_id (revoke_session, выход, вход с того же устройства);
+- "не раньше" на пользователя для revoke_all_sessions: токены, выпущенные
+  до этого момента ("iat"), недействительны, кроме токенов сохраненной сессии.
+
+Запись нужна только пока живут выпущенные до отзыва токены, поэтому через
+ACCESS_TOKEN_EXPIRE_MINUTES она удаляется. При старте реестр загружается из
+БД, а задача планировщика подтягивает отзывы, сделанные другими воркерами
+(по user_sessions.revoked_at).
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db import database, models, schemas
+
+logger = logging.getLogger(__name__)
+
+# Запас на рассинхрон часов и незакоммиченные транзакции при синхронизации
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class SessionRevocations:
+    def __init__(self):
+        self._sessions: Dict[int, datetime] = {}                            # session_id -> revoked_at
+        self._not_before: Dict[int, Tuple[datetime, Optional[int]]] = {}    # user_id -> (момент, сохраненная сессия)
+        self._synced_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def _ttl() -> timedelta:
+        return timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    # --- Отзыв ---
+
+    def revoke(self, session_id: int, at: Optional[datetime] = None):
+        with self._lock:
+            self._sessions[session_id] = at or datetime.utcnow()
+
+    def revoke_all(self, user_id: int, except_session_id: Optional[int] = None, at: Optional[datetime] = None):
+        """Все токены пользователя, выпущенные до этого момента, кроме токенов except_session_id."""
+        # iat в токене - целые секунды: округляем вниз, чтобы не задеть токен новой сессии из той же секунды
+        moment = (at or datetime.utcnow()).replace(microsecond=0)
+        with self._lock:
+            self._not_before[user_id] = (moment, except_session_id)
+
+    # --- Проверка ---
+
+    def is_revoked(self, token_data: schemas.TokenData) -> bool:
+        with self._lock:
+            if token_data.session_id is not None and token_data.session_id in self._sessions:
+                return True
+            not_before = self._not_before.get(token_data.user_id)
+        if not_before is None:
+            return False
+        moment, except_session_id = not_before
+        if except_session_id is not None and token_data.session_id == except_session_id:
+            return False
+        # Токен без iat (выпущен до появления этого поля) считаем старым
+        return token_data.issued_at is None or token_data.issued_at < moment
+
+    # --- Загрузка и синхронизация с БД ---
+
+    def load(self, db: Session) -> int:
+        """Сессии, отозванные за последние ACCESS_TOKEN_EXPIRE_MINUTES (при старте)."""
+        now = datetime.utcnow()
+        since = now - self._ttl()
+        rows = db.query(models.UserSession.id, models.UserSession.revoked_at).filter(
+            models.UserSession.is_active == False,
+            or_(
+                models.UserSession.revoked_at >= since,
+                # Отозванные до появления revoked_at: момент неизвестен, держим как только что отозванные
+                (models.UserSession.revoked_at.is_(None)) & (models.UserSession.expires_at > now)
+            )
+        ).all()
+        with self._lock:
+            for session_id, revoked_at in rows:
+                self._sessions[session_id] = revoked_at or now
+            self._synced_at = now
+        return len(rows)
+
+    def sync(self) -> int:
+        """Задача планировщика: подтягивает отзывы из БД (другие воркеры) и чистит устаревшие записи."""
+        now = datetime.utcnow()
+        since = (self._synced_at or now - self._ttl()) - SYNC_OVERLAP
+        db = database.SessionLocal()
+        try:
+            rows = db.query(models.UserSession.id, models.UserSession.revoked_at).filter(
+                models.UserSession.is_active == False,
+                models.UserSession.revoked_at >= since
+            ).all()
+        finally:
+            db.close()
+
+        expired_before = now - self._ttl()
+        with self._lock:
+            for session_id, revoked_at in rows:
+                self._sessions.setdefault(session_id, revoked_at)
+            self._synced_at = now
+            # Токены, выпущенные до отзыва, к этому моменту уже истекли сами
+            self._sessions = {
+                session_id: at for session_id, at in self._sessions.items() if at >= expired_before
+            }
+            self._not_before = {
+                user_id: value for user_id, value in self._not_before.items() if value[0] >= expired_before
+            }
+        return len(rows)
+
+
+# Синглтон, который импортируется во всем приложении
+session_revocations = SessionRevocations()
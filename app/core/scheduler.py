@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0                             # Запуски, отданные другому воркеру (single_runner)
+    last_started_at: Optional[datetime] = None
+    last_duration_ms: Optional[float] = None
+    last_rows: Optional[int] = None              # Если задача вернула число обработанных строк
+    total_rows: int = 0
+    last_error: Optional[str] = None
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    interval_seconds: float
+    func: Callable
+    single_runner: bool = False
+    stats: JobStats = field(default_factory=JobStats)
+
+
+class Scheduler:
+    """
+    Простой планировщик фоновых задач внутри приложения.
+    Запускается и останавливается в main.lifespan.
+
+    Синхронные задачи выполняются в отдельном потоке (asyncio.to_thread),
+    чтобы не блокировать event loop. Асинхронные - прямо в loop.
+
+    Интервал каждый раз сдвигается на случайную долю (jitter_ratio), чтобы
+    задачи разных воркеров не стартовали одновременно. Задачи с
+    single_runner=True за один запуск выполняет только один воркер - тот, кто
+    взял именованную блокировку в БД (database.AdvisoryLock); остальные пропускают.
+    Блокировка снимается сразу после задачи, поэтому под ней проверяется еще и
+    время последнего запуска (таблица scheduled_job_runs): если другой воркер
+    запускал задачу меньше интервала (за вычетом jitter) назад, запуск пропускается.
+    """
+
+    def __init__(self, jitter_ratio: float = 0.1):
+        self.jitter_ratio = jitter_ratio
+        self._jobs: Dict[str, PeriodicJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(self, name: str, interval_seconds: float, func: Callable, single_runner: bool = False):
+        """Регистрирует периодическую задачу (до вызова start). Повторная регистрация заменяет задачу."""
+        self._jobs[name] = PeriodicJob(
+            name=name, interval_seconds=interval_seconds, func=func, single_runner=single_runner
+        )
+
+    def start(self):
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._run_forever(job), name=f"job:{job.name}"))
+        logger.info(f"Планировщик запущен, задач: {len(self._jobs)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def get_stats(self) -> List[dict]:
+        """Метрики задач (длительность, число строк, ошибки) для /health/jobs."""
+        return [
+            {"name": job.name, "interval_seconds": job.interval_seconds, "single_runner": job.single_runner,
+             **asdict(job.stats)}
+            for job in self._jobs.values()
+        ]
+
+    def _next_delay(self, job: PeriodicJob) -> float:
+        return job.interval_seconds * random.uniform(1 - self.jitter_ratio, 1 + self.jitter_ratio)
+
+    async def _run_forever(self, job: PeriodicJob):
+        while True:
+            await asyncio.sleep(self._next_delay(job))
+            try:
+                await self._run_once(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.stats.failures += 1
+                job.stats.last_error = str(e)[:255]
+                logger.exception(f"Ошибка в фоновой задаче '{job.name}'")
+
+    def _claim_run(self, job: PeriodicJob) -> bool:
+        """Под блокировкой: отмечает запуск, если задачу давно никто не запускал."""
+        from app.db import database, models
+
+        now = datetime.utcnow()
+        min_gap = timedelta(seconds=job.interval_seconds * (1 - self.jitter_ratio))
+        db = database.SessionLocal()
+        try:
+            run = db.query(models.ScheduledJobRun).filter(models.ScheduledJobRun.name == job.name).first()
+            if run is None:
+                db.add(models.ScheduledJobRun(name=job.name, last_started_at=now))
+            elif now - run.last_started_at < min_gap:
+                return False
+            else:
+                run.last_started_at = now
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    async def _run_once(self, job: PeriodicJob):
+        lock = None
+        if job.single_runner:
+            from app.db.database import AdvisoryLock
+
+            lock = AdvisoryLock(f"job:{job.name}")
+            if not await asyncio.to_thread(lock.acquire):
+                job.stats.skipped += 1
+                return
+
+        try:
+            if lock is not None and not await asyncio.to_thread(self._claim_run, job):
+                job.stats.skipped += 1
+                return
+            await self._execute(job)
+        finally:
+            if lock is not None:
+                await asyncio.to_thread(lock.release)
+
+    async def _execute(self, job: PeriodicJob):
+        stats = job.stats
+        stats.last_started_at = datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                result = await job.func()
+            else:
+                result = await asyncio.to_thread(job.func)
+        finally:
+            stats.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            stats.runs += 1
+
+        if isinstance(result, int) and not isinstance(result, bool):
+            stats.last_rows = result
+            stats.total_rows += result
+
+
+# Синглтон, который импортируется во всем приложении
+scheduler = Scheduler(jitter_ratio=settings.SCHEDULER_JITTER_RATIO)
@@ -0,0 +1,324 @@
+"""
+Поисковый индекс пользователей в памяти процесса (триграммы).
+
+Вместо OR из LIKE '%...%' по четырем колонкам (полный скан users на каждое
+нажатие клавиши) поиск идет по постинг-листам триграмм:
+    триграмма -> отсортированный array[user_id]
+Кандидаты берутся из самого короткого постинг-листа запроса (от новых
+пользователей к старым) и проверяются бинарным поиском в списках других слов -
+большие списки частых триграмм целиком не обходятся. Затем каждый кандидат
+проверяется по реальным полям и ранжируется.
+
+Индекс строится при старте (в фоне, до готовности поиск идет старым SQL-путем)
+и обновляется при регистрации / изменении профиля, а изменения из других
+воркеров подтягивает задача планировщика (user_service.sync_user_indexes,
+по users.profile_updated_at). Запросы, где все слова короче 3 символов,
+индекс не обслуживает (search() возвращает None). Из постинг-листов при
+обновлении ничего не удаляется: устаревшие записи отсеиваются проверкой
+кандидата, а при накоплении изменений постинги перестраиваются из документов.
+"""
+import heapq
+import logging
+from bisect import bisect_left
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.phone import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Разделитель полей в документе (не встречается в именах)
+FIELD_SEP = "\x1f"
+# Перестраиваем постинги, когда устаревших записей стало больше этой доли
+REBUILD_STALE_RATIO = 0.2
+# Сколько совпадений ранжируем на один запрос. Для частых слов ("иван")
+# совпадают десятки тысяч пользователей - полная проверка стоила бы сотни
+# миллисекунд, а пользователь все равно уточнит запрос.
+# Точное совпадение username находится отдельно, мимо этого лимита.
+MAX_CANDIDATES = 2000
+# Если даже самый короткий список длинный (частые слова "иван петров"), его
+# сначала пересекаем со списком другого слова через set: иначе при редком
+# сочетании пришлось бы обойти его целиком с бинарным поиском на каждый id
+DIRECT_WALK_MAX = 20_000
+
+# Веса совпадений (на слово запроса берется лучшее совпадение)
+SCORE_QUERY_IS_USERNAME = 1000  # Весь запрос == username
+SCORE_USERNAME_EXACT = 100
+SCORE_USERNAME_PREFIX = 60
+SCORE_USERNAME_SUBSTRING = 30
+SCORE_NAME_EXACT = 80
+SCORE_NAME_PREFIX = 50
+SCORE_NAME_SUBSTRING = 20
+SCORE_PHONE_PREFIX = 50
+SCORE_PHONE_SUBSTRING = 30
+
+# (id, username, first_name, last_name, phone_number)
+UserRow = Tuple[int, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def normalize(text: Optional[str]) -> str:
+    """Нижний регистр, ё -> е: "Фёдор" и "федор" ищутся одинаково."""
+    if not text:
+        return ""
+    return text.lower().replace("ё", "е")
+
+
+def trigrams(text: str) -> Iterable[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _make_doc(row: UserRow) -> str:
+    _, username, first_name, last_name, phone = row
+    return FIELD_SEP.join((normalize(username), normalize(first_name), normalize(last_name), normalize_phone(phone)))
+
+
+def _doc_trigrams(doc: str) -> set:
+    result = set()
+    for field in doc.split(FIELD_SEP):
+        result.update(trigrams(field))
+    return result
+
+
+def _contains(posting: array, user_id: int) -> bool:
+    i = bisect_left(posting, user_id)
+    return i < len(posting) and posting[i] == user_id
+
+
+def _score_name_token(token: str, username: str, first_name: str, last_name: str) -> int:
+    best = 0
+    if username:
+        if username == token:
+            best = SCORE_USERNAME_EXACT
+        elif username.startswith(token):
+            best = SCORE_USERNAME_PREFIX
+        elif token in username:
+            best = SCORE_USERNAME_SUBSTRING
+    for name in (first_name, last_name):
+        if not name:
+            continue
+        if name == token:
+            best = max(best, SCORE_NAME_EXACT)
+        elif name.startswith(token):
+            best = max(best, SCORE_NAME_PREFIX)
+        elif token in name:
+            best = max(best, SCORE_NAME_SUBSTRING)
+    return best
+
+
+class UserSearchIndex:
+    def __init__(self):
+        self._docs: Dict[int, str] = {}
+        self._postings: Dict[str, array] = {}
+        self._by_username: Dict[str, int] = {}  # username -> id (точное совпадение)
+        self._posting_count = 0  # Всего записей в постингах
+        self._stale = 0          # Из них устаревших
+        self._lock = threading.RLock()
+        self._ready = False
+        self._loading = False
+        self._pending: List[UserRow] = []  # Изменения, пришедшие во время загрузки
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # --- Построение ---
+
+    def build(self, rows: Iterable[UserRow]):
+        """Полная перестройка индекса (при старте). Готовый индекс подменяется атомарно."""
+        with self._lock:
+            self._loading = True
+            self._pending = []
+
+        docs = {row[0]: _make_doc(row) for row in rows}
+        postings, posting_count = self._build_postings(docs)
+        by_username = {}
+        for user_id, doc in docs.items():
+            username = doc[:doc.index(FIELD_SEP)]
+            if username:
+                by_username[username] = user_id
+
+        with self._lock:
+            self._docs, self._postings, self._by_username = docs, postings, by_username
+            self._posting_count, self._stale = posting_count, 0
+            pending, self._pending = self._pending, []
+            self._loading = False
+            self._ready = True
+            for row in pending:
+                self._upsert(row)
+        logger.info(f"Поисковый индекс пользователей построен: {len(docs)} документов, {len(postings)} триграмм")
+
+    def load_from_db(self, session_factory: Callable):
+        """Строит индекс по таблице users (потоково, без загрузки ORM-объектов)."""
+        from app.db import models
+
+        db = session_factory()
+        try:
+            rows = db.query(
+                models.User.id, models.User.username, models.User.first_name,
+                models.User.last_name, models.User.phone_number
+            ).yield_per(10_000)
+            self.build(tuple(row) for row in rows)
+        except Exception:
+            with self._lock:
+                self._loading = False
+            logger.exception("Не удалось построить поисковый индекс пользователей (поиск останется на SQL)")
+        finally:
+            db.close()
+
+    # --- Обновление ---
+
+    def upsert(self, user) -> None:
+        """Добавляет / обновляет пользователя (models.User или UserRow)."""
+        row = user if isinstance(user, tuple) else (
+            user.id, user.username, user.first_name, user.last_name, user.phone_number
+        )
+        with self._lock:
+            if self._loading:
+                self._pending.append(row)
+            self._upsert(row)
+
+    def _upsert(self, row: UserRow):
+        user_id = row[0]
+        doc = _make_doc(row)
+        old_doc = self._docs.get(user_id)
+        if old_doc == doc:
+            return
+        old_grams = _doc_trigrams(old_doc) if old_doc is not None else set()
+        new_grams = _doc_trigrams(doc)
+
+        self._docs[user_id] = doc
+        old_username = old_doc[:old_doc.index(FIELD_SEP)] if old_doc is not None else ""
+        username = doc[:doc.index(FIELD_SEP)]
+        if old_username != username:
+            if old_username and self._by_username.get(old_username) == user_id:
+                del self._by_username[old_username]
+            if username:
+                self._by_username[username] = user_id
+        for gram in new_grams - old_grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array("i")
+            # Вставка с сохранением порядка (memmove внутри array)
+            i = bisect_left(posting, user_id)
+            if i == len(posting) or posting[i] != user_id:
+                posting.insert(i, user_id)
+                self._posting_count += 1
+        # Исчезнувшие триграммы остаются в постингах и отсеиваются проверкой
+        self._stale += len(old_grams - new_grams)
+
+        if self._stale > REBUILD_STALE_RATIO * self._posting_count:
+            self._postings, self._posting_count = self._build_postings(self._docs)
+            self._stale = 0
+
+    @staticmethod
+    def _build_postings(docs: Dict[int, str]) -> Tuple[Dict[str, array], int]:
+        postings: Dict[str, array] = {}
+        count = 0
+        for user_id in sorted(docs):
+            for gram in _doc_trigrams(docs[user_id]):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("i")
+                posting.append(user_id)
+                count += 1
+        return postings, count
+
+    # --- Поиск ---
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+        exclude_user_id: Optional[int] = None
+    ) -> Optional[List[int]]:
+        """
+        Возвращает ID пользователей по убыванию качества совпадения.
+        Запрос из цифр (3+) ищется по телефону, иначе - каждое слово по username / имени / фамилии.
+        None - в запросе нет слов из 3+ символов (без триграмм индекс их не найдет).
+        """
+        query = query.strip()
+        clean = normalize(query.lstrip("@"))
+        phone_query = normalize_phone(query)
+        is_phone = len(phone_query) >= 3 and all(ch.isdigit() or ch in "+-() " for ch in query)
+        tokens = [phone_query] if is_phone else clean.split()
+        if not tokens:
+            return []
+        if all(len(token) < 3 for token in tokens):
+            return None
+
+        with self._lock:
+            # 1. Для каждого слова - самый короткий постинг-лист его триграмм.
+            # Триграммы одного слова коррелируют ("пет" и "тро" в "петров"), поэтому
+            # пересекаем списки разных слов, а полное совпадение проверяет ранжирование.
+            postings = []
+            for token in tokens:
+                grams = trigrams(token)
+                if not grams:
+                    continue  # Слово короче 3 символов - проверяется только при ранжировании
+                token_postings = [self._postings.get(gram) for gram in grams]
+                if None in token_postings:
+                    return []
+                postings.append(min(token_postings, key=len))
+            postings.sort(key=len)
+            if len(postings[0]) <= DIRECT_WALK_MAX or len(postings) == 1:
+                candidates, others = reversed(postings[0]), postings[1:]
+            else:
+                candidates = sorted(set(postings[0]).intersection(postings[1]), reverse=True)
+                others = postings[2:]
+
+            # 2. Кандидаты от новых к старым, проверка по полям и ранжирование
+            scored = []
+            seen = set()
+            for user_id in candidates:
+                if not all(_contains(posting, user_id) for posting in others):
+                    continue
+                score = self._score_user(user_id, tokens, is_phone, clean, exclude_user_id)
+                if score:
+                    scored.append((score, -user_id))
+                    seen.add(user_id)
+                    if len(scored) >= MAX_CANDIDATES:
+                        break
+
+            # Точный username всегда в выдаче, даже если не попал в лимит
+            exact_id = None if is_phone else self._by_username.get(clean)
+            if exact_id is not None and exact_id not in seen:
+                score = self._score_user(exact_id, tokens, is_phone, clean, exclude_user_id)
+                if score:
+                    scored.append((score, -exact_id))
+
+        top = heapq.nlargest(offset + limit, scored)
+        return [-neg_id for _, neg_id in top[offset:]]
+
+    def _score_user(self, user_id, tokens, is_phone, clean, exclude_user_id) -> int:
+        if user_id == exclude_user_id:
+            return 0
+        doc = self._docs.get(user_id)
+        if doc is None:
+            return 0
+        username, first_name, last_name, phone = doc.split(FIELD_SEP)
+        return self._score(tokens, is_phone, clean, username, first_name, last_name, phone)
+
+    @staticmethod
+    def _score(tokens, is_phone, clean, username, first_name, last_name, phone) -> int:
+        if is_phone:
+            token = tokens[0]
+            if phone.startswith(token):
+                return SCORE_PHONE_PREFIX
+            return SCORE_PHONE_SUBSTRING if token in phone else 0
+
+        score = SCORE_QUERY_IS_USERNAME if username and username == clean else 0
+        for token in tokens:
+            token_score = _score_name_token(token, username, first_name, last_name)
+            if not token_score:
+                return 0  # Каждое слово запроса должно совпасть хотя бы с одним полем
+            score += token_score
+        return score
+
+
+# Синглтон, который импортируется во всем приложении
+user_search_index = UserSearchIndex()
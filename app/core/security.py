@@ -1,20 +1,22 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 import secrets
 import hashlib
+import time
 
 from jose import jwt, JWTError, ExpiredSignatureError
-from passlib.context import CryptContext
-
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.password_pool import make_password_context, password_pool
 from app.db import schemas # Нам нужна схема TokenData
 
 # --- 1. Настройка Хеширования Паролей ---
 
-# Мы используем bcrypt как основную схему.
+# Argon2 с параметрами из настроек (ARGON2_*).
 # deprecated="auto" означает, что passlib будет автоматически
-# обновлять хеши, если мы в будущем сменим алгоритм.
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# обновлять хеши, если мы в будущем сменим алгоритм или параметры.
+# Сами вычисления идут в пуле процессов (app/core/password_pool.py).
+pwd_context = make_password_context()
 
 
 # --- 2. Функции для работы с Паролями ---
@@ -24,7 +26,15 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Проверяет, что "чистый" пароль (от пользователя)
     соответствует хешу из базы данных.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_pool.verify_and_update(plain_password, hashed_password)[0]
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Как verify_password, но дополнительно возвращает новый хеш, если старый
+    посчитан с устаревшими параметрами Argon2 (иначе None).
+    """
+    return password_pool.verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
@@ -32,7 +42,7 @@ def get_password_hash(password: str) -> str:
     Создает хеш из "чистого" пароля.
     Вызывается только при регистрации или смене пароля.
     """
-    return pwd_context.hash(password)
+    return password_pool.hash(password)
 
 
 # --- 3. Функции для работы с JWT (JSON Web Tokens) ---
@@ -49,9 +59,11 @@ def create_access_token(user_id: int, session_id: int = None) -> str:
     # "sub" (subject) - это стандартное поле JWT для хранения
     # уникального идентификатора (ID пользователя).
     # "sid" - ID сессии для проверки отзыва
+    # "iat" - момент выпуска (для "выйти на всех устройствах")
     to_encode = {
         "sub": str(user_id),
         "sid": session_id,
+        "iat": datetime.utcnow(),
         "exp": expire
     }
     
@@ -80,6 +92,17 @@ def hash_refresh_token(token: str) -> str:
     return hashlib.sha256(token.encode()).hexdigest()
 
 
+# Кэш проверенных access токенов: sha256(токен) -> TokenData.
+# Клиент ходит с одним токеном до ACCESS_TOKEN_EXPIRE_MINUTES, поэтому
+# декодирование и проверка подписи нужны один раз; запись живет до exp токена.
+# Отзыв сессии кэш не обходит: проверка по реестру отзывов (app/core/revocation.py)
+# выполняется в deps на каждый запрос, кэшируется только результат jwt.decode.
+token_cache: TTLCache[schemas.TokenData] = TTLCache(
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    ttl_seconds=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+
+
 def verify_and_decode_token(token: str) -> schemas.TokenData:
     """
     Проверяет JWT токен и извлекает из него данные.
@@ -87,8 +110,15 @@ def verify_and_decode_token(token: str) -> schemas.TokenData:
     
     (Эту функцию будет использовать наш файл с зависимостями,
      чтобы получить "текущего пользователя".)
+
+    Уже проверенный токен берется из token_cache (до его exp) - возвращаемый
+    TokenData общий для всех запросов с этим токеном, менять его нельзя.
     """
-    
+    digest = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(digest)
+    if cached is not None:
+        return cached
+
     # decode() автоматически проверяет подпись (SECRET_KEY)
     # и время жизни (exp).
     payload = jwt.decode(
@@ -100,10 +130,21 @@ def verify_and_decode_token(token: str) -> schemas.TokenData:
     # Извлекаем ID пользователя из поля "sub"
     user_id_str: str = payload.get("sub")
     session_id: int = payload.get("sid")
+    iat = payload.get("iat")
     
     if user_id_str is None:
         # Этого не должно случиться, если мы правильно создаем токен
         raise JWTError("Token payload is missing 'sub' (user_id) claim")
         
     # Возвращаем Pydantic-схему с данными
-    return schemas.TokenData(user_id=int(user_id_str), session_id=session_id)
\ No newline at end of file
+    token_data = schemas.TokenData(
+        user_id=int(user_id_str),
+        session_id=session_id,
+        issued_at=datetime.utcfromtimestamp(iat) if iat is not None else None
+    )
+
+    # Токен без exp не кэшируем (create_access_token его всегда ставит)
+    exp = payload.get("exp")
+    if exp is not None:
+        token_cache.set(digest, token_data, ttl_seconds=exp - time.time())
+    return token_data
@@ -0,0 +1,385 @@
+"""
+Холодное хранилище архивных сообщений (cold storage).
+
+Каждый чат - отдельный каталог с append-only сегментами:
+    {ARCHIVE_DIR}/chat_{chat_id}/{first_id:020d}.{gen:04d}.seg - сжатые блоки сообщений
+    {ARCHIVE_DIR}/chat_{chat_id}/{first_id:020d}.{gen:04d}.idx - разреженный индекс (одна запись на блок)
+
+Блок = заголовок + zlib(записи сообщений). Индекс хранит (first_id, last_id, offset, count)
+каждого блока, поэтому поиск по id - это бинарный поиск по индексу и распаковка одного блока.
+Оба файла читаются через mmap.
+
+Компактор переписывает сегмент с мелкими блоками в новое поколение (gen + 1),
+после чего удаляет старое. Читатель всегда берет последнее поколение с готовым .idx.
+"""
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import zlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.db.models import MessageTypeEnum, MessageStatusEnum
+
+logger = logging.getLogger(__name__)
+
+BLOCK_MAGIC = b"DLSB"
+SEGMENT_VERSION = 2  # v2: превью ответа в записи; блоки v1 по-прежнему читаются
+# magic, version, count, compressed_len, first_id, last_id
+BLOCK_HEADER = struct.Struct("<4sBHIQQ")
+# first_id, last_id, offset, count
+INDEX_ENTRY = struct.Struct("<QQQI")
+# id, sender_id (-1 = нет), sent_at (unix time), type, status, flags, reply_to_id (0 = нет), content_len
+RECORD_V1 = struct.Struct("<QqdBBBQI")
+# v2: запись v1 + reply_sender_id (-1 = нет), reply_type (255 = нет), reply_flags, snippet_len;
+# после контента идет snippet (UTF-8)
+RECORD_V2 = struct.Struct("<QqdBBBQIqBBH")
+
+BLOCK_TARGET_MESSAGES = 256            # Сообщений в одном блоке
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024   # После этого размера начинаем новый сегмент
+COMPACT_MIN_FILL = 0.25                # Компактим сегмент, если блоки заполнены меньше чем на 25%
+
+FLAG_PINNED = 1
+FLAG_EDITED = 2
+
+REPLY_FLAG_DELETED = 1
+REPLY_TYPE_NONE = 255
+
+# Порядок значений Enum фиксирован: новые типы добавляются только в конец
+_TYPES = list(MessageTypeEnum)
+_STATUSES = list(MessageStatusEnum)
+
+_SEGMENT_RE = re.compile(r"^(\d{20})\.(\d{4})\.idx$")
+
+
+@dataclass
+class ArchivedMessage:
+    id: int
+    chat_id: int
+    sender_id: Optional[int]
+    sent_at: datetime
+    message_type: MessageTypeEnum
+    status: MessageStatusEnum
+    is_pinned: bool
+    is_edited: bool
+    reply_to_id: Optional[int]
+    content: bytes
+    # Превью сообщения, на которое отвечают (см. models.Message.reply_*)
+    reply_sender_id: Optional[int] = None
+    reply_message_type: Optional[MessageTypeEnum] = None
+    reply_snippet: Optional[str] = None
+    reply_deleted: bool = False
+
+
+def _to_unix(dt: datetime) -> float:
+    # В БД хранится "наивное" UTC-время
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _from_unix(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def _segment_base(chat_dir: str, first_id: int, gen: int) -> str:
+    return os.path.join(chat_dir, f"{first_id:020d}.{gen:04d}")
+
+
+class SegmentStore:
+    def __init__(self, root: str):
+        self.root = root
+        # Запись и компакция в рамках процесса идут последовательно
+        self._write_lock = threading.Lock()
+
+    # --- Пути и сегменты ---
+
+    def _chat_dir(self, chat_id: int) -> str:
+        return os.path.join(self.root, f"chat_{chat_id}")
+
+    def _list_segments(self, chat_dir: str) -> List[Tuple[int, int, str]]:
+        """Возвращает [(first_id, gen, base_path)] по возрастанию first_id, только последние поколения."""
+        try:
+            names = os.listdir(chat_dir)
+        except FileNotFoundError:
+            return []
+
+        latest = {}
+        for name in names:
+            match = _SEGMENT_RE.match(name)
+            if not match:
+                continue
+            first_id, gen = int(match.group(1)), int(match.group(2))
+            if gen >= latest.get(first_id, -1):
+                latest[first_id] = gen
+
+        return [
+            (first_id, gen, _segment_base(chat_dir, first_id, gen))
+            for first_id, gen in sorted(latest.items())
+        ]
+
+    def has_chat(self, chat_id: int) -> bool:
+        return os.path.isdir(self._chat_dir(chat_id))
+
+    def chat_size_bytes(self, chat_id: int) -> int:
+        chat_dir = self._chat_dir(chat_id)
+        total = 0
+        for _, _, base in self._list_segments(chat_dir):
+            total += os.path.getsize(base + ".seg") + os.path.getsize(base + ".idx")
+        return total
+
+    # --- Кодирование ---
+
+    @staticmethod
+    def _encode_block(messages: List[ArchivedMessage]) -> bytes:
+        parts = []
+        for m in messages:
+            flags = (FLAG_PINNED if m.is_pinned else 0) | (FLAG_EDITED if m.is_edited else 0)
+            content = m.content or b""
+            snippet = (m.reply_snippet or "").encode("utf-8")
+            parts.append(RECORD_V2.pack(
+                m.id,
+                m.sender_id if m.sender_id is not None else -1,
+                _to_unix(m.sent_at),
+                _TYPES.index(m.message_type),
+                _STATUSES.index(m.status),
+                flags,
+                m.reply_to_id or 0,
+                len(content),
+                m.reply_sender_id if m.reply_sender_id is not None else -1,
+                _TYPES.index(m.reply_message_type) if m.reply_message_type is not None else REPLY_TYPE_NONE,
+                REPLY_FLAG_DELETED if m.reply_deleted else 0,
+                len(snippet)
+            ))
+            parts.append(content)
+            parts.append(snippet)
+
+        payload = zlib.compress(b"".join(parts), 6)
+        header = BLOCK_HEADER.pack(
+            BLOCK_MAGIC, SEGMENT_VERSION, len(messages), len(payload), messages[0].id, messages[-1].id
+        )
+        return header + payload
+
+    @staticmethod
+    def _decode_block(buf, offset: int, chat_id: int) -> List[ArchivedMessage]:
+        magic, version, count, compressed_len, _, _ = BLOCK_HEADER.unpack_from(buf, offset)
+        if magic != BLOCK_MAGIC or version not in (1, SEGMENT_VERSION):
+            raise ValueError(f"Поврежденный блок архива чата {chat_id} (offset={offset})")
+
+        start = offset + BLOCK_HEADER.size
+        raw = zlib.decompress(buf[start:start + compressed_len])
+
+        result = []
+        pos = 0
+        for _ in range(count):
+            if version == 1:
+                msg_id, sender_id, sent_at, type_idx, status_idx, flags, reply_to_id, content_len = \
+                    RECORD_V1.unpack_from(raw, pos)
+                reply_sender_id, reply_type_idx, reply_flags, snippet_len = -1, REPLY_TYPE_NONE, 0, 0
+                pos += RECORD_V1.size
+            else:
+                (msg_id, sender_id, sent_at, type_idx, status_idx, flags, reply_to_id, content_len,
+                 reply_sender_id, reply_type_idx, reply_flags, snippet_len) = RECORD_V2.unpack_from(raw, pos)
+                pos += RECORD_V2.size
+            content = raw[pos:pos + content_len]
+            pos += content_len
+            snippet = raw[pos:pos + snippet_len].decode("utf-8", errors="ignore")
+            pos += snippet_len
+            result.append(ArchivedMessage(
+                id=msg_id,
+                chat_id=chat_id,
+                sender_id=sender_id if sender_id >= 0 else None,
+                sent_at=_from_unix(sent_at),
+                message_type=_TYPES[type_idx],
+                status=_STATUSES[status_idx],
+                is_pinned=bool(flags & FLAG_PINNED),
+                is_edited=bool(flags & FLAG_EDITED),
+                reply_to_id=reply_to_id or None,
+                content=content,
+                reply_sender_id=reply_sender_id if reply_sender_id >= 0 else None,
+                reply_message_type=_TYPES[reply_type_idx] if reply_type_idx != REPLY_TYPE_NONE else None,
+                reply_snippet=snippet if reply_to_id and version > 1 else None,
+                reply_deleted=bool(reply_flags & REPLY_FLAG_DELETED)
+            ))
+        return result
+
+    @staticmethod
+    def _read_index(idx) -> List[Tuple[int, int, int, int]]:
+        # Недописанная (после сбоя) последняя запись индекса отбрасывается
+        return list(INDEX_ENTRY.iter_unpack(idx[:len(idx) - len(idx) % INDEX_ENTRY.size]))
+
+    # --- Запись ---
+
+    def _write_blocks(self, seg_file, idx_file, messages: List[ArchivedMessage]):
+        seg_file.seek(0, os.SEEK_END)
+        entries = []
+        for i in range(0, len(messages), BLOCK_TARGET_MESSAGES):
+            chunk = messages[i:i + BLOCK_TARGET_MESSAGES]
+            offset = seg_file.tell()
+            seg_file.write(self._encode_block(chunk))
+            entries.append(INDEX_ENTRY.pack(chunk[0].id, chunk[-1].id, offset, len(chunk)))
+
+        # Сначала данные, потом индекс: неиндексированный хвост просто игнорируется
+        seg_file.flush()
+        os.fsync(seg_file.fileno())
+        idx_file.write(b"".join(entries))
+        idx_file.flush()
+        os.fsync(idx_file.fileno())
+
+    def append(self, chat_id: int, messages: List[ArchivedMessage]):
+        """Дописывает сообщения (по возрастанию id) в текущий сегмент чата."""
+        if not messages:
+            return
+
+        with self._write_lock:
+            chat_dir = self._chat_dir(chat_id)
+            os.makedirs(chat_dir, exist_ok=True)
+
+            segments = self._list_segments(chat_dir)
+            base = segments[-1][2] if segments else None
+            if base is None or os.path.getsize(base + ".seg") >= SEGMENT_MAX_BYTES:
+                base = _segment_base(chat_dir, messages[0].id, 0)
+
+            # Отрезаем недописанную после сбоя запись индекса, иначе собьется выравнивание
+            idx_path = base + ".idx"
+            if os.path.exists(idx_path):
+                idx_size = os.path.getsize(idx_path)
+                if idx_size % INDEX_ENTRY.size:
+                    os.truncate(idx_path, idx_size - idx_size % INDEX_ENTRY.size)
+
+            with open(base + ".seg", "ab") as seg_file, open(base + ".idx", "ab") as idx_file:
+                self._write_blocks(seg_file, idx_file, messages)
+
+    # --- Чтение ---
+
+    def read_before(
+        self,
+        chat_id: int,
+        before_id: int,
+        limit: int,
+        skip: int = 0,
+        min_sent_at: Optional[datetime] = None,
+        min_id: int = 0,
+        match: Optional[Callable[[ArchivedMessage], bool]] = None
+    ) -> List[ArchivedMessage]:
+        """
+        Возвращает до limit сообщений с min_id < id < before_id (от новых к старым),
+        пропустив первые skip. Сообщения не новее min_sent_at не возвращаются.
+        match - дополнительный фильтр (закрепленные, медиа); skip считается после него.
+        """
+        for _ in range(2):
+            try:
+                return self._read_before(chat_id, before_id, limit, skip, min_sent_at, min_id, match)
+            except FileNotFoundError:
+                # Сегмент заменил компактор между листингом и открытием - перечитываем
+                continue
+        return []
+
+    def read_one(self, chat_id: int, message_id: int) -> Optional[ArchivedMessage]:
+        """Одно архивное сообщение по id (или None)."""
+        found = self.read_before(chat_id, message_id + 1, 1, min_id=message_id - 1)
+        return found[0] if found else None
+
+    def _read_before(self, chat_id, before_id, limit, skip, min_sent_at, min_id, match) -> List[ArchivedMessage]:
+        result: List[ArchivedMessage] = []
+        last_id = None
+
+        for first_id, _, base in reversed(self._list_segments(self._chat_dir(chat_id))):
+            if first_id >= before_id:
+                continue
+
+            with open(base + ".idx", "rb") as f_idx, open(base + ".seg", "rb") as f_seg:
+                if os.fstat(f_idx.fileno()).st_size == 0 or os.fstat(f_seg.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f_idx.fileno(), 0, access=mmap.ACCESS_READ) as idx, \
+                        mmap.mmap(f_seg.fileno(), 0, access=mmap.ACCESS_READ) as seg:
+
+                    # Бинарный поиск последнего блока с first_id < before_id
+                    lo, hi = 0, len(idx) // INDEX_ENTRY.size
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        if INDEX_ENTRY.unpack_from(idx, mid * INDEX_ENTRY.size)[0] < before_id:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+
+                    for pos in range(lo - 1, -1, -1):
+                        _, _, offset, _ = INDEX_ENTRY.unpack_from(idx, pos * INDEX_ENTRY.size)
+                        for msg in reversed(self._decode_block(seg, offset, chat_id)):
+                            if msg.id >= before_id or (last_id is not None and msg.id >= last_id):
+                                continue  # Вне диапазона или дубликат
+                            if msg.id <= min_id or (min_sent_at is not None and msg.sent_at <= min_sent_at):
+                                return result  # Дальше только более старые (очищенные) сообщения
+                            last_id = msg.id
+                            if match is not None and not match(msg):
+                                continue
+                            if skip:
+                                skip -= 1
+                                continue
+                            result.append(msg)
+                            if len(result) >= limit:
+                                return result
+        return result
+
+    # --- Обслуживание ---
+
+    def compact_chat(self, chat_id: int) -> int:
+        """Переписывает сегменты с мелкими блоками. Возвращает число переписанных сегментов."""
+        compacted = 0
+        with self._write_lock:
+            chat_dir = self._chat_dir(chat_id)
+            for first_id, gen, base in self._list_segments(chat_dir):
+                with open(base + ".idx", "rb") as f_idx:
+                    entries = self._read_index(f_idx.read())
+                if len(entries) < 2:
+                    continue
+
+                total = sum(entry[3] for entry in entries)
+                if total / (len(entries) * BLOCK_TARGET_MESSAGES) >= COMPACT_MIN_FILL:
+                    continue
+
+                # Читаем все записи по возрастанию и убираем дубликаты
+                messages = {}
+                with open(base + ".seg", "rb") as f_seg:
+                    with mmap.mmap(f_seg.fileno(), 0, access=mmap.ACCESS_READ) as seg:
+                        for _, _, offset, _ in entries:
+                            for msg in self._decode_block(seg, offset, chat_id):
+                                messages[msg.id] = msg
+                ordered = [messages[msg_id] for msg_id in sorted(messages)]
+
+                new_base = _segment_base(chat_dir, first_id, gen + 1)
+                tmp_idx = new_base + ".idx.tmp"
+                with open(new_base + ".seg", "wb") as seg_file, open(tmp_idx, "wb") as idx_file:
+                    self._write_blocks(seg_file, idx_file, ordered)
+                # Появление .idx означает, что новое поколение готово к чтению
+                os.replace(tmp_idx, new_base + ".idx")
+
+                os.remove(base + ".idx")
+                os.remove(base + ".seg")
+                compacted += 1
+        return compacted
+
+    def compact_all(self) -> int:
+        if not os.path.isdir(self.root):
+            return 0
+        compacted = 0
+        for name in os.listdir(self.root):
+            if name.startswith("chat_"):
+                try:
+                    compacted += self.compact_chat(int(name[len("chat_"):]))
+                except Exception as e:
+                    logger.error(f"Ошибка компакции архива {name}: {e}")
+        return compacted
+
+    def drop_chat(self, chat_id: int):
+        """Удаляет весь архив чата (очистка истории / удаление чата)."""
+        with self._write_lock:
+            shutil.rmtree(self._chat_dir(chat_id), ignore_errors=True)
+
+
+# Синглтон, который импортируется во всем приложении
+segment_store = SegmentStore(settings.ARCHIVE_DIR)
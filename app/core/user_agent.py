@@ -0,0 +1,56 @@
+"""
+Разбор User-Agent в читаемое название устройства ("Chrome on Windows") и тип.
+
+Клиенты одной версии присылают одинаковые строки, поэтому результат
+кэшируется (LRU): повторный логин с того же браузера не разбирает строку заново.
+"""
+from functools import lru_cache
+from typing import Tuple
+
+# Длиннее User-Agent не бывает у реальных клиентов; обрезка ограничивает память кэша
+MAX_USER_AGENT_LENGTH = 512
+USER_AGENT_CACHE_SIZE = 4096
+
+
+def parse_user_agent(user_agent: str) -> Tuple[str, str]:
+    """User-Agent -> (device_name, device_type)."""
+    return _parse(user_agent[:MAX_USER_AGENT_LENGTH])
+
+
+@lru_cache(maxsize=USER_AGENT_CACHE_SIZE)
+def _parse(user_agent: str) -> Tuple[str, str]:
+    # Определяем тип устройства по User-Agent
+    device_type = "desktop"
+    if "Mobile" in user_agent or "Android" in user_agent:
+        device_type = "mobile"
+    elif "Tablet" in user_agent or "iPad" in user_agent:
+        device_type = "tablet"
+
+    # Формируем читаемое название устройства
+    if "Windows" in user_agent:
+        os_name = "Windows"
+    elif "Mac" in user_agent:
+        os_name = "macOS"
+    elif "Linux" in user_agent:
+        os_name = "Linux"
+    elif "Android" in user_agent:
+        os_name = "Android"
+    elif "iPhone" in user_agent or "iPad" in user_agent:
+        os_name = "iOS"
+    else:
+        os_name = "Unknown OS"
+
+    if "Chrome" in user_agent and "Edg" not in user_agent:
+        browser = "Chrome"
+    elif "Firefox" in user_agent:
+        browser = "Firefox"
+    elif "Safari" in user_agent and "Chrome" not in user_agent:
+        browser = "Safari"
+    elif "Edg" in user_agent:
+        browser = "Edge"
+    elif "Electron" in user_agent:
+        browser = "Dialect Desktop"
+    else:
+        browser = "Unknown Browser"
+
+    return f"{browser} on {os_name}", device_type
@@ -0,0 +1,117 @@
+"""
+Индекс юзернеймов для автодополнения "@ali..." (отсортированный массив).
+
+Все юзернеймы (в нижнем регистре) лежат в отсортированном списке, поэтому
+совпадения по префиксу - это непрерывный отрезок, который находится одним
+бинарным поиском: O(log n + k) без обращения к БД и без LIKE.
+
+Загружается при старте вместе с Фильтром Блума (main.lifespan), дополняется
+при регистрации и смене юзернейма. Изменения из других воркеров подтягивает
+та же задача, что и для поискового индекса (user_service.sync_user_indexes).
+"""
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Максимум подсказок за один запрос
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+class UsernameIndex:
+    def __init__(self):
+        self._names: List[str] = []        # Отсортированы, нижний регистр
+        self._ids: Dict[str, int] = {}     # username -> user_id
+        self._by_user: Dict[int, str] = {} # user_id -> username (для синхронизации без старого имени)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def load(self, rows: Iterable[Tuple[int, str]]):
+        """Полная загрузка из пар (user_id, username). Старый список подменяется целиком."""
+        ids = {username.lower(): user_id for user_id, username in rows if username}
+        names = sorted(ids)
+        by_user = {user_id: username for username, user_id in ids.items()}
+        with self._lock:
+            self._names, self._ids, self._by_user = names, ids, by_user
+
+    def add(self, username: Optional[str], user_id: int):
+        if not username:
+            return
+        key = username.lower()
+        with self._lock:
+            self._add(key, user_id)
+
+    def remove(self, username: Optional[str]):
+        if not username:
+            return
+        with self._lock:
+            self._remove(username.lower())
+
+    def set(self, user_id: int, username: Optional[str]):
+        """Актуальный юзернейм пользователя (из синхронизации с БД): прежний, если был, убирается."""
+        key = username.lower() if username else None
+        with self._lock:
+            old_key = self._by_user.get(user_id)
+            if old_key == key:
+                return
+            if old_key is not None and self._ids.get(old_key) == user_id:
+                self._remove(old_key)
+            if key is not None:
+                self._add(key, user_id)
+
+    def _add(self, key: str, user_id: int):
+        old_id = self._ids.get(key)
+        if old_id is None:
+            insort(self._names, key)
+        elif old_id != user_id:
+            self._by_user.pop(old_id, None)  # Имя перешло к другому пользователю
+        old_key = self._by_user.get(user_id)
+        if old_key is not None and old_key != key and self._ids.get(old_key) == user_id:
+            self._remove(old_key)
+        self._ids[key] = user_id
+        self._by_user[user_id] = key
+
+    def _remove(self, key: str):
+        user_id = self._ids.pop(key, None)
+        if user_id is None:
+            return
+        if self._by_user.get(user_id) == key:
+            del self._by_user[user_id]
+        i = bisect_left(self._names, key)
+        if i < len(self._names) and self._names[i] == key:
+            del self._names[i]
+
+    def rename(self, old_username: Optional[str], new_username: Optional[str], user_id: int):
+        """Смена юзернейма: старый убираем, новый добавляем."""
+        if (old_username or "").lower() == (new_username or "").lower():
+            return
+        self.remove(old_username)
+        self.add(new_username, user_id)
+
+    def complete(self, prefix: str, limit: int = 10, exclude_user_id: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        До limit пар (username, user_id), начинающихся с prefix, в алфавитном порядке
+        (точное совпадение всегда первое - оно меньше любого продолжения).
+        """
+        prefix = prefix.strip().lstrip("@").lower()
+        if not prefix:
+            return []
+
+        result = []
+        with self._lock:
+            i = bisect_left(self._names, prefix)
+            names = self._names
+            while i < len(names) and len(result) < limit:
+                name = names[i]
+                if not name.startswith(prefix):
+                    break
+                user_id = self._ids[name]
+                if user_id != exclude_user_id:
+                    result.append((name, user_id))
+                i += 1
+        return result
+
+
+# Синглтон, который импортируется во всем приложении
+username_index = UsernameIndex()
@@ -0,0 +1,182 @@
+"""
+Хранилище одноразовых SMS кодов с временем жизни и счетчиком попыток.
+
+Код выдается в /auth/send-code и проверяется в /auth/verify-code - эти
+запросы могут попасть в разные воркеры, поэтому по умолчанию коды лежат в
+таблице verification_codes ("database"). Для запуска в один процесс есть
+бэкенд в памяти ("memory"). Выбор - VERIFICATION_CODE_BACKEND.
+
+Ключ - нормализованный номер ("+7 912..." и "8 912..." - один код).
+Хранится не сам код, а HMAC от него. После VERIFICATION_CODE_MAX_ATTEMPTS
+неверных вводов код сбрасывается. Истекшие коды удаляет задача планировщика.
+"""
+import abc
+import enum
+import hashlib
+import hmac
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.core.phone import normalize_phone
+from app.db import database, models
+
+logger = logging.getLogger(__name__)
+
+# Попыток записи кода при гонке вставок одного номера (IntegrityError)
+SAVE_ATTEMPTS = 2
+
+
+class CodeCheck(str, enum.Enum):
+    ok = "ok"
+    missing = "missing"                        # Код не запрашивался (или уже использован)
+    expired = "expired"
+    wrong = "wrong"
+    too_many_attempts = "too_many_attempts"    # Код сброшен, нужно запросить новый
+
+
+def _code_hash(phone_digits: str, code: str) -> str:
+    return hmac.new(settings.SECRET_KEY.encode(), f"{phone_digits}:{code}".encode(), hashlib.sha256).hexdigest()
+
+
+class VerificationCodeStore(abc.ABC):
+    """Общий интерфейс бэкендов."""
+
+    def __init__(self, ttl_seconds: int, max_attempts: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+
+    def issue(self, phone: str, code: str):
+        """Сохраняет новый код (старый код этого номера и его счетчик попыток сбрасываются)."""
+        phone_digits = normalize_phone(phone)
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        self._save(phone_digits, _code_hash(phone_digits, code), expires_at)
+
+    def check(self, phone: str, code: str) -> CodeCheck:
+        """Проверяет код. Верный код сразу удаляется (одноразовый)."""
+        phone_digits = normalize_phone(phone)
+        return self._check(phone_digits, _code_hash(phone_digits, code), datetime.utcnow())
+
+    def _verdict(self, code_hash: str, stored_hash: str, expires_at: datetime, attempts: int, now: datetime):
+        """(результат, удалить ли запись)."""
+        if expires_at <= now:
+            return CodeCheck.expired, True
+        if hmac.compare_digest(code_hash, stored_hash):
+            return CodeCheck.ok, True
+        if attempts + 1 >= self.max_attempts:
+            return CodeCheck.too_many_attempts, True
+        return CodeCheck.wrong, False
+
+    @abc.abstractmethod
+    def _save(self, phone_digits: str, code_hash: str, expires_at: datetime):
+        ...
+
+    @abc.abstractmethod
+    def _check(self, phone_digits: str, code_hash: str, now: datetime) -> CodeCheck:
+        ...
+
+    @abc.abstractmethod
+    def sweep(self) -> int:
+        """Задача планировщика: удаляет истекшие коды. Возвращает их число."""
+
+
+class MemoryCodeStore(VerificationCodeStore):
+    """Коды в памяти процесса (только для запуска в один воркер)."""
+
+    def __init__(self, ttl_seconds: int, max_attempts: int):
+        super().__init__(ttl_seconds, max_attempts)
+        self._codes: Dict[str, list] = {}  # phone_digits -> [code_hash, expires_at, attempts]
+        self._lock = threading.Lock()
+
+    def _save(self, phone_digits: str, code_hash: str, expires_at: datetime):
+        with self._lock:
+            self._codes[phone_digits] = [code_hash, expires_at, 0]
+
+    def _check(self, phone_digits: str, code_hash: str, now: datetime) -> CodeCheck:
+        with self._lock:
+            entry = self._codes.get(phone_digits)
+            if entry is None:
+                return CodeCheck.missing
+            result, delete = self._verdict(code_hash, entry[0], entry[1], entry[2], now)
+            if delete:
+                del self._codes[phone_digits]
+            else:
+                entry[2] += 1
+            return result
+
+    def sweep(self) -> int:
+        now = datetime.utcnow()
+        with self._lock:
+            expired = [phone for phone, entry in self._codes.items() if entry[1] <= now]
+            for phone in expired:
+                del self._codes[phone]
+        return len(expired)
+
+
+class DatabaseCodeStore(VerificationCodeStore):
+    """Коды в таблице verification_codes (видны всем воркерам)."""
+
+    def _save(self, phone_digits: str, code_hash: str, expires_at: datetime):
+        db = database.SessionLocal()
+        try:
+            for attempt in range(SAVE_ATTEMPTS):
+                try:
+                    db.merge(models.VerificationCode(
+                        phone_digits=phone_digits, code_hash=code_hash, attempts=0, expires_at=expires_at
+                    ))
+                    db.commit()
+                    return
+                except IntegrityError:
+                    # Другой воркер одновременно вставил код этого номера - повторяем как UPDATE
+                    db.rollback()
+                    if attempt == SAVE_ATTEMPTS - 1:
+                        logger.error(f"Не удалось сохранить код подтверждения после {SAVE_ATTEMPTS} попыток")
+                        raise
+        finally:
+            db.close()
+
+    def _check(self, phone_digits: str, code_hash: str, now: datetime) -> CodeCheck:
+        db = database.SessionLocal()
+        try:
+            # FOR UPDATE: параллельные проверки одного номера не обойдут счетчик попыток
+            row = db.query(models.VerificationCode).filter(
+                models.VerificationCode.phone_digits == phone_digits
+            ).with_for_update().first()
+            if row is None:
+                return CodeCheck.missing
+            result, delete = self._verdict(code_hash, row.code_hash, row.expires_at, row.attempts, now)
+            if delete:
+                db.delete(row)
+            else:
+                row.attempts += 1
+            db.commit()
+            return result
+        finally:
+            db.close()
+
+    def sweep(self) -> int:
+        db = database.SessionLocal()
+        try:
+            count = db.query(models.VerificationCode).filter(
+                models.VerificationCode.expires_at <= datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+
+def _create_store() -> VerificationCodeStore:
+    backends = {"database": DatabaseCodeStore, "memory": MemoryCodeStore}
+    backend = backends.get(settings.VERIFICATION_CODE_BACKEND)
+    if backend is None:
+        raise ValueError(f"Неизвестный VERIFICATION_CODE_BACKEND: {settings.VERIFICATION_CODE_BACKEND}")
+    return backend(settings.VERIFICATION_CODE_TTL_SECONDS, settings.VERIFICATION_CODE_MAX_ATTEMPTS)
+
+
+# Синглтон, который импортируется во всем приложении
+verification_codes = _create_store()
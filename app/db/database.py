@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, Enum, UniqueConstraint
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import sessionmaker, Session
 from app.core.config import settings # Импортируем наши настройки
 from app.db.models import Base # Импортируем Base из models.py
@@ -53,6 +54,100 @@ def create_all_tables():
         print("Создание таблиц в БД (если их нет)...")
         Base.metadata.create_all(bind=engine)
         print("Таблицы успешно созданы/проверены.")
+        migrate_schema()
     except Exception as e:
         print(f"Ошибка при создании таблиц: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Внешние ключи, которые убраны из моделей (в старых базах они еще есть): (таблица, колонка)
+DROPPED_FOREIGN_KEYS = [
+    ("messages", "reply_to_id"),  # Ответ может ссылаться на архивное сообщение
+]
+
+def migrate_schema():
+    """
+    create_all создает только отсутствующие таблицы и не меняет существующие.
+    Эта функция догоняет старую базу до моделей: добавляет новые колонки
+    (ALTER TABLE ... ADD COLUMN) и индексы, на MySQL расширяет ENUM новыми
+    значениями и снимает внешние ключи из DROPPED_FOREIGN_KEYS.
+    Типы и ограничения уже существующих колонок не меняются.
+    Данные новых колонок заполняют backfill_* при старте (main.lifespan).
+    SQLite не добавляет колонку с DEFAULT now() в непустую таблицу - локальную
+    базу разработки в этом случае проще пересоздать.
+    """
+    inspector = inspect(engine)
+    is_mysql = engine.dialect.name == "mysql"
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                if column.name not in existing:
+                    print(f"Миграция: {table.name}.{column.name}")
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                elif is_mysql and isinstance(column.type, Enum):
+                    # Новое значение Enum (например, chat_type = supergroup) MySQL иначе не примет
+                    if set(column.type.enums) - set(getattr(existing[column.name]["type"], "enums", ())):
+                        print(f"Миграция: значения {table.name}.{column.name}")
+                        conn.execute(text(f"ALTER TABLE {table.name} MODIFY COLUMN {ddl}"))
+
+            index_names = {index["name"] for index in inspector.get_indexes(table.name)}
+            index_names |= {uc["name"] for uc in inspector.get_unique_constraints(table.name)}
+            for index in table.indexes:
+                if index.name not in index_names:
+                    print(f"Миграция: индекс {index.name}")
+                    index.create(conn)
+            for constraint in table.constraints:
+                if isinstance(constraint, UniqueConstraint) and constraint.name and constraint.name not in index_names:
+                    # Уникальный индекс вместо ADD CONSTRAINT: так умеет и SQLite
+                    print(f"Миграция: уникальный индекс {constraint.name}")
+                    conn.execute(text(
+                        f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} "
+                        f"({', '.join(column.name for column in constraint.columns)})"
+                    ))
+
+        if is_mysql:
+            for table_name, column_name in DROPPED_FOREIGN_KEYS:
+                for fk in inspector.get_foreign_keys(table_name):
+                    if fk["constrained_columns"] == [column_name]:
+                        print(f"Миграция: внешний ключ {fk['name']}")
+                        conn.execute(text(f"ALTER TABLE {table_name} DROP FOREIGN KEY {fk['name']}"))
+
+# --- Именованные блокировки (один исполнитель фоновой задачи на все воркеры) ---
+class AdvisoryLock:
+    """
+    Блокировка MySQL GET_LOCK/RELEASE_LOCK без ожидания. Держится на отдельном
+    соединении, пока не вызван release() (или пока соединение не оборвется -
+    тогда MySQL снимет ее сам). На других СУБД (SQLite в разработке) acquire()
+    всегда успешен: там один процесс.
+    """
+
+    def __init__(self, name: str):
+        # Имя блокировки общее для всего сервера MySQL - добавляем имя БД; лимит MySQL - 64 символа
+        self.name = f"{settings.DB_NAME}:{name}"[:64]
+        self._connection = None
+
+    def acquire(self) -> bool:
+        if engine.dialect.name != "mysql":
+            return True
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": self.name}).scalar() == 1
+        except Exception:
+            connection.close()
+            raise
+        if not acquired:
+            connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    def release(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        try:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": self.name})
+        finally:
+            connection.close()
@@ -1,7 +1,7 @@
 import enum
 from sqlalchemy import (
     Column, Integer, String, ForeignKey, Enum, TIMESTAMP, TEXT, BLOB, BIGINT,
-    create_engine, UniqueConstraint, Boolean, Date
+    create_engine, UniqueConstraint, Boolean, Date, Index
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
@@ -11,6 +11,17 @@ Base = declarative_base()
 class ChatTypeEnum(str, enum.Enum):
     private = 'private'
     group = 'group'
+    supergroup = 'supergroup'  # Большая группа: рассылка только онлайн, участники постранично, прочтение - watermark
+
+class PurgeKindEnum(str, enum.Enum):
+    clear_history = 'clear_history'
+    delete_chat = 'delete_chat'
+
+class PurgeStatusEnum(str, enum.Enum):
+    pending = 'pending'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
 
 class MessageStatusEnum(str, enum.Enum):
     sent = 'sent'
@@ -31,6 +42,10 @@ class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     phone_number = Column(String(20), unique=True, index=True, nullable=False)
+    # ⭐ Нормализованный номер (E.164 без "+", см. app/core/phone.py): точный и префиксный поиск по индексу
+    phone_digits = Column(String(15), index=True, nullable=True)
+    # ⭐ SHA-256 от phone_digits: синхронизация контактов по хешам номеров
+    phone_hash = Column(String(64), index=True, nullable=True)
     username = Column(String(50), unique=True, index=True, nullable=True)
     first_name = Column(String(100), nullable=False)
     last_name = Column(String(100), nullable=True)
@@ -50,6 +65,13 @@ class User(Base):
     last_seen_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
 
+    # ⭐ Когда создан профиль или менялись имя / username (не last_seen_at): по нему воркеры
+    # подтягивают изменения в свои индексы поиска (app/core/search_index.py)
+    profile_updated_at = Column(TIMESTAMP, server_default=func.now(), nullable=True, index=True)
+
+    # ⭐ Когда менялся черный список: по нему воркеры сбрасывают свой block_cache
+    blocks_changed_at = Column(TIMESTAMP, nullable=True, index=True)
+
     chat_links = relationship("ChatParticipant", back_populates="user")
     sent_messages = relationship("Message", back_populates="sender")
     owned_chats = relationship("Chat", back_populates="owner")
@@ -64,9 +86,12 @@ class User(Base):
     def is_online(self) -> bool:
         """Считает пользователя онлайн, если last_seen_at < 5 минут назад (как Telegram)."""
         from datetime import datetime, timedelta
-        if not self.last_seen_at:
+        from app.core.activity import activity_buffer
+        # Свежая отметка может еще лежать в буфере активности (write-behind)
+        last_seen = activity_buffer.last_seen(self.id) or self.last_seen_at
+        if not last_seen:
             return False
-        return datetime.utcnow() - self.last_seen_at < timedelta(minutes=5)
+        return datetime.utcnow() - last_seen < timedelta(minutes=5)
 
 
 class UserSession(Base):
@@ -92,6 +117,8 @@ class UserSession(Base):
     
     # Флаг активности (для soft-delete)
     is_active = Column(Boolean, default=True, nullable=False)
+    # ⭐ Момент отзыва: по нему воркеры синхронизируют реестр отозванных сессий (app/core/revocation.py)
+    revoked_at = Column(TIMESTAMP, nullable=True, index=True)
     
     user = relationship("User", back_populates="sessions")
 
@@ -108,6 +135,23 @@ class UserDevice(Base):
     user = relationship("User", back_populates="devices")
 
 
+class ScheduledJobRun(Base):
+    """Время последнего запуска задач single_runner (общее для всех воркеров, см. app/core/scheduler.py)"""
+    __tablename__ = "scheduled_job_runs"
+    name = Column(String(64), primary_key=True)
+    last_started_at = Column(TIMESTAMP, nullable=False)
+
+
+class VerificationCode(Base):
+    """Одноразовые SMS коды (общие для всех воркеров, см. app/core/verification_codes.py)"""
+    __tablename__ = "verification_codes"
+    phone_digits = Column(String(15), primary_key=True)  # Нормализованный номер (app/core/phone.py)
+    code_hash = Column(String(64), nullable=False)       # HMAC-SHA256 кода, сам код не храним
+    attempts = Column(Integer, default=0, nullable=False) # Неверных вводов этого кода
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
 class UserBlock(Base):
     """Черный список"""
     __tablename__ = "user_blocks"
@@ -130,9 +174,37 @@ class Chat(Base):
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
 
+    # ⭐ Денормализация для списка чатов (обновляется при отправке сообщения).
+    # Без FK, чтобы не создавать циклическую зависимость chats <-> messages.
+    last_message_id = Column(BIGINT, nullable=True)
+    last_activity_at = Column(TIMESTAMP, server_default=func.now(), nullable=False, index=True)
+
+    # ⭐ Граница архива: сообщения с id <= archived_up_to_id лежат в cold storage
+    archived_up_to_id = Column(BIGINT, default=0, server_default="0", nullable=False)
+
+    # ⭐ Логическое удаление: данные скрываются сразу, физически удаляются фоновым воркером
+    cleared_before_id = Column(BIGINT, default=0, server_default="0", nullable=False)  # История "для всех" очищена до этого id
+    deleted_at = Column(TIMESTAMP, nullable=True)  # Чат удален "для всех"
+
+    # ⭐ Канонический ключ пары для ЛС: (min(user_id), max(user_id)). У групп - NULL.
+    # Уникальность гарантирует не более одного ЛС на пару даже при гонке запросов.
+    pair_low_user_id = Column(Integer, nullable=True)
+    pair_high_user_id = Column(Integer, nullable=True)
+
+    # ⭐ Число участников (денормализация: у супергрупп список участников не загружается целиком)
+    member_count = Column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (UniqueConstraint('pair_low_user_id', 'pair_high_user_id', name='_private_pair_uc'),)
+
     participant_links = relationship("ChatParticipant", back_populates="chat", cascade="all, delete-orphan")
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
     owner = relationship("User", back_populates="owned_chats")
+    last_message = relationship(
+        "Message",
+        primaryjoin="foreign(Chat.last_message_id) == Message.id",
+        viewonly=True,
+        uselist=False
+    )
 
 
 class ChatParticipant(Base):
@@ -144,14 +216,24 @@ class ChatParticipant(Base):
     joined_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     last_cleared_at = Column(TIMESTAMP, nullable=True) 
     last_read_message_id = Column(BIGINT, default=0)
+    last_read_at = Column(TIMESTAMP, nullable=True)  # ⭐ Когда сдвинут last_read_message_id (watermark прочтения)
 
-    __table_args__ = (UniqueConstraint('user_id', 'chat_id', name='_user_chat_uc'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'chat_id', name='_user_chat_uc'),
+        # Участники чата по порядку user_id (постраничный список, проверка членства пачкой)
+        Index('ix_participants_chat_user', 'chat_id', 'user_id'),
+    )
     user = relationship("User", back_populates="chat_links")
     chat = relationship("Chat", back_populates="participant_links")
 
 
 class Message(Base):
     __tablename__ = "messages"
+    # Закрепленные и медиа чата - один проход по диапазону индекса (WHERE ... AND id < курсор ORDER BY id DESC)
+    __table_args__ = (
+        Index('ix_messages_chat_pinned', 'chat_id', 'is_pinned', 'id'),
+        Index('ix_messages_chat_type', 'chat_id', 'message_type', 'id'),
+    )
     id = Column(BIGINT, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -166,8 +248,16 @@ class Message(Base):
     status = Column(Enum(MessageStatusEnum), nullable=False, default=MessageStatusEnum.sent)
     is_pinned = Column(Boolean, default=False, nullable=False)
     
-    # ⭐ Ответ на сообщение (self-referencing FK)
-    reply_to_id = Column(BIGINT, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    # ⭐ Ответ на сообщение. Без FK: исходное сообщение может уйти в архив (cold storage)
+    # или быть удалено - тогда ответ показывает "удалено", а не теряет ссылку
+    reply_to_id = Column(BIGINT, nullable=True, index=True)
+
+    # ⭐ Превью исходного сообщения (денормализация): история и рассылка
+    # не загружают родительскую строку с ее BLOB
+    reply_snippet = Column(String(100), nullable=True)
+    reply_sender_id = Column(Integer, nullable=True)
+    reply_message_type = Column(Enum(MessageTypeEnum), nullable=True)
+    reply_deleted = Column(Boolean, default=False, server_default="0", nullable=False)
     
     # ⭐ Флаг редактирования
     is_edited = Column(Boolean, default=False, nullable=False)
@@ -176,8 +266,36 @@ class Message(Base):
     sender = relationship("User", back_populates="sent_messages")
     read_by = relationship("MessageRead", back_populates="message", cascade="all, delete-orphan")
     
-    # Связь с ответом (для легкого доступа к цитируемому сообщению)
-    reply_to = relationship("Message", remote_side=[id], foreign_keys=[reply_to_id])
+    @property
+    def reply_to(self):
+        """Превью цитируемого сообщения (schemas.ReplyInfo) из денормализованных полей."""
+        if self.reply_to_id is None:
+            return None
+        return {
+            "id": self.reply_to_id,
+            "content": self.reply_snippet or "",
+            "sender_id": self.reply_sender_id,
+            "message_type": self.reply_message_type,
+            "is_deleted": bool(self.reply_deleted)
+        }
+
+
+class ArchivedMessageRef(Base):
+    """
+    ⭐ Указатель на закрепленное или медиа-сообщение в архиве (cold storage).
+    Закрепленные и медиа-галерея находят архивные сообщения по этой таблице
+    и читают только их блоки, не распаковывая весь архив чата.
+    """
+    __tablename__ = "archived_message_refs"
+    __table_args__ = (
+        Index('ix_archived_refs_chat_pinned', 'chat_id', 'is_pinned', 'message_id'),
+        Index('ix_archived_refs_chat_type', 'chat_id', 'message_type', 'message_id'),
+    )
+    message_id = Column(BIGINT, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    message_type = Column(Enum(MessageTypeEnum), nullable=False)
+    is_pinned = Column(Boolean, nullable=False)
+    sent_at = Column(TIMESTAMP, nullable=False)
 
 
 class MessageRead(Base):
@@ -188,4 +306,20 @@ class MessageRead(Base):
     read_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     __table_args__ = (UniqueConstraint('message_id', 'user_id', name='_msg_user_read_uc'),)
     message = relationship("Message", back_populates="read_by")
-    user = relationship("User", back_populates="read_receipts")
\ No newline at end of file
+    user = relationship("User", back_populates="read_receipts")
+
+
+class ChatPurgeJob(Base):
+    """Задача фоновой очистки истории / удаления чата (прогресс виден клиенту)"""
+    __tablename__ = "chat_purge_jobs"
+    id = Column(Integer, primary_key=True)
+    # Без FK: строка чата удаляется самим воркером в конце задачи delete_chat
+    chat_id = Column(Integer, nullable=False, index=True)
+    requested_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    kind = Column(Enum(PurgeKindEnum), nullable=False)
+    up_to_message_id = Column(BIGINT, nullable=True)  # None = все сообщения чата
+    status = Column(Enum(PurgeStatusEnum), nullable=False, default=PurgeStatusEnum.pending, index=True)
+    purged_messages = Column(BIGINT, default=0, nullable=False)
+    error = Column(String(255), nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    finished_at = Column(TIMESTAMP, nullable=True)
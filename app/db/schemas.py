@@ -1,9 +1,10 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, model_validator
 from typing import Optional, List
 from datetime import datetime, date
 import enum
 
-from .models import ChatTypeEnum, MessageStatusEnum, MessageTypeEnum
+from app.core.activity import activity_buffer
+from .models import ChatTypeEnum, MessageStatusEnum, MessageTypeEnum, PurgeKindEnum, PurgeStatusEnum
 
 class StatusDurationEnum(str, enum.Enum):
     forever = "forever"
@@ -50,6 +51,27 @@ class UserPublic(BaseModel):
     last_seen_at: datetime
     is_online: bool = False
 
+    @model_validator(mode="after")
+    def _buffered_last_seen(self):
+        # Свежая отметка активности может еще не быть записана в БД (app/core/activity.py)
+        buffered = activity_buffer.last_seen(self.id)
+        if buffered:
+            self.last_seen_at = buffered
+        return self
+
+class UserBatch(BaseModel):
+    users: List[UserPublic]
+    not_found: List[int] = []  # Запрошенные id, которых нет
+
+class ContactSyncRequest(BaseModel):
+    phone_numbers: List[str] = []
+    phone_hashes: List[str] = []  # SHA-256 (hex) нормализованного номера, см. app/core/phone.py
+
+class ContactMatch(BaseModel):
+    phone_number: Optional[str] = None  # В том виде, в каком прислал клиент
+    phone_hash: Optional[str] = None
+    user: UserPublic
+
 class UserInDB(UserBase):
     model_config = ConfigDict(from_attributes=True)
     id: int
@@ -75,17 +97,44 @@ class ChatCreatePrivate(BaseModel):
 class ChatCreateGroup(BaseModel):
     chat_name: str
     participant_ids: List[int]
+    chat_type: ChatTypeEnum = ChatTypeEnum.group  # group или supergroup
+
+class ChatAddUsers(BaseModel):
+    user_ids: List[int]
 
 class ChatBase(BaseModel):
     chat_type: ChatTypeEnum
     chat_name: Optional[str] = None
 
+class LastMessagePreview(BaseModel):
+    """Короткое превью последнего сообщения для списка чатов"""
+    id: int
+    sender_id: Optional[int] = None
+    message_type: MessageTypeEnum
+    content: str  # Обрезанный текст (или ссылка на вложение)
+    sent_at: datetime
+
 class Chat(ChatBase):
     model_config = ConfigDict(from_attributes=True)
     id: int
     owner_id: Optional[int] = None
     avatar_url: Optional[str] = None
-    participants: List[UserPublic] = []
+    participants: List[UserPublic] = []  # У супергрупп пусто: GET /chats/{id}/members
+    member_count: int = 0
+    last_message: Optional[LastMessagePreview] = None
+    last_activity_at: Optional[datetime] = None
+
+class PurgeJobInfo(BaseModel):
+    """Прогресс фоновой очистки истории / удаления чата"""
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    chat_id: int
+    kind: PurgeKindEnum
+    status: PurgeStatusEnum
+    purged_messages: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
 
 # --- Message ---
 class ReadReceipt(BaseModel):
@@ -108,12 +157,14 @@ class MessageUpdate(BaseModel):
     message_id: int
     content: bytes
 
-# Schema for replied message info
+# Schema for replied message info (compact preview, see models.Message.reply_to)
 class ReplyInfo(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     id: int
-    content: bytes
+    content: str  # Обрезанный текст исходного сообщения ("" если удалено)
     sender_id: Optional[int] = None
+    message_type: Optional[MessageTypeEnum] = None
+    is_deleted: bool = False
 
 class Message(MessageBase):
     model_config = ConfigDict(from_attributes=True)
@@ -146,6 +197,7 @@ class RefreshTokenRequest(BaseModel):
 class TokenData(BaseModel):
     user_id: Optional[int] = None
     session_id: Optional[int] = None
+    issued_at: Optional[datetime] = None  # "iat" (UTC) - для отзыва всех сессий
 
 # --- Sessions ---
 class SessionInfo(BaseModel):
@@ -158,4 +210,11 @@ class SessionInfo(BaseModel):
     location: Optional[str] = None
     created_at: datetime
     last_used_at: datetime
-    is_current: bool = False  # Текущая сессия пользователя
\ No newline at end of file
+    is_current: bool = False  # Текущая сессия пользователя
+
+    @model_validator(mode="after")
+    def _buffered_last_used(self):
+        buffered = activity_buffer.last_used(self.id)
+        if buffered:
+            self.last_used_at = buffered
+        return self
\ No newline at end of file
@@ -1,6 +1,7 @@
 import logging
 from contextlib import asynccontextmanager
 import os
+import threading
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -10,10 +11,21 @@ from sqlalchemy.orm import Session
 # --- Импорты наших компонентов ---
 from app.db import database, models
 from app.core.bloom_filter import bloom_service
-from app.services import user_service
-from app.services.notification_service import init_firebase # <--- Импорт
+from app.core.config import settings
+from app.core.scheduler import scheduler
+from app.core.search_index import user_search_index
+from app.core.username_index import username_index
+from app.core.activity import activity_buffer
+from app.core.revocation import session_revocations
+from app.core.password_pool import password_pool
+from app.core.geoip import geoip
+from app.core.verification_codes import verification_codes
+from app.services import user_service, chat_service, message_service, archive_service, purge_service, maintenance_service
+from app.services.notification_service import init_firebase, push_batcher # <--- Импорт
+from app.services.status_service import status_expiry
 
 # --- Импорты наших роутеров (API) ---
+from app.api.rate_limits import RateLimitMiddleware
 from app.api.v1 import auth as auth_v1
 from app.api.v1 import users as users_v1
 from app.api.v1 import chats as chats_v1
@@ -44,21 +56,84 @@ async def lifespan(app: FastAPI):
     logger.info("Проверка и создание таблиц в БД...")
     database.create_all_tables()
     
-    # 3. Синхронизация Фильтра Блума
+    # 3. Синхронизация Фильтра Блума и индекса автодополнения юзернеймов
     logger.info("Загрузка юзернеймов в Фильтр Блума...")
+    try:
+        bloom_service.open(settings.BLOOM_DATA_DIR)
+    except Exception as e:
+        logger.error(f"Не удалось открыть файлы фильтра Блума ({settings.BLOOM_DATA_DIR}): {e}")
     db = database.SessionLocal()
     try:
-        users_with_usernames = db.query(models.User.username).filter(models.User.username.isnot(None)).all()
-        all_usernames = [u[0] for u in users_with_usernames]
+        users_with_usernames = db.query(models.User.id, models.User.username).filter(
+            models.User.username.isnot(None)
+        ).all()
+        all_usernames = [u[1] for u in users_with_usernames]
         bloom_service.sync_from_db(all_usernames)
+        username_index.load(users_with_usernames)
     except Exception as e:
         logger.error(f"Ошибка при синхронизации Фильтра Блума: {e}")
     finally:
         db.close()
 
+    # 4. Поисковый индекс пользователей строится в фоне (до готовности поиск идет через SQL)
+    threading.Thread(
+        target=user_search_index.load_from_db, args=(database.SessionLocal,),
+        name="user-search-index", daemon=True
+    ).start()
+
+    # 5. Заполнение денормализованных полей для старых данных, очередь истечения статусов
+    db = database.SessionLocal()
+    try:
+        user_service.backfill_phone_digits(db)
+        message_service.backfill_reply_previews(db)
+        chat_service.backfill_private_pairs(db)
+        chat_service.backfill_member_counts(db)
+        chat_service.backfill_last_messages(db)
+        archive_service.backfill_archived_refs(db)
+        status_expiry.load(db)
+    except Exception as e:
+        logger.error(f"Ошибка при заполнении денормализованных полей: {e}")
+    finally:
+        db.close()
+
+    # 6. Реестр отозванных сессий (access токены отозванных сессий перестают работать сразу)
+    db = database.SessionLocal()
+    try:
+        session_revocations.load(db)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке отозванных сессий: {e}")
+    finally:
+        db.close()
+
+    # 7. Локальная база GeoIP для списка сессий (без нее локация - "Unknown Location")
+    try:
+        logger.info(f"База GeoIP загружена, диапазонов: {geoip.load(settings.GEOIP_DB_PATH)}")
+    except Exception as e:
+        logger.warning(f"База GeoIP не загружена ({settings.GEOIP_DB_PATH}): {e}")
+
+    # 8. Фоновые задачи
+    # single_runner: задачу над общими данными за один запуск выполняет только один воркер
+    scheduler.add_job("archive_messages", settings.ARCHIVE_INTERVAL_SECONDS, archive_service.run_archive_cycle, single_runner=True)
+    scheduler.add_job("purge_chats", settings.PURGE_INTERVAL_SECONDS, purge_service.process_pending_jobs, single_runner=True)
+    scheduler.add_job("maintenance", settings.MAINTENANCE_INTERVAL_SECONDS, maintenance_service.run_maintenance, single_runner=True)
+    scheduler.add_job("bloom_compact", settings.BLOOM_COMPACT_INTERVAL_SECONDS, bloom_service.compact, single_runner=True)
+    scheduler.add_job("push_batcher", settings.PUSH_BATCH_INTERVAL_SECONDS, push_batcher.flush)
+    scheduler.add_job("status_expiry", settings.STATUS_EXPIRY_TICK_SECONDS, status_expiry.tick)
+    scheduler.add_job("activity_flush", settings.ACTIVITY_FLUSH_INTERVAL_SECONDS, activity_buffer.flush)
+    scheduler.add_job("session_revocations", settings.REVOCATION_SYNC_INTERVAL_SECONDS, session_revocations.sync)
+    scheduler.add_job("block_cache_sync", settings.BLOCK_CACHE_SYNC_INTERVAL_SECONDS, user_service.sync_block_cache)
+    scheduler.add_job("user_index_sync", settings.USER_INDEX_SYNC_INTERVAL_SECONDS, user_service.sync_user_indexes)
+    scheduler.add_job("verification_codes_sweep", settings.VERIFICATION_CODE_SWEEP_INTERVAL_SECONDS, verification_codes.sweep, single_runner=True)
+    scheduler.start()
+
     yield
 
     logger.info("Приложение останавливается...")
+    await scheduler.stop()
+    # Досбрасываем отметки активности, накопленные с последнего запуска задачи
+    activity_buffer.flush()
+    password_pool.shutdown()
+    bloom_service.close()
 
 
 # --- Создание основного приложения ---
@@ -69,6 +144,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# --- Ограничение частоты запросов к дорогим эндпоинтам (добавлен до CORS, чтобы 429 получал CORS-заголовки) ---
+app.add_middleware(RateLimitMiddleware)
+
 # --- CORS (Разрешаем запросы с фронтенда/Swagger) ---
 app.add_middleware(
     CORSMiddleware,
@@ -90,4 +168,9 @@ app.mount("/static", StaticFiles(directory="uploads"), name="static")
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to Dialect Messenger API V1"}
\ No newline at end of file
+    return {"message": "Welcome to Dialect Messenger API V1"}
+
+@app.get("/health/jobs")
+def read_job_stats():
+    """Метрики фоновых задач этого воркера: запуски, длительность, число строк, ошибки."""
+    return scheduler.get_stats()
\ No newline at end of file
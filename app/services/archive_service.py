@@ -0,0 +1,263 @@
+"""
+Сервис архивации старых сообщений в холодное хранилище (segment_store).
+
+Архиватор переносит сообщения старше ARCHIVE_HORIZON_DAYS из таблицы messages
+в сжатые сегментные файлы чата и сдвигает границу Chat.archived_up_to_id.
+История чата (message_service.get_chat_history) прозрачно дочитывает архив,
+когда курсор переходит эту границу.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert
+
+from app.db import database, models
+from app.core.config import settings
+from app.core.segment_store import segment_store, ArchivedMessage
+
+logger = logging.getLogger(__name__)
+
+
+def _to_archived(msg: models.Message) -> ArchivedMessage:
+    return ArchivedMessage(
+        id=msg.id,
+        chat_id=msg.chat_id,
+        sender_id=msg.sender_id,
+        sent_at=msg.sent_at,
+        message_type=msg.message_type,
+        status=msg.status,
+        is_pinned=msg.is_pinned,
+        is_edited=msg.is_edited,
+        reply_to_id=msg.reply_to_id,
+        content=msg.content,
+        reply_sender_id=msg.reply_sender_id,
+        reply_message_type=msg.reply_message_type,
+        reply_snippet=msg.reply_snippet,
+        reply_deleted=msg.reply_deleted
+    )
+
+
+def to_message(archived: ArchivedMessage) -> models.Message:
+    """Собирает transient-объект Message (не привязан к сессии) для сериализации в ответ."""
+    return models.Message(
+        id=archived.id,
+        chat_id=archived.chat_id,
+        sender_id=archived.sender_id,
+        sent_at=archived.sent_at,
+        message_type=archived.message_type,
+        status=archived.status,
+        is_pinned=archived.is_pinned,
+        is_edited=archived.is_edited,
+        reply_to_id=archived.reply_to_id,
+        content=archived.content,
+        reply_sender_id=archived.reply_sender_id,
+        reply_message_type=archived.reply_message_type,
+        reply_snippet=archived.reply_snippet,
+        reply_deleted=archived.reply_deleted
+    )
+
+
+def _needs_ref(msg) -> bool:
+    return msg.is_pinned or msg.message_type != models.MessageTypeEnum.text
+
+
+def _ref_row(msg) -> dict:
+    return dict(
+        message_id=msg.id, chat_id=msg.chat_id, message_type=msg.message_type,
+        is_pinned=msg.is_pinned, sent_at=msg.sent_at
+    )
+
+
+def find_horizon_id(db: Session, horizon: datetime) -> int:
+    """
+    Находит максимальный id сообщения, отправленного раньше horizon.
+    id растут вместе с sent_at, поэтому это бинарный поиск по первичному ключу
+    (~40 точечных чтений) вместо сканирования таблицы по sent_at без индекса.
+    """
+    lo = db.query(func.min(models.Message.id)).scalar()
+    hi = db.query(func.max(models.Message.id)).scalar()
+    if lo is None:
+        return 0
+
+    result = 0
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        row = db.query(models.Message.id, models.Message.sent_at).filter(
+            models.Message.id >= mid
+        ).order_by(models.Message.id).first()
+        if row is None or row.id > hi:
+            hi = mid - 1
+        elif row.sent_at < horizon:
+            result = row.id
+            lo = row.id + 1
+        else:
+            hi = mid - 1
+    return result
+
+
+def archive_chat(db: Session, chat_id: int, horizon_id: int) -> int:
+    """
+    Переносит сообщения чата с id <= horizon_id в архив пачками по ARCHIVE_BATCH_SIZE.
+    Последнее сообщение чата всегда остается "горячим" (превью в списке чатов).
+    Возвращает количество перенесенных сообщений.
+    """
+    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    if not chat or chat.deleted_at:
+        return 0
+    # Строки ниже границы очистки ждут удаления воркером - их не архивируем
+    if chat.cleared_before_id > chat.archived_up_to_id:
+        chat.archived_up_to_id = chat.cleared_before_id
+
+    upper_id = horizon_id
+    if chat.last_message_id:
+        upper_id = min(upper_id, chat.last_message_id - 1)
+
+    archived = 0
+    while True:
+        batch = db.query(models.Message).filter(
+            models.Message.chat_id == chat_id,
+            models.Message.id > chat.archived_up_to_id,
+            models.Message.id <= upper_id
+        ).order_by(models.Message.id).limit(settings.ARCHIVE_BATCH_SIZE).all()
+
+        if not batch:
+            break
+
+        # 1. Сначала пишем в сегмент (с fsync), потом удаляем из горячей таблицы.
+        # Если транзакция ниже упадет, сообщения будут заархивированы повторно,
+        # а читатель сегментов отбрасывает дубликаты по id.
+        segment_store.append(chat_id, [_to_archived(m) for m in batch])
+
+        refs = [_ref_row(m) for m in batch if _needs_ref(m)]
+        if refs:
+            db.execute(insert(models.ArchivedMessageRef), refs)
+
+        ids = [m.id for m in batch]
+        db.query(models.MessageRead).filter(
+            models.MessageRead.message_id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.query(models.Message).filter(
+            models.Message.id.in_(ids)
+        ).delete(synchronize_session=False)
+
+        chat.archived_up_to_id = ids[-1]
+        db.commit()
+        archived += len(ids)
+
+    return archived
+
+
+def read_cold_history(
+    chat: models.Chat,
+    before_id: Optional[int],
+    limit: int,
+    skip: int = 0,
+    min_sent_at: Optional[datetime] = None,
+    match: Optional[Callable[[ArchivedMessage], bool]] = None
+) -> List[models.Message]:
+    """Читает из архива до limit сообщений старше before_id (от новых к старым)."""
+    if not chat.archived_up_to_id or limit <= 0:
+        return []
+
+    upper = chat.archived_up_to_id + 1
+    if before_id is not None:
+        upper = min(upper, before_id)
+
+    records = segment_store.read_before(
+        chat.id, upper, limit, skip=skip, min_sent_at=min_sent_at, min_id=chat.cleared_before_id, match=match
+    )
+    return [to_message(r) for r in records]
+
+
+def read_cold_refs(
+    db: Session,
+    chat: models.Chat,
+    filters: list,
+    before_id: Optional[int],
+    limit: int,
+    min_sent_at: Optional[datetime] = None
+) -> List[models.Message]:
+    """
+    Архивные сообщения по условиям на archived_message_refs (закрепленные, медиа),
+    до limit штук старше before_id. Читается по одному блоку на найденное сообщение.
+    """
+    if not chat.archived_up_to_id or limit <= 0:
+        return []
+
+    query = db.query(models.ArchivedMessageRef.message_id).filter(
+        models.ArchivedMessageRef.chat_id == chat.id,
+        models.ArchivedMessageRef.message_id > chat.cleared_before_id,
+        *filters
+    )
+    if before_id is not None:
+        query = query.filter(models.ArchivedMessageRef.message_id < before_id)
+    if min_sent_at is not None:
+        query = query.filter(models.ArchivedMessageRef.sent_at > min_sent_at)
+    ids = [row[0] for row in query.order_by(models.ArchivedMessageRef.message_id.desc()).limit(limit).all()]
+
+    messages = []
+    for message_id in ids:
+        record = segment_store.read_one(chat.id, message_id)
+        if record is not None:
+            messages.append(to_message(record))
+    return messages
+
+
+def backfill_archived_refs(db: Session) -> int:
+    """
+    Строит archived_message_refs для архивов, созданных до появления таблицы.
+    Выполняется, только пока таблица пуста. Возвращает число указателей.
+    """
+    if db.query(models.ArchivedMessageRef.message_id).first() is not None:
+        return 0
+
+    added = 0
+    chats = db.query(models.Chat).filter(
+        models.Chat.archived_up_to_id > models.Chat.cleared_before_id,
+        models.Chat.deleted_at.is_(None)
+    ).all()
+    for chat in chats:
+        records = segment_store.read_before(
+            chat.id, chat.archived_up_to_id + 1, chat.archived_up_to_id,
+            min_id=chat.cleared_before_id, match=_needs_ref
+        )
+        for start in range(0, len(records), settings.ARCHIVE_BATCH_SIZE):
+            db.execute(insert(models.ArchivedMessageRef), [
+                _ref_row(r) for r in records[start:start + settings.ARCHIVE_BATCH_SIZE]
+            ])
+        db.commit()
+        added += len(records)
+
+    if added:
+        logger.info(f"Заполнены указатели на архивные закрепленные и медиа: {added}")
+    return added
+
+
+def run_archive_cycle():
+    """Фоновая задача: архивирует старые сообщения всех чатов и компактит сегменты."""
+    db = database.SessionLocal()
+    try:
+        horizon = datetime.utcnow() - timedelta(days=settings.ARCHIVE_HORIZON_DAYS)
+        horizon_id = find_horizon_id(db, horizon)
+        if horizon_id:
+            chat_ids = [row[0] for row in db.query(models.Message.chat_id).filter(
+                models.Message.id <= horizon_id
+            ).distinct().all()]
+
+            total = 0
+            for chat_id in chat_ids:
+                try:
+                    total += archive_chat(db, chat_id, horizon_id)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Ошибка архивации чата {chat_id}: {e}")
+            if total:
+                logger.info(f"Архиватор: перенесено {total} сообщений из {len(chat_ids)} чатов")
+    finally:
+        db.close()
+
+    compacted = segment_store.compact_all()
+    if compacted:
+        logger.info(f"Компактор: переписано сегментов: {compacted}")
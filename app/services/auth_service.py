@@ -4,10 +4,12 @@ from typing import Optional
 
 from app.db import models, schemas
 from app.services import user_service
-from app.core.security import verify_password
+from app.core.security import verify_and_update_password
+from app.core.phone import is_valid_phone
 
 # Импортируем наш синглтон-сервис
 from ..core.bloom_filter import bloom_service
+from ..core.username_index import username_index
 
 
 def register_new_user(db: Session, user_data: schemas.UserCreate) -> models.User:
@@ -16,7 +18,13 @@ def register_new_user(db: Session, user_data: schemas.UserCreate) -> models.User
     Включает проверки на дубликаты.
     """
 
-    # 1. Проверка на дубликат телефона
+    # 1. Проверка формата и дубликата телефона
+    if not is_valid_phone(user_data.phone_number):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный номер телефона.",
+        )
+
     db_user_by_phone = user_service.get_user_by_phone(db, phone_number=user_data.phone_number)
     if db_user_by_phone:
         raise HTTPException(
@@ -43,9 +51,10 @@ def register_new_user(db: Session, user_data: schemas.UserCreate) -> models.User
     # 3. Если все проверки пройдены, создаем пользователя
     new_user = user_service.create_user(db, user_data=user_data)
 
-    # ⭐ ШАГ 4: Добавляем новый юзернейм в фильтр
+    # ⭐ ШАГ 4: Добавляем новый юзернейм в фильтр и в индекс автодополнения
     if new_user.username:
         bloom_service.add(new_user.username)
+        username_index.add(new_user.username, new_user.id)
 
     return new_user
 
@@ -61,9 +70,16 @@ def authenticate_user(db: Session, phone_number: str, password: str) -> Optional
     if not user:
         return None
 
-    # 2. Проверяем пароль
-    if not verify_password(password, user.password_hash):
+    # 2. Проверяем пароль (в пуле процессов)
+    is_valid, new_hash = verify_and_update_password(password, user.password_hash)
+    if not is_valid:
         return None
 
+    # Хеш посчитан со старыми параметрами Argon2 - сохраняем пересчитанный
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+        user_service.invalidate_user_cache(user.id)
+
     # 3. Все верно, возвращаем пользователя
     return user
\ No newline at end of file
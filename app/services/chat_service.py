@@ -1,15 +1,31 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload, joinedload
 from fastapi import HTTPException, status, UploadFile
-from sqlalchemy import func
-from typing import List
+from sqlalchemy import func, or_, and_, insert, exists
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional, Tuple
 from PIL import Image, UnidentifiedImageError
 import shutil
 import uuid
 import os
 import datetime
+import logging
 
 from app.db import models, schemas
-from app.services import user_service
+from app.core.config import settings
+from app.services import user_service, purge_service
+
+logger = logging.getLogger(__name__)
+
+# Максимум участников в группе (больше - только супергруппа, см. SUPERGROUP_MAX_MEMBERS)
+MAX_GROUP_MEMBERS = 30
+
+# Типы чатов с владельцем, названием и аватаркой
+GROUP_CHAT_TYPES = (models.ChatTypeEnum.group, models.ChatTypeEnum.supergroup)
+
+def _max_members(chat_type: models.ChatTypeEnum) -> int:
+    if chat_type == models.ChatTypeEnum.supergroup:
+        return settings.SUPERGROUP_MAX_MEMBERS
+    return MAX_GROUP_MEMBERS
 
 # --- ВАЛИДАТОР (Дублируем или импортируем, если бы был utils.py) ---
 MAX_FILE_SIZE = 5 * 1024 * 1024
@@ -53,54 +69,184 @@ def _validate_image(file: UploadFile, target_width: int, target_height: int):
 
 # --- ЛОГИКА ЧАТОВ (Без изменений в логике, только код) ---
 
+def get_active_chat(db: Session, chat_id: int) -> Optional[models.Chat]:
+    """Чат по id, если он не удален (удаленные чаты ждут фоновой очистки)."""
+    return db.query(models.Chat).filter(
+        models.Chat.id == chat_id,
+        models.Chat.deleted_at.is_(None)
+    ).first()
+
 def create_private_chat(db: Session, creator: models.User, target_user_id: int) -> models.Chat:
     if creator.id == target_user_id:
         raise HTTPException(status_code=400, detail="Нельзя создать чат с самим собой")
 
-    user1_id, user2_id = creator.id, target_user_id
-    existing_chat = db.query(models.Chat).join(models.ChatParticipant).filter(
-        models.Chat.chat_type == models.ChatTypeEnum.private,
-        models.ChatParticipant.user_id.in_([user1_id, user2_id])
-    ).group_by(models.Chat.id).having(func.count(models.ChatParticipant.user_id) == 2).first()
+    low_id, high_id = sorted((creator.id, target_user_id))
 
+    # 1. Точечное чтение по уникальному ключу пары
+    existing_chat = _get_private_chat_by_pair(db, low_id, high_id)
     if existing_chat:
-        parts = [p.user_id for p in existing_chat.participant_links]
-        if set(parts) == set([user1_id, user2_id]):
-            return existing_chat
+        return _rejoin_private_chat(db, existing_chat, (low_id, high_id))
 
     target_user = user_service.get_user(db, target_user_id)
     if not target_user: raise HTTPException(404, "Пользователь не найден")
 
-    db_chat = models.Chat(chat_type=models.ChatTypeEnum.private, chat_name=None, owner_id=None)
+    # 2. Чат и участники - одной транзакцией. Параллельный запрос с той же парой
+    # упрется в _private_pair_uc: тогда просто возвращаем созданный им чат.
+    db_chat = models.Chat(
+        chat_type=models.ChatTypeEnum.private, chat_name=None, owner_id=None,
+        pair_low_user_id=low_id, pair_high_user_id=high_id, member_count=2
+    )
+    db_chat.participant_links = [
+        models.ChatParticipant(user_id=creator.id),
+        models.ChatParticipant(user_id=target_user.id)
+    ]
     db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing_chat = _get_private_chat_by_pair(db, low_id, high_id)
+        if not existing_chat:
+            raise
+        return _rejoin_private_chat(db, existing_chat, (low_id, high_id))
 
-    db.add(models.ChatParticipant(user_id=creator.id, chat_id=db_chat.id))
-    db.add(models.ChatParticipant(user_id=target_user.id, chat_id=db_chat.id))
-    
-    db.commit()
     db.refresh(db_chat)
     return db_chat
 
+def _get_private_chat_by_pair(db: Session, low_id: int, high_id: int) -> Optional[models.Chat]:
+    return db.query(models.Chat).filter(
+        models.Chat.pair_low_user_id == low_id,
+        models.Chat.pair_high_user_id == high_id
+    ).first()
+
+def _rejoin_private_chat(db: Session, chat: models.Chat, user_ids) -> models.Chat:
+    """
+    Возвращает существующий ЛС. Если кто-то из пары удалил его "для себя",
+    возвращаем его в чат (старая история у него остается скрытой).
+    """
+    present = {link.user_id for link in chat.participant_links}
+    missing = [uid for uid in user_ids if uid not in present]
+    if not missing:
+        return chat
+
+    for uid in missing:
+        db.add(models.ChatParticipant(user_id=uid, chat_id=chat.id, last_cleared_at=func.now()))
+    chat.member_count = 2
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # Параллельный запрос уже вернул участника
+    db.refresh(chat)
+    return chat
+
+def backfill_private_pairs(db: Session) -> int:
+    """
+    Проставляет ключ пары ЛС, созданным до его появления.
+    Если у пары несколько ЛС (дубликаты из-за старой гонки), ключ получает самый активный,
+    остальные остаются доступны, но новые запросы ведут в него.
+    """
+    rows = db.query(
+        models.ChatParticipant.chat_id,
+        func.min(models.ChatParticipant.user_id),
+        func.max(models.ChatParticipant.user_id)
+    ).join(models.Chat).filter(
+        models.Chat.chat_type == models.ChatTypeEnum.private,
+        models.Chat.pair_low_user_id.is_(None),
+        models.Chat.deleted_at.is_(None)
+    ).group_by(models.ChatParticipant.chat_id).having(
+        func.count(models.ChatParticipant.user_id) == 2
+    ).all()
+    if not rows:
+        return 0
+
+    taken = {
+        (low, high) for low, high in db.query(
+            models.Chat.pair_low_user_id, models.Chat.pair_high_user_id
+        ).filter(models.Chat.pair_low_user_id.isnot(None)).all()
+    }
+    pairs = {chat_id: (low, high) for chat_id, low, high in rows}
+    chats = db.query(models.Chat).filter(models.Chat.id.in_(list(pairs))).all()
+
+    updated = 0
+    for chat in sorted(chats, key=lambda c: (c.last_activity_at, c.id), reverse=True):
+        low, high = pairs[chat.id]
+        if (low, high) in taken:
+            continue
+        chat.pair_low_user_id, chat.pair_high_user_id = low, high
+        taken.add((low, high))
+        updated += 1
+    db.commit()
+
+    if updated:
+        logger.info(f"Проставлены ключи пар для ЛС: {updated}")
+    return updated
+
+def backfill_member_counts(db: Session) -> int:
+    """Заполняет member_count у чатов, созданных до появления колонки (одним UPDATE)."""
+    counts = db.query(func.count(models.ChatParticipant.id)).filter(
+        models.ChatParticipant.chat_id == models.Chat.id
+    ).scalar_subquery()
+    updated = db.query(models.Chat).filter(models.Chat.member_count == 0).update(
+        {models.Chat.member_count: counts}, synchronize_session=False
+    )
+    db.commit()
+    return updated
+
+def backfill_last_messages(db: Session) -> int:
+    """
+    Заполняет last_message_id и last_activity_at у чатов, созданных до появления
+    колонок (одним UPDATE). Чаты без сообщений не трогаем.
+    """
+    visible = and_(
+        models.Message.chat_id == models.Chat.id,
+        models.Message.id > models.Chat.cleared_before_id
+    )
+    last_id = db.query(func.max(models.Message.id)).filter(visible).scalar_subquery()
+    last_sent_at = db.query(func.max(models.Message.sent_at)).filter(visible).scalar_subquery()
+    updated = db.query(models.Chat).filter(
+        models.Chat.last_message_id.is_(None),
+        models.Chat.deleted_at.is_(None),
+        exists().where(visible)
+    ).update(
+        {models.Chat.last_message_id: last_id, models.Chat.last_activity_at: last_sent_at},
+        synchronize_session=False
+    )
+    db.commit()
+    return updated
+
+def _validate_user_ids(db: Session, user_ids: List[int]):
+    """Проверяет существование всех пользователей одним запросом (IN)."""
+    found = {row[0] for row in db.query(models.User.id).filter(models.User.id.in_(user_ids)).all()}
+    for uid in user_ids:
+        if uid not in found:
+            raise HTTPException(404, f"User {uid} not found")
+
+def _insert_participants(db: Session, chat_id: int, user_ids: List[int]):
+    """Вставляет участников одним INSERT (executemany), без коммита."""
+    if user_ids:
+        db.execute(insert(models.ChatParticipant), [{"chat_id": chat_id, "user_id": uid} for uid in user_ids])
+
 def create_group_chat(db: Session, creator: models.User, group_data: schemas.ChatCreateGroup) -> models.Chat:
     participant_ids = group_data.participant_ids
     if creator.id not in participant_ids: participant_ids.append(creator.id)
     participant_ids = list(set(participant_ids))
 
-    if len(participant_ids) > 30: raise HTTPException(400, "Максимум 30 участников.")
+    chat_type = group_data.chat_type
+    if chat_type == models.ChatTypeEnum.private: raise HTTPException(400, "Для ЛС используйте /chats/private")
+    max_members = _max_members(chat_type)
+    if len(participant_ids) > max_members: raise HTTPException(400, f"Максимум {max_members} участников.")
 
-    for uid in participant_ids:
-        if not user_service.get_user(db, uid): raise HTTPException(404, f"User {uid} not found")
+    _validate_user_ids(db, participant_ids)
 
-    db_chat = models.Chat(chat_type=models.ChatTypeEnum.group, chat_name=group_data.chat_name, owner_id=creator.id)
+    # Чат и все участники - одна транзакция
+    db_chat = models.Chat(
+        chat_type=chat_type, chat_name=group_data.chat_name, owner_id=creator.id,
+        member_count=len(participant_ids)
+    )
     db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
+    db.flush()
+    _insert_participants(db, db_chat.id, participant_ids)
 
-    for uid in participant_ids:
-        db.add(models.ChatParticipant(user_id=uid, chat_id=db_chat.id))
-    
     db.commit()
     db.refresh(db_chat)
     return db_chat
@@ -108,10 +254,10 @@ def create_group_chat(db: Session, creator: models.User, group_data: schemas.Cha
 
 # --- ОБНОВЛЕННАЯ ЗАГРУЗКА АВАТАРКИ ГРУППЫ ---
 def upload_chat_avatar(db: Session, chat_id: int, user_id: int, file: UploadFile) -> str:
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     
-    if chat.chat_type != models.ChatTypeEnum.group:
+    if chat.chat_type not in GROUP_CHAT_TYPES:
         raise HTTPException(400, "Аватарки только для групп")
         
     if chat.owner_id != user_id:
@@ -140,11 +286,11 @@ def upload_chat_avatar(db: Session, chat_id: int, user_id: int, file: UploadFile
 
 def delete_chat_avatar(db: Session, chat_id: int, user_id: int) -> models.Chat:
     """Удаляет аватарку группы и файл с диска."""
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat:
         raise HTTPException(404, "Chat not found")
         
-    if chat.chat_type != models.ChatTypeEnum.group:
+    if chat.chat_type not in GROUP_CHAT_TYPES:
         raise HTTPException(400, "Удаление аватарки возможно только для групп")
         
     # Права: только владелец
@@ -160,31 +306,123 @@ def delete_chat_avatar(db: Session, chat_id: int, user_id: int) -> models.Chat:
     db.commit()
     return chat
 
-def get_user_chats(db: Session, user_id: int) -> List[models.Chat]:
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user: raise HTTPException(404, "User not found")
-    return [link.chat for link in user.chat_links]
+def get_user_chats(
+    db: Session,
+    user_id: int,
+    limit: Optional[int] = None,
+    before_activity: Optional[datetime.datetime] = None,
+    before_id: Optional[int] = None
+) -> List[models.Chat]:
+    """
+    Список чатов пользователя, отсортированный по активности (новые сверху).
 
-def add_user_to_chat(db: Session, chat_id: int, user_id: int, requester_id: int):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    Загружается фиксированным числом запросов независимо от количества чатов:
+    1. Чаты пользователя (JOIN chat_participants).
+    2. Участники всех чатов (selectin) + их профили (JOIN users).
+       У супергрупп грузится только сам пользователь (список - GET /chats/{id}/members).
+    3. Последние сообщения всех чатов (selectin).
+
+    Пагинация курсором (keyset): передайте last_activity_at и id последнего
+    чата предыдущей страницы в before_activity / before_id.
+    """
+    query = db.query(models.Chat).join(
+        models.ChatParticipant, models.ChatParticipant.chat_id == models.Chat.id
+    ).filter(
+        models.ChatParticipant.user_id == user_id,
+        models.Chat.deleted_at.is_(None)
+    ).options(
+        selectinload(models.Chat.participant_links.and_(or_(
+            models.ChatParticipant.user_id == user_id,
+            ~exists().where(
+                models.Chat.id == models.ChatParticipant.chat_id,
+                models.Chat.chat_type == models.ChatTypeEnum.supergroup
+            )
+        ))).joinedload(models.ChatParticipant.user),
+        selectinload(models.Chat.last_message)
+    )
+
+    if before_activity is not None:
+        if before_id is not None:
+            query = query.filter(or_(
+                models.Chat.last_activity_at < before_activity,
+                and_(models.Chat.last_activity_at == before_activity, models.Chat.id < before_id)
+            ))
+        else:
+            query = query.filter(models.Chat.last_activity_at < before_activity)
+
+    query = query.order_by(models.Chat.last_activity_at.desc(), models.Chat.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def add_users_to_chat(db: Session, chat_id: int, user_ids: List[int], requester_id: int) -> List[int]:
+    """
+    Добавляет пользователей в группу пачкой. Уже состоящие в чате пропускаются.
+    Членство проверяется только для переданных ID (индекс chat_id, user_id),
+    размер группы берется из member_count. Возвращает добавленные ID.
+    """
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     if chat.chat_type == models.ChatTypeEnum.private: raise HTTPException(400, "Private chat error")
-    
-    is_member = db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=requester_id).first()
-    if not is_member: raise HTTPException(403, "Not member")
-    
-    count = db.query(func.count(models.ChatParticipant.id)).filter_by(chat_id=chat_id).scalar()
-    if count >= 30: raise HTTPException(400, "Full group")
-    
-    if db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id).first():
-        raise HTTPException(400, "User already in chat")
-        
-    db.add(models.ChatParticipant(chat_id=chat_id, user_id=user_id))
+
+    candidates = list(dict.fromkeys(user_ids))
+    present = {row[0] for row in db.query(models.ChatParticipant.user_id).filter(
+        models.ChatParticipant.chat_id == chat_id,
+        models.ChatParticipant.user_id.in_(candidates + [requester_id])
+    ).all()}
+    if requester_id not in present: raise HTTPException(403, "Not member")
+
+    new_ids = [uid for uid in candidates if uid not in present]
+    if not new_ids:
+        return []
+    if chat.member_count + len(new_ids) > _max_members(chat.chat_type): raise HTTPException(400, "Full group")
+
+    _validate_user_ids(db, new_ids)
+    _insert_participants(db, chat_id, new_ids)
+    chat.member_count = models.Chat.member_count + len(new_ids)
     db.commit()
+    return new_ids
+
+def add_user_to_chat(db: Session, chat_id: int, user_id: int, requester_id: int):
+    if not add_users_to_chat(db, chat_id, [user_id], requester_id):
+        raise HTTPException(400, "User already in chat")
     return True
 
+def upgrade_to_supergroup(db: Session, chat_id: int, requester_id: int) -> models.Chat:
+    """Превращает группу в супергруппу (снимает лимит в MAX_GROUP_MEMBERS участников)."""
+    chat = get_active_chat(db, chat_id)
+    if not chat: raise HTTPException(404, "Chat not found")
+    if chat.chat_type != models.ChatTypeEnum.group: raise HTTPException(400, "Group only")
+    if chat.owner_id != requester_id: raise HTTPException(403, "Owner only")
+
+    chat.chat_type = models.ChatTypeEnum.supergroup
+    chat.member_count = db.query(func.count(models.ChatParticipant.id)).filter_by(chat_id=chat_id).scalar()
+    db.commit()
+    db.refresh(chat)
+    return chat
+
+def get_chat_members(
+    db: Session,
+    chat_id: int,
+    requester_id: int,
+    limit: int = 100,
+    after_user_id: int = 0
+) -> List[models.ChatParticipant]:
+    """Участники чата постранично (курсор - user_id последнего участника предыдущей страницы)."""
+    chat = get_active_chat(db, chat_id)
+    if not chat: raise HTTPException(404, "Chat not found")
+    if not db.query(models.ChatParticipant.id).filter_by(chat_id=chat_id, user_id=requester_id).first():
+        raise HTTPException(403, "Not member")
+
+    return db.query(models.ChatParticipant).options(
+        joinedload(models.ChatParticipant.user)
+    ).filter(
+        models.ChatParticipant.chat_id == chat_id,
+        models.ChatParticipant.user_id > after_user_id
+    ).order_by(models.ChatParticipant.user_id).limit(limit).all()
+
 def remove_user_from_chat(db: Session, chat_id: int, user_id_to_remove: int, requester_id: int):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     if user_id_to_remove != requester_id and chat.owner_id != requester_id:
         raise HTTPException(403, "Owner only")
@@ -192,11 +430,12 @@ def remove_user_from_chat(db: Session, chat_id: int, user_id_to_remove: int, req
     part = db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id_to_remove).first()
     if not part: raise HTTPException(404, "Not found")
     db.delete(part)
+    chat.member_count = models.Chat.member_count - 1
     db.commit()
     return True
 
 def set_custom_nickname(db: Session, chat_id: int, target_user_id: int, nickname: str, requester_id: int):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     if target_user_id != requester_id and chat.owner_id != requester_id:
         raise HTTPException(403, "Permission denied")
@@ -208,61 +447,70 @@ def set_custom_nickname(db: Session, chat_id: int, target_user_id: int, nickname
     return True
 
 def update_chat_name(db: Session, chat_id: int, new_name: str, requester_id: int):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
-    if chat.chat_type != models.ChatTypeEnum.group: raise HTTPException(400, "Group only")
+    if chat.chat_type not in GROUP_CHAT_TYPES: raise HTTPException(400, "Group only")
     if chat.owner_id != requester_id: raise HTTPException(403, "Owner only")
     chat.chat_name = new_name
     db.commit()
     return True
 
-def delete_chat(db: Session, chat_id: int, user_id: int, for_everyone: bool) -> List[int]:
+def delete_chat(db: Session, chat_id: int, user_id: int, for_everyone: bool) -> Tuple[List[int], Optional[models.ChatPurgeJob]]:
     """
-    Удаляет чат и возвращает список ID пользователей, которых нужно уведомить.
+    Удаляет чат и возвращает (ID пользователей для уведомления, задачу фоновой очистки).
+    Удаление "для всех" мгновенно скрывает чат, а сообщения удаляются воркером пачками.
     """
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     
     affected_users = []
+    job = None
 
     if for_everyone:
-        if chat.chat_type == models.ChatTypeEnum.group and chat.owner_id != user_id:
-            raise HTTPException(403, "Owner only")
-        if chat.chat_type == models.ChatTypeEnum.private and not db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id).first():
+        if not db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id).first():
             raise HTTPException(403, "Not member")
+        if chat.chat_type in GROUP_CHAT_TYPES and chat.owner_id != user_id:
+            raise HTTPException(403, "Owner only")
             
         # Собираем всех участников для уведомления
         participants = db.query(models.ChatParticipant).filter(models.ChatParticipant.chat_id == chat_id).all()
         affected_users = [p.user_id for p in participants]
         
-        db.delete(chat)
+        # Логическое удаление + задача на физическую очистку.
+        # Ключ пары освобождаем сразу: новый ЛС можно создать, не дожидаясь воркера.
+        chat.deleted_at = func.now()
+        chat.pair_low_user_id = None
+        chat.pair_high_user_id = None
+        job = purge_service.enqueue_purge(db, chat_id, models.PurgeKindEnum.delete_chat, requested_by=user_id)
     else:
         part = db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id).first()
         if part: 
             db.delete(part)
+            chat.member_count = models.Chat.member_count - 1
             affected_users = [user_id]
             
     db.commit()
-    return affected_users
+    return affected_users, job
 
-def clear_chat_history(db: Session, chat_id: int, user_id: int, for_everyone: bool) -> List[int]:
+def clear_chat_history(db: Session, chat_id: int, user_id: int, for_everyone: bool) -> Tuple[List[int], Optional[models.ChatPurgeJob]]:
     """
-    Очищает историю и возвращает список ID пользователей для уведомления.
+    Очищает историю и возвращает (ID пользователей для уведомления, задачу фоновой очистки).
     """
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = get_active_chat(db, chat_id)
     if not chat: raise HTTPException(404, "Chat not found")
     
     from app.services import message_service 
     
     affected_users = []
+    job = None
 
     if for_everyone:
-        if chat.chat_type == models.ChatTypeEnum.group and chat.owner_id != user_id:
-             raise HTTPException(403, "Owner only")
         if not db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=user_id).first():
              raise HTTPException(403, "Not member")
+        if chat.chat_type in GROUP_CHAT_TYPES and chat.owner_id != user_id:
+             raise HTTPException(403, "Owner only")
              
-        message_service.delete_all_messages_in_chat(db, chat_id)
+        job = message_service.delete_all_messages_in_chat(db, chat_id, requested_by=user_id)
         
         # Уведомляем всех участников
         participants = db.query(models.ChatParticipant).filter(models.ChatParticipant.chat_id == chat_id).all()
@@ -275,4 +523,4 @@ def clear_chat_history(db: Session, chat_id: int, user_id: int, for_everyone: bo
         affected_users = [user_id]
         
         db.commit()
-    return affected_users
\ No newline at end of file
+    return affected_users, job
@@ -1,4 +1,6 @@
-from typing import Dict, List
+import asyncio
+import json
+from typing import Dict, Iterable, List
 from fastapi import WebSocket
 
 class ConnectionManager:
@@ -38,6 +40,28 @@ class ConnectionManager:
             return True
         return False
     
+    async def broadcast(self, message: dict, user_ids: Iterable[int]) -> int:
+        """
+        Рассылает одно событие многим пользователям.
+        JSON сериализуется один раз, отправка на все соединения идет параллельно.
+        Возвращает число пользователей, у которых есть активные соединения.
+        """
+        user_ids = set(user_ids)  # Генератор можно обойти только один раз
+        connections = [
+            connection
+            for user_id in user_ids
+            for connection in self.active_connections.get(user_id, [])
+        ]
+        if not connections:
+            return 0
+
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        await asyncio.gather(
+            *(connection.send_text(text) for connection in connections),
+            return_exceptions=True  # Мертвые соединения не мешают остальным
+        )
+        return sum(1 for user_id in user_ids if user_id in self.active_connections)
+
     def is_user_online(self, user_id: int) -> bool:
         """Проверяет, подключен ли пользователь."""
         return user_id in self.active_connections
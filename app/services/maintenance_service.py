@@ -0,0 +1,104 @@
+"""
+Периодическое обслуживание БД и файлов (задача планировщика "maintenance").
+
+- истекшие сессии (user_sessions.expires_at в прошлом);
+- устройства для пушей без регистрации и успешной доставки пуша за
+  USER_DEVICE_STALE_DAYS дней (last_active_at обновляет notification_service);
+- осиротевшие аватарки/баннеры в uploads/ (файл есть, ссылки на него нет).
+
+Строки удаляются пачками по MAINTENANCE_BATCH_SIZE - каждая пачка в своей
+короткой транзакции, не больше MAINTENANCE_MAX_BATCHES пачек таблицы за запуск.
+Задача запускается в одном воркере (single_runner в планировщике).
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db import database, models
+from app.services import session_service
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = "uploads"
+
+# Префиксы файлов, на которые ссылаются колонки *_url (см. upload_avatar/upload_banner/upload_chat_avatar).
+# Вложения сообщений (attachment_*) не трогаем: ссылка на них лежит внутри зашифрованного content.
+_OWNED_PREFIXES = ("avatar_", "banner_", "chat_")
+
+
+def _delete_in_batches(db: Session, model, id_column, filters) -> int:
+    """SELECT id ... LIMIT n, затем DELETE ... WHERE id IN (...) - до MAINTENANCE_MAX_BATCHES раз."""
+    total = 0
+    for _ in range(settings.MAINTENANCE_MAX_BATCHES):
+        ids = [row[0] for row in db.query(id_column).filter(*filters).limit(settings.MAINTENANCE_BATCH_SIZE).all()]
+        if not ids:
+            break
+        db.query(model).filter(id_column.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        total += len(ids)
+    return total
+
+
+def cleanup_stale_devices(db: Session) -> int:
+    """
+    FCM токены, на которые давно ничего не доставлялось и которые не перерегистрировались.
+    Активному устройству пуши доходят, и каждая доставка сдвигает last_active_at.
+    """
+    horizon = datetime.utcnow() - timedelta(days=settings.USER_DEVICE_STALE_DAYS)
+    return _delete_in_batches(db, models.UserDevice, models.UserDevice.id, [
+        models.UserDevice.last_active_at < horizon
+    ])
+
+
+def cleanup_orphaned_uploads(db: Session) -> int:
+    """Удаляет файлы аватарок/баннеров, на которые больше не ссылается ни один пользователь или чат."""
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+
+    horizon = time.time() - settings.ORPHAN_UPLOAD_GRACE_HOURS * 3600
+    candidates = []
+    with os.scandir(UPLOADS_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.startswith(_OWNED_PREFIXES) and entry.stat().st_mtime < horizon:
+                candidates.append(entry.name)
+    if not candidates:
+        return 0
+
+    # Ссылки ищем только на кандидатов - чанками IN, без выгрузки всех URL
+    referenced = set()
+    for i in range(0, len(candidates), settings.MAINTENANCE_BATCH_SIZE):
+        urls = [f"/static/{name}" for name in candidates[i:i + settings.MAINTENANCE_BATCH_SIZE]]
+        for column in (models.User.avatar_url, models.User.banner_url, models.Chat.avatar_url):
+            referenced.update(row[0] for row in db.query(column).filter(column.in_(urls)).all())
+
+    removed = 0
+    for name in candidates:
+        if f"/static/{name}" in referenced:
+            continue
+        try:
+            os.remove(os.path.join(UPLOADS_DIR, name))
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл {name}: {e}")
+    return removed
+
+
+def run_maintenance() -> int:
+    """Задача планировщика. Возвращает общее число удаленных строк и файлов (для метрик)."""
+    db = database.SessionLocal()
+    try:
+        sessions = session_service.cleanup_expired_sessions(
+            db, batch_size=settings.MAINTENANCE_BATCH_SIZE, max_batches=settings.MAINTENANCE_MAX_BATCHES
+        )
+        devices = cleanup_stale_devices(db)
+        files = cleanup_orphaned_uploads(db)
+    finally:
+        db.close()
+
+    if sessions or devices or files:
+        logger.info(f"Обслуживание: сессий {sessions}, устройств {devices}, файлов {files}")
+    return sessions + devices + files
@@ -1,15 +1,68 @@
+import logging
+
 from sqlalchemy.orm import Session
 from sqlalchemy import update, and_, func
-from typing import List
+from typing import List, Optional
 from fastapi import HTTPException, status
 
 from app.db import models, schemas
-from app.services import user_service
+from app.services import user_service, archive_service, purge_service
+from app.core.segment_store import segment_store
+from app.services.connection_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста в превью (список чатов, цитата ответа)
+PREVIEW_MAX_LENGTH = 100
+# Сколько байт BLOB читать для превью: до 4 байт на символ UTF-8
+PREVIEW_MAX_BYTES = PREVIEW_MAX_LENGTH * 4
+# Размер пачки ID в запросах IN (онлайн-участники супергрупп)
+IN_CHUNK_SIZE = 1000
+# Сколько прочитавших возвращать для сообщения супергруппы
+READERS_PAGE_LIMIT = 100
+
+def make_snippet(content, max_length: int = PREVIEW_MAX_LENGTH) -> str:
+    """Обрезает контент сообщения до короткого превью (по символам, а не байтам)."""
+    if content is None:
+        return ""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    return content[:max_length]
+
+def _load_reply_source(db: Session, chat: models.Chat, message_id: int):
+    """
+    Находит исходное сообщение для цитаты: только нужные колонки и префикс контента
+    (без загрузки всего BLOB). Если сообщение уже в архиве - читает его оттуда.
+    Возвращает объект с полями chat_id, sender_id, message_type, content или None.
+    """
+    if message_id <= chat.cleared_before_id:
+        return None
+    source = db.query(
+        models.Message.chat_id,
+        models.Message.sender_id,
+        models.Message.message_type,
+        func.substr(models.Message.content, 1, PREVIEW_MAX_BYTES).label("content")
+    ).filter(models.Message.id == message_id).first()
+    if source is None and message_id <= chat.archived_up_to_id:
+        source = segment_store.read_one(chat.id, message_id)
+    return source
+
+def _set_reply_preview(msg: models.Message, source):
+    if source is None:
+        msg.reply_snippet = None
+        msg.reply_deleted = True
+        return
+    msg.reply_snippet = make_snippet(source.content)
+    msg.reply_sender_id = source.sender_id
+    msg.reply_message_type = source.message_type
+    msg.reply_deleted = False
 
 def check_is_participant(db: Session, chat_id: int, user_id: int):
-    participant = db.query(models.ChatParticipant).filter(
+    # Удаленные чаты (ожидающие фоновой очистки) недоступны
+    participant = db.query(models.ChatParticipant).join(models.Chat).filter(
         models.ChatParticipant.chat_id == chat_id,
-        models.ChatParticipant.user_id == user_id
+        models.ChatParticipant.user_id == user_id,
+        models.Chat.deleted_at.is_(None)
     ).first()
     if not participant:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Вы не участник")
@@ -26,15 +79,19 @@ def create_message(
     # 2. Проверка ЧС (Для ЛС)
     chat = db.query(models.Chat).filter(models.Chat.id == msg_data.chat_id).first()
     if chat.chat_type == models.ChatTypeEnum.private:
-        # Ищем собеседника
-        other_participant = db.query(models.ChatParticipant).filter(
-            models.ChatParticipant.chat_id == msg_data.chat_id,
-            models.ChatParticipant.user_id != sender_id
-        ).first()
+        # Собеседник - из ключа пары, без запроса к участникам
+        if chat.pair_low_user_id is not None:
+            other_user_id = chat.pair_high_user_id if chat.pair_low_user_id == sender_id else chat.pair_low_user_id
+        else:
+            other_participant = db.query(models.ChatParticipant.user_id).filter(
+                models.ChatParticipant.chat_id == msg_data.chat_id,
+                models.ChatParticipant.user_id != sender_id
+            ).first()
+            other_user_id = other_participant[0] if other_participant else None
         
-        if other_participant:
-            # Проверяем: "Заблокировал ли СОБЕСЕДНИК (other) МЕНЯ (sender)?"
-            if user_service.is_blocked(db, blocker_id=other_participant.user_id, target_id=sender_id):
+        if other_user_id is not None:
+            # Проверяем: "Заблокировал ли СОБЕСЕДНИК (other) МЕНЯ (sender)?" (кэш черных списков)
+            if user_service.is_blocked(db, blocker_id=other_user_id, target_id=sender_id):
                 raise HTTPException(status.HTTP_403_FORBIDDEN, "Вы находитесь в черном списке этого пользователя")
 
     # 3. Создаем запись
@@ -46,29 +103,162 @@ def create_message(
         status=models.MessageStatusEnum.sent,
         reply_to_id=msg_data.reply_to_id  # Ответ на сообщение
     )
+
+    # Ответ: сохраняем превью цитаты сразу, чтобы история и рассылка его не искали
+    if msg_data.reply_to_id:
+        source = _load_reply_source(db, chat, msg_data.reply_to_id)
+        if source is None or source.chat_id != chat.id:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Сообщение для ответа не найдено в этом чате")
+        _set_reply_preview(db_msg, source)
     
     db.add(db_msg)
+    db.flush()  # Получаем id сообщения до коммита
+
+    # 4. Обновляем денормализованные поля чата (для списка чатов)
+    chat.last_message_id = db_msg.id
+    chat.last_activity_at = func.now()
+
     db.commit()
     db.refresh(db_msg)
     return db_msg
 
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import update, and_, func
+def get_chat_history(
+    db: Session,
+    chat_id: int,
+    user_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    before_id: Optional[int] = None
+) -> List[models.Message]:
+    """
+    История чата от новых к старым.
+    Пагинация: offset или курсор before_id (id самого старого полученного сообщения).
+    Когда горячая таблица заканчивается, история дочитывается из архива (cold storage).
+    """
+    participant = check_is_participant(db, chat_id, user_id)
+    chat = participant.chat
+    # Превью ответов хранится в самих строках (reply_snippet и т.д.) - родителей не грузим
+    query = db.query(models.Message).filter(models.Message.chat_id == chat_id)
+    if chat.cleared_before_id:
+        # История очищена "для всех" - старые строки ждут фоновой очистки
+        query = query.filter(models.Message.id > chat.cleared_before_id)
+    if participant.last_cleared_at:
+        query = query.filter(models.Message.sent_at > participant.last_cleared_at)
+    if before_id is not None:
+        query = query.filter(models.Message.id < before_id)
+    messages = query.order_by(models.Message.id.desc()).limit(limit).offset(offset).all()
 
-# ... (imports)
+    # Горячих сообщений не хватило - проверяем архив
+    if len(messages) >= limit or chat.archived_up_to_id <= chat.cleared_before_id:
+        return messages
 
-def get_chat_history(db: Session, chat_id: int, user_id: int, limit: int = 50, offset: int = 0) -> List[models.Message]:
+    if messages:
+        cold_before, cold_skip = messages[-1].id, 0
+    else:
+        # Страница целиком в архиве: пропускаем то, что offset "съел" в горячей части
+        cold_before = before_id
+        cold_skip = max(0, offset - query.count()) if offset else 0
+
+    cold = archive_service.read_cold_history(
+        chat, cold_before, limit - len(messages),
+        skip=cold_skip, min_sent_at=participant.last_cleared_at
+    )
+    return messages + cold
+
+def _get_filtered_history(
+    db: Session,
+    chat_id: int,
+    user_id: int,
+    filters: list,
+    ref_filters: list,
+    limit: int,
+    before_id: Optional[int]
+) -> List[models.Message]:
+    """
+    Выборка из истории по фильтру (закрепленные, медиа) с курсором before_id.
+    filters - условия для горячей таблицы (покрыты составным индексом),
+    ref_filters - те же условия для указателей на архивные сообщения (archived_message_refs).
+    """
     participant = check_is_participant(db, chat_id, user_id)
-    # Eager load reply_to to ensure it's available for serialization
-    query = db.query(models.Message).options(joinedload(models.Message.reply_to)).filter(models.Message.chat_id == chat_id)
+    chat = participant.chat
+    query = db.query(models.Message).filter(models.Message.chat_id == chat_id, *filters)
+    if chat.cleared_before_id:
+        query = query.filter(models.Message.id > chat.cleared_before_id)
     if participant.last_cleared_at:
         query = query.filter(models.Message.sent_at > participant.last_cleared_at)
-    return query.order_by(models.Message.sent_at.desc()).limit(limit).offset(offset).all()
+    if before_id is not None:
+        query = query.filter(models.Message.id < before_id)
+    messages = query.order_by(models.Message.id.desc()).limit(limit).all()
+
+    if len(messages) >= limit or chat.archived_up_to_id <= chat.cleared_before_id:
+        return messages
+
+    cold = archive_service.read_cold_refs(
+        db, chat, ref_filters, messages[-1].id if messages else before_id, limit - len(messages),
+        min_sent_at=participant.last_cleared_at
+    )
+    return messages + cold
+
+def get_pinned_messages(
+    db: Session,
+    chat_id: int,
+    user_id: int,
+    limit: int = 50,
+    before_id: Optional[int] = None
+) -> List[models.Message]:
+    """Закрепленные сообщения чата (от новых к старым)."""
+    # "== True", а не is_(True): IS TRUE в MySQL не использует индекс дальше префикса chat_id
+    return _get_filtered_history(
+        db, chat_id, user_id,
+        [models.Message.is_pinned == True],  # noqa: E712
+        [models.ArchivedMessageRef.is_pinned == True],  # noqa: E712
+        limit, before_id
+    )
+
+def get_chat_media(
+    db: Session,
+    chat_id: int,
+    user_id: int,
+    message_type: models.MessageTypeEnum,
+    limit: int = 50,
+    before_id: Optional[int] = None
+) -> List[models.Message]:
+    """Медиа-галерея чата: сообщения одного типа (image, video, audio, file)."""
+    if message_type == models.MessageTypeEnum.text:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Тип медиа должен быть image, video, audio или file")
+    return _get_filtered_history(
+        db, chat_id, user_id,
+        [models.Message.message_type == message_type],
+        [models.ArchivedMessageRef.message_type == message_type],
+        limit, before_id
+    )
 
 def get_chat_participants(db: Session, chat_id: int) -> List[int]:
     parts = db.query(models.ChatParticipant.user_id).filter(models.ChatParticipant.chat_id == chat_id).all()
     return [p[0] for p in parts]
 
+def get_online_participants(db: Session, chat_id: int) -> List[int]:
+    """
+    Участники чата, у которых сейчас есть WS-соединение.
+    Онлайн-пользователи проверяются пачками по индексу (chat_id, user_id),
+    поэтому стоимость зависит от числа онлайн, а не от размера чата.
+    """
+    online_ids = list(manager.active_connections)
+    result = []
+    for i in range(0, len(online_ids), IN_CHUNK_SIZE):
+        chunk = online_ids[i:i + IN_CHUNK_SIZE]
+        result.extend(row[0] for row in db.query(models.ChatParticipant.user_id).filter(
+            models.ChatParticipant.chat_id == chat_id,
+            models.ChatParticipant.user_id.in_(chunk)
+        ).all())
+    return result
+
+def get_broadcast_recipients(db: Session, chat: models.Chat) -> List[int]:
+    """Кому рассылать события чата по WS: в супергруппе - только онлайн-участникам."""
+    if chat.chat_type == models.ChatTypeEnum.supergroup:
+        return get_online_participants(db, chat.id)
+    return get_chat_participants(db, chat.id)
+
 # ⭐ ОБНОВЛЕННАЯ ФУНКЦИЯ ПРОЧТЕНИЯ
 def mark_messages_as_read(db: Session, chat_id: int, user_id: int, last_message_id: int):
     """
@@ -85,6 +275,13 @@ def mark_messages_as_read(db: Session, chat_id: int, user_id: int, last_message_
     if last_message_id <= last_read_id:
         return # Уже всё прочитано
 
+    # Супергруппа: только watermark участника, без строк message_reads на каждое сообщение
+    if participant.chat.chat_type == models.ChatTypeEnum.supergroup:
+        participant.last_read_message_id = last_message_id
+        participant.last_read_at = func.now()
+        db.commit()
+        return
+
     # 2. Находим ID сообщений, которые нужно пометить
     # (Чужие сообщения, ID > последнего прочитанного и <= текущего)
     unread_messages = db.query(models.Message.id).filter(
@@ -113,6 +310,7 @@ def mark_messages_as_read(db: Session, chat_id: int, user_id: int, last_message_
 
     # 5. Обновляем "курсор" прочтения у участника
     participant.last_read_message_id = last_message_id
+    participant.last_read_at = func.now()
     db.commit()
 
 def get_message_read_details(db: Session, message_id: int, user_id: int) -> List[models.MessageRead]:
@@ -121,42 +319,160 @@ def get_message_read_details(db: Session, message_id: int, user_id: int) -> List
     if not message: return []
     
     # Проверяем доступ к чату
-    check_is_participant(db, message.chat_id, user_id)
+    participant = check_is_participant(db, message.chat_id, user_id)
+
+    # Супергруппа: прочитавшие - участники, чей watermark дошел до сообщения
+    if participant.chat.chat_type == models.ChatTypeEnum.supergroup:
+        readers = db.query(models.ChatParticipant).filter(
+            models.ChatParticipant.chat_id == message.chat_id,
+            models.ChatParticipant.last_read_message_id >= message_id,
+            models.ChatParticipant.user_id != message.sender_id
+        ).limit(READERS_PAGE_LIMIT).all()
+        return [
+            models.MessageRead(message_id=message_id, user_id=p.user_id, read_at=p.last_read_at or p.joined_at)
+            for p in readers
+        ]
     
     return db.query(models.MessageRead).filter(
         models.MessageRead.message_id == message_id
     ).all()
 
-def update_message(db: Session, message_id: int, user_id: int, new_content: bytes):
+ARCHIVED_MESSAGE_DETAIL = "Сообщение перенесено в архив: его нельзя изменить, удалить или закрепить"
+ARCHIVE_LOOKUP_MAX_CHATS = 20  # Сколько чатов-кандидатов проверяем по сегментам, если chat_id не передан
+
+def _is_archived(db: Session, message_id: int, chat_id: Optional[int]) -> bool:
+    """
+    Есть ли сообщение, которого нет в горячей таблице, в архиве.
+    С chat_id (клиент может передать его в событии) проверка точная. Без него -
+    по указателям на закрепленные и медиа, а затем по сегментам чатов, чья граница
+    архива покрывает id (не больше ARCHIVE_LOOKUP_MAX_CHATS). Удаленное до архивации
+    сообщение в сегментах не найдется и останется "не найдено".
+    """
+    if chat_id is not None:
+        chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+        return (
+            chat is not None and chat.cleared_before_id < message_id <= chat.archived_up_to_id
+            and segment_store.read_one(chat.id, message_id) is not None
+        )
+    if db.query(models.ArchivedMessageRef.message_id).filter(
+        models.ArchivedMessageRef.message_id == message_id
+    ).first() is not None:
+        return True
+    # Ближайшие границы сверху - самые вероятные владельцы id
+    candidate_ids = db.query(models.Chat.id).filter(
+        models.Chat.archived_up_to_id >= message_id,
+        models.Chat.cleared_before_id < message_id
+    ).order_by(models.Chat.archived_up_to_id).limit(ARCHIVE_LOOKUP_MAX_CHATS).all()
+    return any(segment_store.read_one(cid, message_id) is not None for (cid,) in candidate_ids)
+
+
+def get_mutable_message(db: Session, message_id: int, chat_id: Optional[int] = None) -> Optional[models.Message]:
+    """
+    Сообщение для редактирования, удаления и закрепления (только из горячей таблицы).
+    Архивные сообщения неизменяемы: для них - 409, а не "не найдено".
+    """
     message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    if message is None and _is_archived(db, message_id, chat_id):
+        raise HTTPException(status.HTTP_409_CONFLICT, ARCHIVED_MESSAGE_DETAIL)
+    return message
+
+def update_message(db: Session, message_id: int, user_id: int, new_content: bytes, chat_id: Optional[int] = None):
+    message = get_mutable_message(db, message_id, chat_id)
     if not message: return None
     if message.sender_id != user_id: return False
     message.content = new_content
     message.is_edited = True  # Помечаем как отредактированное
+    # Обновляем цитаты в ответах на это сообщение
+    db.query(models.Message).filter(models.Message.reply_to_id == message_id).update(
+        {models.Message.reply_snippet: make_snippet(new_content)}, synchronize_session=False
+    )
     db.commit()
     db.refresh(message)
     return message
 
-def delete_message(db: Session, message_id: int, user_id: int):
-    message = db.query(models.Message).filter(models.Message.id == message_id).first()
+def delete_message(db: Session, message_id: int, user_id: int, chat_id: Optional[int] = None):
+    message = get_mutable_message(db, message_id, chat_id)
     if not message: return None
     is_author = (message.sender_id == user_id)
     chat = db.query(models.Chat).filter(models.Chat.id == message.chat_id).first()
     is_owner = (chat and chat.owner_id == user_id)
     if is_author or is_owner:
+        # Ответы на сообщение остаются, но цитата превращается в "удалено"
+        db.query(models.Message).filter(models.Message.reply_to_id == message_id).update(
+            {models.Message.reply_snippet: None, models.Message.reply_deleted: True},
+            synchronize_session=False
+        )
         db.delete(message)
+        db.flush()
+        # Если удалили последнее сообщение - сдвигаем превью на предыдущее
+        if chat and chat.last_message_id == message_id:
+            chat.last_message_id = db.query(func.max(models.Message.id)).filter(
+                models.Message.chat_id == chat.id
+            ).scalar()
         db.commit()
         return True
     return False
 
-def pin_message(db: Session, message_id: int, user_id: int, is_pinned: bool):
-    message = db.query(models.Message).filter(models.Message.id == message_id).first()
+def pin_message(db: Session, message_id: int, user_id: int, is_pinned: bool, chat_id: Optional[int] = None):
+    message = get_mutable_message(db, message_id, chat_id)
     if not message: return None
     check_is_participant(db, message.chat_id, user_id)
     message.is_pinned = is_pinned
     db.commit()
     return True
 
-def delete_all_messages_in_chat(db: Session, chat_id: int):
-    db.query(models.Message).filter(models.Message.chat_id == chat_id).delete()
-    db.commit()
\ No newline at end of file
+def delete_all_messages_in_chat(db: Session, chat_id: int, requested_by: int) -> models.ChatPurgeJob:
+    """
+    Очищает историю чата "для всех".
+    Сообщения мгновенно скрываются границей cleared_before_id,
+    а физически удаляются фоновым воркером (purge_service) пачками.
+    """
+    max_id = db.query(func.max(models.Message.id)).filter(models.Message.chat_id == chat_id).scalar()
+    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    up_to_id = max(max_id or 0, chat.archived_up_to_id)
+
+    chat.cleared_before_id = up_to_id
+    chat.last_message_id = None
+    chat.archived_up_to_id = 0
+    job = purge_service.enqueue_purge(
+        db, chat_id, models.PurgeKindEnum.clear_history,
+        requested_by=requested_by, up_to_message_id=up_to_id
+    )
+    db.commit()
+    # Архив целиком ниже границы очистки - удаляем файлы сразу (это не держит блокировок в БД)
+    segment_store.drop_chat(chat_id)
+    return job
+
+
+def backfill_reply_previews(db: Session, batch_size: int = 1000) -> int:
+    """
+    Заполняет превью цитат у ответов, созданных до появления колонок reply_*.
+    Идет пачками по id; возвращает число обновленных сообщений.
+    """
+    updated = 0
+    last_id = 0
+    chats = {}
+    while True:
+        batch = db.query(models.Message).filter(
+            models.Message.id > last_id,
+            models.Message.reply_to_id.isnot(None),
+            models.Message.reply_snippet.is_(None),
+            models.Message.reply_deleted.is_(False)
+        ).order_by(models.Message.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for msg in batch:
+            chat = chats.get(msg.chat_id)
+            if chat is None:
+                chat = chats[msg.chat_id] = db.query(models.Chat).filter(models.Chat.id == msg.chat_id).first()
+            source = _load_reply_source(db, chat, msg.reply_to_id)
+            _set_reply_preview(msg, source if source is not None and source.chat_id == msg.chat_id else None)
+
+        last_id = batch[-1].id
+        updated += len(batch)
+        db.commit()
+
+    if updated:
+        logger.info(f"Заполнены превью ответов: {updated}")
+    return updated
@@ -2,8 +2,14 @@ import firebase_admin
 from firebase_admin import messaging, credentials
 from sqlalchemy.orm import Session
 import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from typing import Dict, List
 
-from app.db import models
+from app.db import database, models
+from app.services.connection_manager import manager
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +25,33 @@ def init_firebase():
     except Exception as e:
         logger.warning(f"Firebase init failed (Push notifications won't work): {e}")
 
+# Успешная доставка продлевает жизнь токена (last_active_at) не чаще раза за этот интервал
+DEVICE_TOUCH_INTERVAL = timedelta(days=1)
+
+def _apply_send_results(db: Session, tokens: List[str], responses):
+    """
+    Итоги отправки по токенам: доставленным обновляем last_active_at (по нему
+    задача обслуживания удаляет устаревшие устройства), а токены, которые FCM
+    больше не знает (UnregisteredError), удаляем сразу.
+    """
+    delivered = [token for token, r in zip(tokens, responses) if r.success]
+    unregistered = [
+        token for token, r in zip(tokens, responses)
+        if not r.success and isinstance(r.exception, messaging.UnregisteredError)
+    ]
+    if delivered:
+        db.query(models.UserDevice).filter(
+            models.UserDevice.fcm_token.in_(delivered),
+            models.UserDevice.last_active_at < datetime.utcnow() - DEVICE_TOUCH_INTERVAL
+        ).update({models.UserDevice.last_active_at: func.now()}, synchronize_session=False)
+    if unregistered:
+        db.query(models.UserDevice).filter(
+            models.UserDevice.fcm_token.in_(unregistered)
+        ).delete(synchronize_session=False)
+        logger.info(f"Удалены незарегистрированные FCM токены: {len(unregistered)}")
+    if delivered or unregistered:
+        db.commit()
+
 def send_push_to_user(db: Session, user_id: int, title: str, body: str, data: dict = None):
     """
     Отправляет пуш на ВСЕ устройства пользователя.
@@ -47,7 +80,97 @@ def send_push_to_user(db: Session, user_id: int, title: str, body: str, data: di
     try:
         response = messaging.send_multicast(message)
         logger.info(f"Push sent to user {user_id}: {response.success_count} success")
-        
-        # (Опционально) Удалить невалидные токены на основе response.responses
+        _apply_send_results(db, tokens, response.responses)
     except Exception as e:
-        logger.error(f"Error sending push: {e}")
\ No newline at end of file
+        logger.error(f"Error sending push: {e}")
+
+
+# --- Пакетные пуши для супергрупп ---
+
+# Максимум сообщений в одном вызове FCM send_each
+FCM_BATCH_SIZE = 500
+
+
+@dataclass
+class PendingChatPush:
+    chat_id: int
+    title: str
+    body: str
+    sender_id: int
+    last_message_id: int
+    count: int = 1
+
+
+class PushBatcher:
+    """
+    Склеивает пуши супергрупп: за окно PUSH_BATCH_INTERVAL_SECONDS на чат копится
+    одна запись (последнее сообщение + счетчик). При сбросе получатели и их токены
+    выбираются одним запросом на чат (офлайн-участники, не прочитавшие последнее
+    сообщение), а уведомления уходят в FCM пачками по FCM_BATCH_SIZE.
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, PendingChatPush] = {}
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: int, title: str, body: str, sender_id: int, message_id: int):
+        with self._lock:
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                self._pending[chat_id] = PendingChatPush(chat_id, title, body, sender_id, message_id)
+            else:
+                pending.title, pending.body = title, body
+                pending.sender_id, pending.last_message_id = sender_id, message_id
+                pending.count += 1
+
+    def flush(self) -> int:
+        """Отправляет накопленное (задача планировщика). Возвращает число токенов."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        sent = 0
+        db = database.SessionLocal()
+        try:
+            for item in pending.values():
+                try:
+                    sent += self._send_chat(db, item)
+                except Exception as e:
+                    logger.error(f"Error sending batched push for chat {item.chat_id}: {e}")
+        finally:
+            db.close()
+        return sent
+
+    def _send_chat(self, db: Session, item: PendingChatPush) -> int:
+        rows = db.query(models.UserDevice.user_id, models.UserDevice.fcm_token).join(
+            models.ChatParticipant, models.ChatParticipant.user_id == models.UserDevice.user_id
+        ).filter(
+            models.ChatParticipant.chat_id == item.chat_id,
+            models.ChatParticipant.user_id != item.sender_id,
+            models.ChatParticipant.last_read_message_id < item.last_message_id
+        ).all()
+
+        # Онлайн-участники уже получили сообщение по WebSocket
+        tokens = [token for user_id, token in rows if not manager.is_user_online(user_id)]
+        if not tokens:
+            return 0
+
+        body = item.body if item.count == 1 else f"{item.count} новых сообщений"
+        messages = [
+            messaging.Message(
+                notification=messaging.Notification(title=item.title, body=body),
+                data={"chat_id": str(item.chat_id)},
+                token=token
+            )
+            for token in tokens
+        ]
+        for i in range(0, len(messages), FCM_BATCH_SIZE):
+            response = messaging.send_each(messages[i:i + FCM_BATCH_SIZE])
+            logger.info(f"Batched push for chat {item.chat_id}: {response.success_count} success")
+            _apply_send_results(db, tokens[i:i + FCM_BATCH_SIZE], response.responses)
+        return len(tokens)
+
+
+# Синглтон, который импортируется во всем приложении
+push_batcher = PushBatcher()
@@ -0,0 +1,145 @@
+"""
+Сервис фоновой очистки истории и удаления чатов.
+
+HTTP-запрос только скрывает данные логически (Chat.cleared_before_id / Chat.deleted_at)
+и ставит задачу в chat_purge_jobs. Воркер (задача планировщика) удаляет строки
+пачками по PURGE_BATCH_SIZE - каждая пачка в своей короткой транзакции, без долгих
+блокировок и раздувания undo-лога. Прогресс хранится в самой задаче.
+"""
+import logging
+from typing import List
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+
+from app.db import database, models
+from app.core.config import settings
+from app.core.segment_store import segment_store
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_purge(
+    db: Session,
+    chat_id: int,
+    kind: models.PurgeKindEnum,
+    requested_by: int,
+    up_to_message_id: int = None
+) -> models.ChatPurgeJob:
+    """Добавляет задачу в сессию (коммит делает вызывающий код вместе с логическим удалением)."""
+    job = models.ChatPurgeJob(
+        chat_id=chat_id,
+        kind=kind,
+        requested_by=requested_by,
+        up_to_message_id=up_to_message_id,
+        status=models.PurgeStatusEnum.pending
+    )
+    db.add(job)
+    return job
+
+
+def get_chat_purge_jobs(db: Session, chat_id: int, user_id: int) -> List[models.ChatPurgeJob]:
+    """Задачи очистки чата, видимые пользователю (инициатор или участник чата)."""
+    is_member = db.query(models.ChatParticipant.id).filter_by(chat_id=chat_id, user_id=user_id).first()
+    query = db.query(models.ChatPurgeJob).filter(models.ChatPurgeJob.chat_id == chat_id)
+    if not is_member:
+        query = query.filter(models.ChatPurgeJob.requested_by == user_id)
+    return query.order_by(models.ChatPurgeJob.id.desc()).limit(20).all()
+
+
+def _purge_batch(db: Session, model, id_column, filters) -> int:
+    """Удаляет одну пачку строк: SELECT id ... LIMIT n, затем DELETE ... WHERE id IN (...)."""
+    ids = [row[0] for row in db.query(id_column).filter(*filters).limit(settings.PURGE_BATCH_SIZE).all()]
+    if not ids:
+        return 0
+    db.query(model).filter(id_column.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+
+def _run_job(db: Session, job: models.ChatPurgeJob, budget: int) -> int:
+    """Выполняет до budget пачек задачи. Возвращает остаток бюджета."""
+    message_filters = [models.Message.chat_id == job.chat_id]
+    if job.up_to_message_id is not None:
+        message_filters.append(models.Message.id <= job.up_to_message_id)
+
+    while budget > 0:
+        # 1. Пачка сообщений; их отметки о прочтении удаляем явно, чтобы каскад не разрастался
+        ids = [row[0] for row in db.query(models.Message.id).filter(
+            *message_filters
+        ).order_by(models.Message.id).limit(settings.PURGE_BATCH_SIZE).all()]
+        if not ids:
+            break
+
+        db.query(models.MessageRead).filter(
+            models.MessageRead.message_id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.query(models.Message).filter(
+            models.Message.id.in_(ids)
+        ).delete(synchronize_session=False)
+        job.purged_messages += len(ids)
+        db.commit()
+        budget -= 1
+
+    if budget <= 0:
+        return 0
+
+    # 2. Указатели на архивные закрепленные и медиа
+    ref_filters = [models.ArchivedMessageRef.chat_id == job.chat_id]
+    if job.up_to_message_id is not None:
+        ref_filters.append(models.ArchivedMessageRef.message_id <= job.up_to_message_id)
+    while budget > 0:
+        removed = _purge_batch(db, models.ArchivedMessageRef, models.ArchivedMessageRef.message_id, ref_filters)
+        db.commit()
+        budget -= 1
+        if not removed:
+            break
+    if budget <= 0:
+        return 0
+
+    if job.kind == models.PurgeKindEnum.delete_chat:
+        # 3. Участники (для больших групп - тоже пачками)
+        while budget > 0:
+            removed = _purge_batch(db, models.ChatParticipant, models.ChatParticipant.id, [
+                models.ChatParticipant.chat_id == job.chat_id
+            ])
+            db.commit()
+            budget -= 1
+            if not removed:
+                break
+        if budget <= 0:
+            return 0
+
+        segment_store.drop_chat(job.chat_id)
+        db.query(models.Chat).filter(models.Chat.id == job.chat_id).delete(synchronize_session=False)
+
+    job.status = models.PurgeStatusEnum.done
+    job.finished_at = func.now()
+    db.commit()
+    return budget
+
+
+def process_pending_jobs():
+    """Фоновая задача: продвигает незавершенные задачи очистки (в порядке создания)."""
+    db = database.SessionLocal()
+    try:
+        budget = settings.PURGE_MAX_BATCHES_PER_RUN
+        jobs = db.query(models.ChatPurgeJob).filter(
+            models.ChatPurgeJob.status.in_([models.PurgeStatusEnum.pending, models.PurgeStatusEnum.running])
+        ).order_by(models.ChatPurgeJob.id).all()
+
+        for job in jobs:
+            if budget <= 0:
+                break
+            try:
+                if job.status == models.PurgeStatusEnum.pending:
+                    job.status = models.PurgeStatusEnum.running
+                    db.commit()
+                budget = _run_job(db, job, budget)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Ошибка очистки чата {job.chat_id} (задача {job.id}): {e}")
+                job.status = models.PurgeStatusEnum.failed
+                job.error = str(e)[:255]
+                db.commit()
+    finally:
+        db.close()
@@ -10,6 +10,8 @@ from sqlalchemy import and_
 from app.db import models
 from app.core.config import settings
 from app.core.security import create_refresh_token, hash_refresh_token
+from app.core.activity import activity_buffer
+from app.core.revocation import session_revocations
 
 
 def create_session(
@@ -45,8 +47,10 @@ def create_session(
         )
     ).first()
     
+    now = datetime.utcnow()
     if existing_session:
         existing_session.is_active = False
+        existing_session.revoked_at = now
         # Не делаем commit здесь, он будет сделан при добавлении новой сессии
     
     session = models.UserSession(
@@ -63,6 +67,9 @@ def create_session(
     db.add(session)
     db.commit()
     db.refresh(session)
+
+    if existing_session:
+        session_revocations.revoke(existing_session.id, now)
     
     return refresh_token, session
 
@@ -76,7 +83,7 @@ def validate_refresh_token(db: Session, refresh_token: str) -> Optional[models.U
     2. Сессия активна (is_active = True)
     3. Срок действия не истек (expires_at > now)
     
-    При успешной валидации обновляет last_used_at.
+    При успешной валидации обновляет last_used_at (через буфер активности, без COMMIT).
     """
     token_hash = hash_refresh_token(refresh_token)
     
@@ -89,9 +96,8 @@ def validate_refresh_token(db: Session, refresh_token: str) -> Optional[models.U
     ).first()
     
     if session:
-        # Обновляем время последнего использования
-        session.last_used_at = datetime.utcnow()
-        db.commit()
+        # Обновляем время последнего использования (в БД уйдет пачкой)
+        activity_buffer.touch_session(session.id)
     
     return session
 
@@ -115,7 +121,10 @@ def revoke_session(db: Session, session_id: int, user_id: int) -> bool:
         return False
     
     session.is_active = False
+    session.revoked_at = datetime.utcnow()
     db.commit()
+    # Access токены этой сессии перестают работать сразу
+    session_revocations.revoke(session.id, session.revoked_at)
     return True
 
 
@@ -139,10 +148,15 @@ def revoke_all_sessions(db: Session, user_id: int, except_session_id: int = None
     sessions = query.all()
     count = len(sessions)
     
+    now = datetime.utcnow()
     for session in sessions:
         session.is_active = False
+        session.revoked_at = now
     
     db.commit()
+    for session in sessions:
+        session_revocations.revoke(session.id, now)
+    session_revocations.revoke_all(user_id, except_session_id, now)
     return count
 
 
@@ -160,19 +174,28 @@ def get_user_sessions(db: Session, user_id: int) -> List[models.UserSession]:
     ).order_by(models.UserSession.last_used_at.desc()).all()
 
 
-def cleanup_expired_sessions(db: Session) -> int:
+def cleanup_expired_sessions(db: Session, batch_size: int = 1000, max_batches: int = 100) -> int:
     """
-    Удаляет все истекшие сессии из базы данных.
-    Можно вызывать периодически через cron-задачу.
+    Удаляет истекшие сессии из базы данных пачками по batch_size строк
+    (каждая пачка - своя короткая транзакция), не больше max_batches пачек за вызов.
+    Вызывается периодически задачей обслуживания (app/services/maintenance_service.py).
     
     Возвращает количество удаленных сессий.
     """
-    result = db.query(models.UserSession).filter(
-        models.UserSession.expires_at <= datetime.utcnow()
-    ).delete()
-    
-    db.commit()
-    return result
+    now = datetime.utcnow()
+    total = 0
+    for _ in range(max_batches):
+        ids = [row[0] for row in db.query(models.UserSession.id).filter(
+            models.UserSession.expires_at <= now
+        ).limit(batch_size).all()]
+        if not ids:
+            break
+        db.query(models.UserSession).filter(
+            models.UserSession.id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+        total += len(ids)
+    return total
 
 
 def get_session_by_id(db: Session, session_id: int, user_id: int) -> Optional[models.UserSession]:
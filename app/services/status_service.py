@@ -0,0 +1,193 @@
+"""
+Истечение временных статусов пользователей (status_text + status_expires_at).
+
+Сроки хранятся в куче (heapq) в памяти процесса: при старте загружаются из БД,
+при смене статуса - добавляются через schedule(). Задача планировщика раз в
+STATUS_EXPIRY_TICK_SECONDS снимает наступившие сроки, очищает статусы пачкой
+UPDATE и рассылает событие собеседникам, которые сейчас онлайн.
+
+Куча у каждого воркера своя, поэтому раз в STATUS_EXPIRY_DB_SYNC_SECONDS она
+подтягивает из БД сроки из профилей, измененных с прошлой синхронизации
+(users.profile_updated_at), и все уже наступившие сроки. Так каждый воркер
+сбрасывает user_cache и уведомляет своих подключенных собеседников, даже если
+статус поставили (или уже очистили) в другом воркере.
+
+Условие status_expires_at <= now в UPDATE защищает от гонок: если статус
+успели продлить (в т.ч. в другом воркере), строка не изменится.
+"""
+import asyncio
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session, aliased
+
+from app.core.config import settings
+from app.db import database, models
+from app.services.connection_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Размер IN в UPDATE / выборке собеседников
+EXPIRE_CHUNK_SIZE = 1000
+# Запас на рассинхрон часов воркеров и долгие транзакции (как в user_service)
+STATUS_SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class StatusExpiryQueue:
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        self._deadlines: Dict[int, datetime] = {}  # Актуальный срок пользователя (старые записи кучи игнорируются)
+        self._lock = threading.Lock()
+        self._synced_at: Optional[datetime] = None  # Последняя синхронизация с БД (None - еще не загружались)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def load(self, db: Session) -> int:
+        """Заполняет кучу сроками из БД (при старте)."""
+        now = datetime.utcnow()
+        rows = db.query(models.User.id, models.User.status_expires_at).filter(
+            models.User.status_expires_at.isnot(None)
+        ).all()
+        with self._lock:
+            self._deadlines = {user_id: expires_at for user_id, expires_at in rows}
+            self._heap = [(expires_at, user_id) for user_id, expires_at in rows]
+            heapq.heapify(self._heap)
+            self._synced_at = now
+        return len(rows)
+
+    def merge(self, rows: List[Tuple[int, datetime]]) -> int:
+        """Добавляет в кучу сроки из БД, которых здесь еще нет. Возвращает число новых."""
+        added = 0
+        with self._lock:
+            for user_id, expires_at in rows:
+                if self._deadlines.get(user_id) != expires_at:
+                    self._deadlines[user_id] = expires_at
+                    heapq.heappush(self._heap, (expires_at, user_id))
+                    added += 1
+        return added
+
+    async def sync(self, now: datetime):
+        """Подтягивает сроки, поставленные другими воркерами, и наступившие сроки из БД."""
+        since = (self._synced_at or now) - STATUS_SYNC_OVERLAP
+        rows = await asyncio.to_thread(_load_deadlines, since, now)
+        self._synced_at = now
+        added = self.merge(rows)
+        if added:
+            logger.debug(f"Сроков статусов из БД: {added}")
+
+    def schedule(self, user_id: int, expires_at: Optional[datetime]):
+        """Новый срок статуса пользователя. None - статус бессрочный (срок снимается)."""
+        with self._lock:
+            if expires_at is None:
+                self._deadlines.pop(user_id, None)
+                return
+            self._deadlines[user_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, user_id))
+
+    def pop_due(self, now: datetime) -> List[int]:
+        """Снимает с кучи всех, у кого срок наступил."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, user_id = heapq.heappop(self._heap)
+                if self._deadlines.get(user_id) == expires_at:
+                    del self._deadlines[user_id]
+                    due.append(user_id)
+        return due
+
+    async def tick(self):
+        """Задача планировщика: очищает истекшие статусы и уведомляет собеседников."""
+        now = datetime.utcnow()
+        if self._synced_at is None or now - self._synced_at >= timedelta(seconds=settings.STATUS_EXPIRY_DB_SYNC_SECONDS):
+            await self.sync(now)
+        due = self.pop_due(now)
+        if not due:
+            return
+        expired, recipients = await asyncio.to_thread(_expire_in_db, due, now)
+        if not expired:
+            return
+
+        from app.services import user_service  # user_service сам импортирует этот модуль
+        for user_id in expired:
+            user_service.invalidate_user_cache(user_id)
+            if recipients.get(user_id):
+                await manager.broadcast(
+                    {"type": "user_status_text", "user_id": user_id, "status_text": None, "status_expires_at": None},
+                    recipients[user_id]
+                )
+        logger.info(f"Истекло статусов: {len(expired)}")
+
+
+def _load_deadlines(since: datetime, now: datetime) -> List[Tuple[int, datetime]]:
+    """Сроки статусов из профилей, измененных после since, и все уже наступившие."""
+    db = database.SessionLocal()
+    try:
+        return [tuple(row) for row in db.query(models.User.id, models.User.status_expires_at).filter(
+            models.User.status_expires_at.isnot(None),
+            or_(models.User.profile_updated_at >= since, models.User.status_expires_at <= now)
+        ).all()]
+    finally:
+        db.close()
+
+
+def _expire_in_db(user_ids: List[int], now: datetime) -> Tuple[List[int], Dict[int, Set[int]]]:
+    """
+    Очищает статусы пачками; возвращает (очищенные, {user_id: онлайн-собеседники}).
+    Очищенными считаются и статусы, которые к этому моменту уже снял другой воркер:
+    его рассылка дошла только до его соединений, о своих сообщаем сами.
+    """
+    db = database.SessionLocal()
+    try:
+        expired = []
+        for i in range(0, len(user_ids), EXPIRE_CHUNK_SIZE):
+            chunk = user_ids[i:i + EXPIRE_CHUNK_SIZE]
+            # Условие по сроку: продленный статус (в т.ч. в другом воркере) не трогаем
+            db.execute(
+                update(models.User).where(
+                    models.User.id.in_(chunk), models.User.status_expires_at <= now
+                ).values(status_text=None, status_expires_at=None),
+                execution_options={"synchronize_session": False}
+            )
+            expired.extend(row[0] for row in db.query(models.User.id).filter(
+                models.User.id.in_(chunk),
+                models.User.status_text.is_(None),
+                models.User.status_expires_at.is_(None)
+            ).all())
+        db.commit()
+        return expired, _online_contacts(db, expired)
+    finally:
+        db.close()
+
+
+def _online_contacts(db: Session, user_ids: List[int]) -> Dict[int, Set[int]]:
+    """Собеседники по ЛС и группам (без супергрупп), подключенные по WebSocket."""
+    online = set(manager.active_connections)
+    if not online or not user_ids:
+        return {}
+
+    me, other = aliased(models.ChatParticipant), aliased(models.ChatParticipant)
+    result = defaultdict(set)
+    for i in range(0, len(user_ids), EXPIRE_CHUNK_SIZE):
+        chunk = user_ids[i:i + EXPIRE_CHUNK_SIZE]
+        rows = db.query(me.user_id, other.user_id).join(
+            other, other.chat_id == me.chat_id
+        ).join(models.Chat, models.Chat.id == me.chat_id).filter(
+            me.user_id.in_(chunk),
+            other.user_id != me.user_id,
+            models.Chat.chat_type != models.ChatTypeEnum.supergroup,
+            models.Chat.deleted_at.is_(None)
+        ).distinct().all()
+        for user_id, contact_id in rows:
+            if contact_id in online:
+                result[user_id].add(contact_id)
+    return result
+
+
+# Синглтон, который импортируется во всем приложении
+status_expiry = StatusExpiryQueue()
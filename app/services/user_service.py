@@ -1,12 +1,20 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-from typing import Optional
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy import or_, and_, update, inspect as sa_inspect
+from typing import FrozenSet, Iterable, List, Optional, Set
 from datetime import datetime, timedelta
 from PIL import Image, UnidentifiedImageError # <-- Нужен Pillow
 import io
 
-from app.db import models, schemas
+from app.db import database, models, schemas
 from app.core.security import get_password_hash
+from app.core.cache import TTLCache
+from app.core.activity import activity_buffer
+from app.services.status_service import status_expiry
+from app.core.config import settings
+from app.core.phone import normalize_phone, phone_prefixes, hash_phone
+from app.core.rate_limit import RateLimiter
+from app.core.search_index import user_search_index
+from app.core.username_index import username_index, MAX_AUTOCOMPLETE_LIMIT
 
 from sqlalchemy.sql import func
 from fastapi import UploadFile, HTTPException, status
@@ -17,6 +25,25 @@ import os
 # --- КОНСТАНТЫ ---
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
 ALLOWED_EXTENSIONS = {"PNG", "JPEG", "JPG", "WEBP"}
+MAX_USERS_PER_BATCH = 200  # GET /users?ids=...
+
+# Строки пользователей для deps.get_current_user: user_id -> {колонка: значение}
+user_cache: TTLCache[dict] = TTLCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL_SECONDS)
+# Черные списки: blocker_id -> frozenset(blocked_id). Пустой список (почти у всех) - общий объект
+block_cache: TTLCache[FrozenSet[int]] = TTLCache(settings.BLOCK_CACHE_MAX_SIZE, settings.BLOCK_CACHE_TTL_SECONDS)
+_NO_BLOCKS: FrozenSet[int] = frozenset()
+# Размер IN при пакетной загрузке черных списков
+BLOCK_LOAD_CHUNK_SIZE = 1000
+# Запас на рассинхрон часов и незакоммиченные транзакции при синхронизации кэшей и индексов
+BLOCK_SYNC_OVERLAP = timedelta(seconds=30)
+USER_INDEX_SYNC_OVERLAP = timedelta(seconds=30)
+_block_cache_synced_at: Optional[datetime] = None
+# Индексы в памяти строятся при старте процесса - изменения раньше этого момента в них уже есть
+_user_indexes_synced_at: datetime = datetime.utcnow()
+# Размер IN при синхронизации контактов
+CONTACT_SYNC_CHUNK_SIZE = 1000
+
+contact_sync_limiter = RateLimiter(settings.CONTACT_SYNC_RATE_LIMIT, settings.CONTACT_SYNC_RATE_WINDOW_SECONDS)
 
 # --- ХЕЛПЕРЫ ---
 
@@ -99,21 +126,68 @@ def calculate_expiration(duration: schemas.StatusDurationEnum) -> Optional[datet
     if duration == schemas.StatusDurationEnum.hour_24: return now + timedelta(hours=24)
     return None
 
-def check_status_expiration(user: models.User):
-    if user.status_expires_at and user.status_expires_at < datetime.utcnow():
-        user.status_text = None
-        user.status_expires_at = None
-    return user
-
 # --- READ ---
 
 def get_user(db: Session, user_id: int) -> Optional[models.User]:
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user: check_status_expiration(user)
-    return user
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+def get_user_cached(db: Session, user_id: int) -> Optional[models.User]:
+    """
+    get_user через кэш (для зависимостей авторизации, которые вызываются на каждый запрос).
+    Из кэша собирается объект и присоединяется к сессии через merge(load=False) - без SELECT;
+    ленивые связи и изменения с commit работают как у обычно загруженного объекта.
+    """
+    row = user_cache.get(user_id)
+    if row is None:
+        user = get_user(db, user_id)
+        if user:
+            _cache_user(user)
+        return user
+
+    user = models.User(**row)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+def _cache_user(user: models.User):
+    user_cache.set(user.id, {attr.key: getattr(user, attr.key) for attr in sa_inspect(models.User).column_attrs})
+
+def invalidate_user_cache(user_id: int):
+    user_cache.invalidate(user_id)
+
+def get_users_by_ids(db: Session, user_ids: List[int]) -> tuple[List[models.User], List[int]]:
+    """
+    Профили пачкой (список участников, страница поиска): кэш, промахи - одним IN.
+    Возвращает (пользователи в порядке запроса, id которых нет).
+    Пользователи из кэша - не привязанные к сессии объекты, только для ответа API.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) > MAX_USERS_PER_BATCH:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Не больше {MAX_USERS_PER_BATCH} id за один запрос")
+
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        row = user_cache.get(user_id)
+        if row is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = models.User(**row)
+
+    if missing:
+        for user in db.query(models.User).filter(models.User.id.in_(missing)).all():
+            _cache_user(user)
+            users[user.id] = user
+
+    found = [users[uid] for uid in user_ids if uid in users]
+    not_found = [uid for uid in user_ids if uid not in users]
+    return found, not_found
 
 def get_user_by_phone(db: Session, phone_number: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.phone_number == phone_number).first()
+    """Поиск по нормализованному номеру: "+7 (912) 345-67-89" и "89123456789" - один пользователь."""
+    phone_digits = normalize_phone(phone_number)
+    if not phone_digits:
+        return None
+    return db.query(models.User).filter(models.User.phone_digits == phone_digits).first()
 
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.username == username).first()
@@ -122,18 +196,23 @@ def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
 
 def create_user(db: Session, user_data: schemas.UserCreate) -> models.User:
     hashed_password = get_password_hash(user_data.password)
+    phone_digits = normalize_phone(user_data.phone_number)
     db_user = models.User(
         phone_number=user_data.phone_number,
+        phone_digits=phone_digits,
+        phone_hash=hash_phone(phone_digits),
         username=user_data.username,
         first_name=user_data.first_name,
         last_name=user_data.last_name,
         public_key=user_data.public_key,
         password_hash=hashed_password,
-        country=user_data.country
+        country=user_data.country,
+        profile_updated_at=datetime.utcnow()
     )
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_search_index.upsert(db_user)
     return db_user
 
 def search_users(
@@ -149,11 +228,24 @@ def search_users(
     1. Точному совпадению username.
     2. Номеру телефона (игнорируя скобки и пробелы).
     3. Имени, Фамилии и их сочетанию ("Иван Петров").
+
+    Основной путь - триграммный индекс в памяти (app/core/search_index.py) с ранжированием:
+    точный username первым. Пока индекс строится после старта, а также для
+    запросов из слов короче 3 символов - LIKE-запрос ниже.
     """
     if not query_str:
         return []
         
     query_str = query_str.strip()
+
+    ids = None
+    if user_search_index.ready:
+        ids = user_search_index.search(query_str, limit=limit, offset=offset, exclude_user_id=exclude_user_id)
+    if ids is not None:
+        if not ids:
+            return []
+        users = {u.id: u for u in db.query(models.User).filter(models.User.id.in_(ids)).all()}
+        return [users[uid] for uid in ids if uid in users]
     
     # Базовый запрос
     query = db.query(models.User)
@@ -165,11 +257,11 @@ def search_users(
     conditions = []
 
     # --- 1. Поиск по телефону (очищаем от мусора) ---
-    # Если пользователь ввел цифры, ищем их в телефоне
-    clean_phone = "".join(filter(str.isdigit, query_str))
-    if clean_phone and len(clean_phone) >= 3:
-        # Ищем вхождение цифр
-        conditions.append(models.User.phone_number.like(f"%{clean_phone}%"))
+    # Если пользователь ввел цифры, ищем номера, которые с них начинаются
+    # (префикс по нормализованной колонке - диапазон по индексу, а не скан)
+    for prefix in phone_prefixes(query_str):
+        if len(prefix) >= 3:
+            conditions.append(models.User.phone_digits.like(f"{prefix}%"))
 
     # --- 2. Поиск по Username (@username) ---
     # Убираем @ если есть
@@ -205,31 +297,147 @@ def search_users(
     query = query.filter(or_(*conditions))
     
     # Обрабатываем результаты
-    results = query.limit(limit).offset(offset).all()
-    
-    # Проверяем статусы (чтобы не показывать просроченные)
-    for u in results:
-        check_status_expiration(u)
-        
-    return results
+    return query.limit(limit).offset(offset).all()
+
+def autocomplete_usernames(
+    db: Session,
+    prefix: str,
+    exclude_user_id: Optional[int] = None,
+    limit: int = 10
+) -> List[models.User]:
+    """
+    Подсказки "@ali..." по префиксу юзернейма из индекса в памяти (app/core/username_index.py).
+    В БД идет только один запрос по первичным ключам найденных пользователей.
+    """
+    limit = max(1, min(limit, MAX_AUTOCOMPLETE_LIMIT))
+    matches = username_index.complete(prefix, limit=limit, exclude_user_id=exclude_user_id)
+    if not matches:
+        return []
+
+    ids = [user_id for _, user_id in matches]
+    users = {u.id: u for u in db.query(models.User).filter(models.User.id.in_(ids)).all()}
+    return [users[uid] for uid in ids if uid in users]
+
+def _find_by_column(db: Session, column, values: List[str]) -> dict:
+    """value -> User, чанками IN по CONTACT_SYNC_CHUNK_SIZE (поиск по индексу)."""
+    found = {}
+    for i in range(0, len(values), CONTACT_SYNC_CHUNK_SIZE):
+        chunk = values[i:i + CONTACT_SYNC_CHUNK_SIZE]
+        for user in db.query(models.User).filter(column.in_(chunk)).all():
+            found[getattr(user, column.key)] = user
+    return found
+
+def sync_contacts(
+    db: Session,
+    user_id: int,
+    phone_numbers: List[str],
+    phone_hashes: List[str]
+) -> List[dict]:
+    """
+    Сопоставляет адресную книгу клиента с пользователями за один вызов.
+    Номера нормализуются (app/core/phone.py) и ищутся по phone_digits, хеши - по phone_hash,
+    чанками IN. Себя и тех, кто заблокировал текущего пользователя, в ответе нет.
+    """
+    if len(phone_numbers) + len(phone_hashes) > settings.CONTACT_SYNC_MAX_NUMBERS:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Не больше {settings.CONTACT_SYNC_MAX_NUMBERS} номеров за один запрос"
+        )
+    retry_after = contact_sync_limiter.hit(user_id)
+    if retry_after:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            "Слишком частая синхронизация контактов",
+            headers={"Retry-After": str(int(retry_after) + 1)}
+        )
+
+    # 1. Нормализация и дедупликация (один номер может быть записан по-разному)
+    by_digits = {}
+    for raw in phone_numbers:
+        digits = normalize_phone(raw)
+        if digits:
+            by_digits.setdefault(digits, raw)
+    hashes = list(dict.fromkeys(h.lower() for h in phone_hashes if h))
+
+    # 2. Поиск чанками IN
+    users_by_digits = _find_by_column(db, models.User.phone_digits, list(by_digits))
+    users_by_hash = _find_by_column(db, models.User.phone_hash, hashes)
+
+    # 3. Фильтрация: себя не показываем, заблокировавших нас - тоже
+    found_ids = {u.id for u in users_by_digits.values()} | {u.id for u in users_by_hash.values()}
+    found_ids.discard(user_id)
+    hidden = get_blockers_among(db, user_id, found_ids)
+
+    matches = []
+    for digits, user in users_by_digits.items():
+        if user.id != user_id and user.id not in hidden:
+            matches.append({"phone_number": by_digits[digits], "user": user})
+    for phone_hash, user in users_by_hash.items():
+        if user.id != user_id and user.id not in hidden:
+            matches.append({"phone_hash": phone_hash, "user": user})
+    return matches
 
 # --- UPDATE ---
 
-def update_last_seen(db: Session, user_id: int, force_offline: bool = False):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        if force_offline:
-            # Сдвигаем время назад на 6 минут, чтобы is_online (< 5 мин) стало False
-            user.last_seen_at = datetime.utcnow() - timedelta(minutes=6)
-        else:
-            user.last_seen_at = func.now()
+def backfill_phone_digits(db: Session, batch_size: int = 1000) -> int:
+    """Заполняет phone_digits / phone_hash у пользователей, созданных до появления колонок (пачками по id)."""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.query(models.User.id, models.User.phone_number).filter(
+            or_(models.User.phone_digits.is_(None), models.User.phone_hash.is_(None)),
+            models.User.id > last_id
+        ).order_by(models.User.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.execute(update(models.User), [
+            {"id": user_id, "phone_digits": normalize_phone(phone), "phone_hash": hash_phone(normalize_phone(phone))}
+            for user_id, phone in rows
+        ])
         db.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    return updated
+
+def update_last_seen(user_id: int, force_offline: bool = False):
+    """
+    Отметка активности. Пишется в буфер (app/core/activity.py), в БД уходит
+    пачкой задачей планировщика - без запроса на каждый вызов.
+    """
+    if force_offline:
+        # Сдвигаем время назад на 6 минут, чтобы is_online (< 5 мин) стало False
+        activity_buffer.touch_user(user_id, datetime.utcnow() - timedelta(minutes=6))
+    else:
+        activity_buffer.touch_user(user_id)
+
+def sync_user_indexes() -> int:
+    """
+    Задача планировщика: подтягивает в поисковый индекс и индекс автодополнения
+    регистрации и правки профилей, сделанные в других воркерах.
+    Возвращает число обновленных записей.
+    """
+    global _user_indexes_synced_at
+    now = datetime.utcnow()
+    db = database.SessionLocal()
+    try:
+        rows = db.query(
+            models.User.id, models.User.username, models.User.first_name,
+            models.User.last_name, models.User.phone_number
+        ).filter(models.User.profile_updated_at >= _user_indexes_synced_at - USER_INDEX_SYNC_OVERLAP).all()
+    finally:
+        db.close()
+    for row in rows:
+        user_search_index.upsert(tuple(row))  # Неизмененный документ upsert пропускает
+        username_index.set(row.id, row.username)
+    _user_indexes_synced_at = now
+    return len(rows)
 
 def update_user_profile(db: Session, user_id: int, update_data: schemas.UserUpdate) -> models.User:
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user: return None
     
     update_dict = update_data.model_dump(exclude_unset=True)
+    old_username = user.username
     if "status_duration" in update_dict:
         duration_enum = update_dict.pop("status_duration")
         if duration_enum:
@@ -238,9 +446,14 @@ def update_user_profile(db: Session, user_id: int, update_data: schemas.UserUpda
     for key, value in update_dict.items():
         if hasattr(user, key):
             setattr(user, key, value)
+    user.profile_updated_at = datetime.utcnow()
         
     db.commit()
     db.refresh(user)
+    invalidate_user_cache(user.id)
+    status_expiry.schedule(user.id, user.status_expires_at)
+    user_search_index.upsert(user)
+    username_index.rename(old_username, user.username, user.id)
     return user
 
 def upload_avatar(db: Session, user_id: int, file: UploadFile) -> str:
@@ -265,6 +478,7 @@ def upload_avatar(db: Session, user_id: int, file: UploadFile) -> str:
     url = f"/static/{file_name}"
     user.avatar_url = url
     db.commit()
+    invalidate_user_cache(user_id)
     db.refresh(user)
     return url
 
@@ -290,6 +504,7 @@ def upload_banner(db: Session, user_id: int, file: UploadFile) -> str:
     url = f"/static/{file_name}"
     user.banner_url = url
     db.commit()
+    invalidate_user_cache(user_id)
     db.refresh(user)
     return url
 
@@ -306,6 +521,7 @@ def delete_avatar(db: Session, user_id: int):
     # Очищаем поле в БД
     user.avatar_url = None
     db.commit()
+    invalidate_user_cache(user_id)
     db.refresh(user)
     return user
 
@@ -319,6 +535,7 @@ def delete_banner(db: Session, user_id: int):
         
     user.banner_url = None
     db.commit()
+    invalidate_user_cache(user_id)
     db.refresh(user)
     return user
 
@@ -351,20 +568,83 @@ def block_user(db: Session, blocker_id: int, blocked_id: int):
         raise HTTPException(404, "Пользователь не найден")
         
     # Проверка дубликата
-    existing = db.query(models.UserBlock).filter_by(blocker_id=blocker_id, blocked_id=blocked_id).first()
-    if existing:
+    blocked = get_blocked_ids(db, blocker_id)
+    if blocked_id in blocked:
         return # Уже заблокирован
         
     block = models.UserBlock(blocker_id=blocker_id, blocked_id=blocked_id)
     db.add(block)
+    _mark_blocks_changed(db, blocker_id)
     db.commit()
+    block_cache.set(blocker_id, blocked | {blocked_id})
 
 def unblock_user(db: Session, blocker_id: int, blocked_id: int):
     block = db.query(models.UserBlock).filter_by(blocker_id=blocker_id, blocked_id=blocked_id).first()
     if block:
         db.delete(block)
+        _mark_blocks_changed(db, blocker_id)
         db.commit()
+    block_cache.invalidate(blocker_id)
+
+def _mark_blocks_changed(db: Session, blocker_id: int):
+    """Отметка для других воркеров: их block_cache для blocker_id устарел (см. sync_block_cache)."""
+    db.query(models.User).filter(models.User.id == blocker_id).update(
+        {models.User.blocks_changed_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+def sync_block_cache() -> int:
+    """
+    Задача планировщика: сбрасывает в кэше черные списки, измененные другими
+    воркерами с прошлой синхронизации. Возвращает число сброшенных списков.
+    """
+    global _block_cache_synced_at
+    now = datetime.utcnow()
+    # Первый запуск: кэш моложе BLOCK_CACHE_TTL_SECONDS, старше смотреть незачем
+    since = (_block_cache_synced_at or now - timedelta(seconds=settings.BLOCK_CACHE_TTL_SECONDS)) - BLOCK_SYNC_OVERLAP
+    db = database.SessionLocal()
+    try:
+        changed = [row[0] for row in db.query(models.User.id).filter(models.User.blocks_changed_at >= since).all()]
+    finally:
+        db.close()
+    for blocker_id in changed:
+        block_cache.invalidate(blocker_id)
+    _block_cache_synced_at = now
+    return len(changed)
+
+def _set_blocked_ids(blocker_id: int, blocked_ids: Iterable[int]) -> FrozenSet[int]:
+    blocked = frozenset(blocked_ids) or _NO_BLOCKS
+    block_cache.set(blocker_id, blocked)
+    return blocked
+
+def get_blocked_ids(db: Session, blocker_id: int) -> FrozenSet[int]:
+    """Черный список пользователя (из кэша, при промахе - один запрос)."""
+    blocked = block_cache.get(blocker_id)
+    if blocked is None:
+        rows = db.query(models.UserBlock.blocked_id).filter(models.UserBlock.blocker_id == blocker_id).all()
+        blocked = _set_blocked_ids(blocker_id, (row[0] for row in rows))
+    return blocked
 
 def is_blocked(db: Session, blocker_id: int, target_id: int) -> bool:
-    """Проверяет, заблокировал ли blocker_id пользователя target_id."""
-    return db.query(models.UserBlock).filter_by(blocker_id=blocker_id, blocked_id=target_id).first() is not None
\ No newline at end of file
+    """Проверяет, заблокировал ли blocker_id пользователя target_id (O(1) на прогретом кэше)."""
+    return target_id in get_blocked_ids(db, blocker_id)
+
+def get_blockers_among(db: Session, target_id: int, user_ids: Iterable[int]) -> Set[int]:
+    """
+    "Кто из user_ids заблокировал target_id" - для рассылки в группы.
+    Черные списки, которых нет в кэше, загружаются пачкой (IN по BLOCK_LOAD_CHUNK_SIZE).
+    """
+    user_ids = list(user_ids)
+    lists = {uid: block_cache.get(uid) for uid in user_ids}
+    missing = [uid for uid, blocked in lists.items() if blocked is None]
+
+    for i in range(0, len(missing), BLOCK_LOAD_CHUNK_SIZE):
+        chunk = missing[i:i + BLOCK_LOAD_CHUNK_SIZE]
+        loaded = {uid: [] for uid in chunk}
+        for blocker_id, blocked_id in db.query(models.UserBlock.blocker_id, models.UserBlock.blocked_id).filter(
+            models.UserBlock.blocker_id.in_(chunk)
+        ).all():
+            loaded[blocker_id].append(blocked_id)
+        for uid, blocked_ids in loaded.items():
+            lists[uid] = _set_blocked_ids(uid, blocked_ids)
+
+    return {uid for uid, blocked in lists.items() if target_id in blocked}
\ No newline at end of file
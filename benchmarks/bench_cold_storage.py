@@ -0,0 +1,89 @@
+"""
+Бенчмарк холодного хранилища сообщений (app/core/segment_store.py).
+
+Сравнивает оценку размера строк в горячей таблице messages с размером
+сегментных файлов и измеряет задержку чтения страницы истории из архива.
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_cold_storage --messages 200000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app.core.segment_store import SegmentStore, ArchivedMessage
+from app.db.models import MessageTypeEnum, MessageStatusEnum
+
+# Грубая оценка накладных расходов InnoDB на строку messages:
+# фиксированные колонки + заголовок строки + запись во вторичном индексе chat_id
+ROW_OVERHEAD_BYTES = 70
+
+WORDS = ["привет", "как", "дела", "ок", "завтра", "встреча", "в", "офисе", "созвон", "hello", "thanks", "👍"]
+
+
+def _make_messages(chat_id: int, count: int):
+    start = datetime.utcnow() - timedelta(days=365)
+    for i in range(1, count + 1):
+        text = " ".join(random.choices(WORDS, k=random.randint(2, 25))).encode("utf-8")
+        yield ArchivedMessage(
+            id=i,
+            chat_id=chat_id,
+            sender_id=random.randint(1, 2),
+            sent_at=start + timedelta(seconds=i * 30),
+            message_type=MessageTypeEnum.text,
+            status=MessageStatusEnum.read,
+            is_pinned=False,
+            is_edited=False,
+            reply_to_id=None,
+            content=text
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=1000, help="Сообщений за один append (как ARCHIVE_BATCH_SIZE)")
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    store = SegmentStore(tempfile.mkdtemp(prefix="dialect_archive_"))
+    chat_id = 1
+
+    hot_bytes = 0
+    batch = []
+    started = time.perf_counter()
+    for msg in _make_messages(chat_id, args.messages):
+        hot_bytes += len(msg.content) + ROW_OVERHEAD_BYTES
+        batch.append(msg)
+        if len(batch) >= args.batch:
+            store.append(chat_id, batch)
+            batch = []
+    store.append(chat_id, batch)
+    write_seconds = time.perf_counter() - started
+
+    cold_bytes = store.chat_size_bytes(chat_id)
+    print(f"Сообщений:             {args.messages}")
+    print(f"Запись в архив:        {write_seconds:.2f} c ({args.messages / write_seconds:,.0f} сообщ/с)")
+    print(f"Горячая таблица (оц.): {hot_bytes / 1024 / 1024:.1f} MiB")
+    print(f"Сегменты архива:       {cold_bytes / 1024 / 1024:.1f} MiB ({hot_bytes / max(cold_bytes, 1):.1f}x меньше)")
+
+    latencies = []
+    for _ in range(args.reads):
+        before_id = random.randint(args.page + 1, args.messages + 1)
+        t0 = time.perf_counter()
+        page = store.read_before(chat_id, before_id, args.page)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        assert len(page) == args.page and page[0].id == before_id - 1
+
+    latencies.sort()
+    print(f"Чтение страницы ({args.page}) из архива: "
+          f"p50={statistics.median(latencies):.3f} мс, "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1]:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
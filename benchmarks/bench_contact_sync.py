@@ -0,0 +1,140 @@
+"""
+Бенчмарк синхронизации контактов (POST /users/contacts/sync).
+
+Создает --users зарегистрированных пользователей и адресную книгу на
+--contacts номеров (доля --hit-ratio из них зарегистрирована, номера записаны
+в разных форматах: "+7 (9xx) ...", "8 9xx ...", "7 9xx..."). Сравнивает
+прежний сценарий клиента (запрос на каждый номер) с одним вызовом
+user_service.sync_contacts - по номерам и по SHA-256 хешам.
+
+По умолчанию работает на SQLite в памяти (схема та же, BIGINT -> INTEGER),
+для замеров на MySQL передайте --db-url.
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_contact_sync --users 100000 --contacts 5000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import BIGINT, create_engine, event, insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+
+@compiles(BIGINT, "sqlite")
+def _sqlite_bigint(type_, compiler, **kw):
+    # В SQLite автоинкремент работает только у INTEGER PRIMARY KEY
+    return "INTEGER"
+
+
+from app.core.phone import hash_phone, normalize_phone
+from app.db import database, models
+from app.services import user_service
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def _setup_db(db_url: str):
+    if db_url.startswith("sqlite"):
+        engine = create_engine(db_url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(db_url)
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+def _format(digits: str, rnd: random.Random) -> str:
+    """79161234567 -> один из форматов записной книжки."""
+    body = digits[1:]
+    return rnd.choice([
+        f"+7 ({body[:3]}) {body[3:6]}-{body[6:8]}-{body[8:]}",
+        f"8 {body[:3]} {body[3:6]} {body[6:8]} {body[8:]}",
+        f"+7{body}",
+    ])
+
+
+def _measure(fn, counter: QueryCounter, repeats: int):
+    timings, queries, result = [], [], None
+    for _ in range(repeats):
+        before = counter.count
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count - before)
+    return statistics.median(timings), statistics.median(queries), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--contacts", type=int, default=5000)
+    parser.add_argument("--hit-ratio", type=float, default=0.1, help="Доля контактов, которые зарегистрированы")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--db-url", default="sqlite://")
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    engine = _setup_db(args.db_url)
+    db = database.SessionLocal()
+
+    registered = [f"79{n:09d}" for n in rnd.sample(range(10 ** 9), args.users)]
+    db.execute(insert(models.User), [
+        {"phone_number": f"+{digits}", "phone_digits": digits, "phone_hash": hash_phone(digits),
+         "first_name": f"User{i}", "password_hash": "x", "public_key": "k"}
+        for i, digits in enumerate(registered)
+    ])
+    db.commit()
+    me = db.query(models.User.id).order_by(models.User.id).first()[0]
+
+    hits = rnd.sample(registered, int(args.contacts * args.hit_ratio))
+    registered_set = set(registered)
+    misses = []
+    while len(misses) < args.contacts - len(hits):
+        digits = f"79{rnd.randrange(10 ** 9):09d}"
+        if digits not in registered_set:
+            misses.append(digits)
+    book = [_format(digits, rnd) for digits in hits + misses]
+    rnd.shuffle(book)
+    hashes = [hash_phone(normalize_phone(phone)) for phone in book]
+
+    # Лимит частоты в бенчмарке не нужен
+    user_service.contact_sync_limiter.capacity = 10 ** 9
+    user_service.contact_sync_limiter.reset(me)
+
+    counter = QueryCounter(engine)
+    print(f"Пользователей: {args.users}, контактов: {args.contacts}, зарегистрировано: {len(hits)}\n")
+    print(f"{'Путь':<42}{'время':>12}{'запросов':>10}{'найдено':>9}")
+
+    def row(title, result):
+        ms, queries, found = result
+        print(f"{title:<42}{ms:>9.1f} мс{queries:>10.0f}{found:>9}")
+
+    def one_by_one():
+        db.expunge_all()
+        return sum(1 for phone in book if user_service.get_user_by_phone(db, phone) is not None)
+
+    def sync(numbers, phone_hashes):
+        def run():
+            db.expunge_all()
+            return len(user_service.sync_contacts(db, me, numbers, phone_hashes))
+        return run
+
+    row("Запрос на каждый номер (get_user_by_phone)", _measure(one_by_one, counter, args.repeats))
+    row("sync_contacts по номерам", _measure(sync(book, []), counter, args.repeats))
+    row("sync_contacts по хешам", _measure(sync([], hashes), counter, args.repeats))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Бенчмарк проверки паролей (Argon2): сколько логинов в секунду дает одно ядро.
+
+Сначала проверка паролей в одном процессе подряд (как раньше в threadpool),
+затем через PasswordHashPool с --workers процессами и заполненной очередью.
+Параметры Argon2 передаются через переменные окружения ARGON2_* (их же
+видят процессы пула), поэтому задаются до импорта приложения.
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_password_hash --logins 200 --workers 1 2 4
+    python -m benchmarks.bench_password_hash --time-cost 2 --memory-cost-kib 19456 --parallelism 1
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--time-cost", type=int, default=None)
+    parser.add_argument("--memory-cost-kib", type=int, default=None)
+    parser.add_argument("--parallelism", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    for name, value in (
+        ("ARGON2_TIME_COST", args.time_cost),
+        ("ARGON2_MEMORY_COST_KIB", args.memory_cost_kib),
+        ("ARGON2_PARALLELISM", args.parallelism),
+    ):
+        if value is not None:
+            os.environ[name] = str(value)
+
+    from app.core.config import settings
+    from app.core.password_pool import PasswordHashPool, make_password_context
+
+    context = make_password_context()
+    hashed = context.hash("correct horse battery staple")
+    cores = os.cpu_count() or 1
+    print(
+        f"Argon2: t={settings.ARGON2_TIME_COST}, m={settings.ARGON2_MEMORY_COST_KIB} KiB, "
+        f"p={settings.ARGON2_PARALLELISM}; ядер: {cores}; логинов: {args.logins}"
+    )
+
+    started = time.perf_counter()
+    for _ in range(args.logins):
+        context.verify("correct horse battery staple", hashed)
+    elapsed = time.perf_counter() - started
+    print(f"{'в одном процессе':<22} {args.logins / elapsed:8.1f} логинов/с   {elapsed / args.logins * 1000:7.1f} мс на логин")
+
+    for workers in args.workers:
+        pool = PasswordHashPool(workers=workers, max_pending=args.logins, timeout_seconds=600)
+        # Запуск процессов не входит в замер
+        with ThreadPoolExecutor(max_workers=workers) as warmup:
+            list(warmup.map(lambda _: pool.verify_and_update("прогрев", hashed), range(workers)))
+
+        # Потоки имитируют threadpool FastAPI: каждый ждет свой результат из пула
+        with ThreadPoolExecutor(max_workers=args.logins) as clients:
+            started = time.perf_counter()
+            results = list(clients.map(
+                lambda _: pool.verify_and_update("correct horse battery staple", hashed)[0], range(args.logins)
+            ))
+            elapsed = time.perf_counter() - started
+        pool.shutdown()
+
+        assert all(results)
+        per_second = args.logins / elapsed
+        print(
+            f"{f'пул, {workers} проц.':<22} {per_second:8.1f} логинов/с   "
+            f"{per_second / min(workers, cores):7.1f} логинов/с на ядро"
+        )
+
+
+if __name__ == "__main__":
+    main()
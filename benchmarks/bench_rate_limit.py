@@ -0,0 +1,129 @@
+"""
+Бенчмарк ограничителя частоты запросов (app/core/rate_limit.py, app/api/rate_limits.py).
+
+1. Стоимость hit() для бэкендов "memory" и "shared" на --keys разных ключах.
+2. Накладные расходы RateLimitMiddleware на запрос (ASGI-вызов с пустым
+   приложением: путь под лимитом по IP, путь без правил).
+3. Проверка общего лимита "shared": --processes процессов одновременно
+   тратят одно ведро на --capacity запросов - пропущено должно быть ровно
+   столько, сколько в ведре (пополнение за время теста незначительно).
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_rate_limit --keys 10000 --hits 200000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from multiprocessing import resource_tracker
+
+
+def _measure_hits(limiter, keys, hits: int) -> float:
+    rnd = random.Random(1)
+    sample = [rnd.choice(keys) for _ in range(hits)]
+    started = time.perf_counter()
+    for key in sample:
+        limiter.hit(key)
+    return (time.perf_counter() - started) / hits * 1_000_000
+
+
+def _unlink(shm):
+    # Сегмент снят с учета resource_tracker при открытии (он общий) - возвращаем перед удалением
+    resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+def _measure_middleware(path: str, requests: int) -> float:
+    from app.api.rate_limits import RateLimitMiddleware
+
+    async def endpoint(scope, receive, send):
+        pass
+
+    async def send(message):
+        pass
+
+    middleware = RateLimitMiddleware(endpoint)
+    scopes = [
+        {"type": "http", "path": path, "headers": [], "client": (f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", 1)}
+        for i in range(requests)
+    ]
+
+    async def run():
+        timings = []
+        for scope in scopes:
+            started = time.perf_counter()
+            await middleware(scope, None, send)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    return statistics.mean(asyncio.run(run())) * 1_000_000
+
+
+def _spend_shared_bucket(name: str, capacity: int, attempts: int, queue):
+    from app.core.rate_limit import SharedRateLimiter
+    limiter = SharedRateLimiter(name, capacity, 3600, slots=1024)
+    queue.put(sum(1 for _ in range(attempts) if limiter.hit("one-key") == 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=10_000)
+    parser.add_argument("--hits", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=1000)
+    args = parser.parse_args()
+
+    from multiprocessing import shared_memory
+    from app.core.rate_limit import RateLimiter, SharedRateLimiter
+
+    keys = [f"10.0.{i // 256}.{i % 256}" for i in range(args.keys)]
+    name = f"bench_{os.getpid()}"
+    shared = SharedRateLimiter(name, 1_000_000, 60, slots=65_536)
+    try:
+        print(f"hit(), {args.keys} ключей:")
+        print(f"  memory  {_measure_hits(RateLimiter(1_000_000, 60), keys, args.hits):6.2f} µs")
+        print(f"  shared  {_measure_hits(shared, keys, args.hits):6.2f} µs")
+    finally:
+        _unlink(shared._shm)
+
+    # Middleware с временными ведрами, чтобы не трогать сегменты работающего приложения
+    from app.api import rate_limits
+    for backend in ("memory", "shared"):
+        if backend == "memory":
+            rate_limits.limiters = {rule: RateLimiter(1_000_000, 60) for rule in rate_limits.RULES}
+        else:
+            rate_limits.limiters = {
+                rule: SharedRateLimiter(f"bench_{os.getpid()}_{rule}", 1_000_000, 60) for rule in rate_limits.RULES
+            }
+        try:
+            print(f"RateLimitMiddleware на запрос, {backend}:")
+            print(f"  путь с лимитом по IP   {_measure_middleware('/api/v1/auth/send-code', 20_000):6.2f} µs")
+            print(f"  путь без правил        {_measure_middleware('/api/v1/chats/', 20_000):6.2f} µs")
+        finally:
+            if backend == "shared":
+                for limiter in rate_limits.limiters.values():
+                    _unlink(limiter._shm)
+
+    name = f"bench_mp_{os.getpid()}"
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_spend_shared_bucket, args=(name, args.capacity, args.capacity, queue))
+        for _ in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    allowed = sum(queue.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    _unlink(shared_memory.SharedMemory(name=f"dialect_rl_{name}"))
+    print(
+        f"shared, {args.processes} процессов x {args.capacity} запросов в ведро на {args.capacity}: "
+        f"пропущено {allowed}"
+    )
+
+
+if __name__ == "__main__":
+    main()
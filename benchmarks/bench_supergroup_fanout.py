@@ -0,0 +1,196 @@
+"""
+Нагрузочный бенчмарк супергрупп (ChatTypeEnum.supergroup).
+
+Создает чат на --members участников (по умолчанию 10 000), подключает --online
+"фейковых" WebSocket-соединений и сравнивает обычную группу и супергруппу на
+горячих путях: рассылка нового сообщения, список чатов участника, прочтение.
+Для каждого пути выводит время и число SQL-запросов.
+
+По умолчанию работает на SQLite в памяти (схема та же, BIGINT -> INTEGER),
+для замеров на MySQL передайте --db-url.
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_supergroup_fanout --members 10000 --online 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import BIGINT, create_engine, event, insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+
+@compiles(BIGINT, "sqlite")
+def _sqlite_bigint(type_, compiler, **kw):
+    # В SQLite автоинкремент работает только у INTEGER PRIMARY KEY
+    return "INTEGER"
+
+
+from app.db import database, models
+from app.services import chat_service, message_service, notification_service
+from app.services.connection_manager import manager
+from app.api.v1.messages import deliver_new_message
+
+
+class FakeWebSocket:
+    """Соединение, которое только считает отправленные кадры."""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, text: str):
+        self.frames += 1
+
+    async def send_json(self, data: dict):
+        self.frames += 1
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def _setup_db(db_url: str):
+    if db_url.startswith("sqlite"):
+        engine = create_engine(db_url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(db_url)
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_chat(db, chat_type: models.ChatTypeEnum, user_ids) -> models.Chat:
+    chat = models.Chat(chat_type=chat_type, chat_name=f"bench {chat_type.value}", owner_id=user_ids[0],
+                       member_count=len(user_ids))
+    db.add(chat)
+    db.flush()
+    db.execute(insert(models.ChatParticipant), [{"chat_id": chat.id, "user_id": uid} for uid in user_ids])
+    db.commit()
+    return chat
+
+
+def _measure(fn, counter: QueryCounter, repeats: int):
+    timings, queries = [], []
+    for _ in range(repeats):
+        before = counter.count
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count - before)
+    return statistics.median(timings), statistics.median(queries)
+
+
+def _legacy_fanout(db, msg: models.Message):
+    """Прежний путь: каждый участник по отдельности (WS + запрос устройств для пуша)."""
+    async def run():
+        for pid in message_service.get_chat_participants(db, msg.chat_id):
+            await manager.send_personal_message({"type": "new_message", "id": msg.id}, pid)
+            if pid != msg.sender_id:
+                db.query(models.UserDevice).filter(models.UserDevice.user_id == pid).all()
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=10_000)
+    parser.add_argument("--online", type=int, default=500, help="Сколько участников подключено по WS")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db-url", default="sqlite://")
+    args = parser.parse_args()
+
+    engine = _setup_db(args.db_url)
+    db = database.SessionLocal()
+
+    db.execute(insert(models.User), [
+        {"phone_number": f"+7000{i:07d}", "first_name": f"User{i}", "password_hash": "x", "public_key": "k"}
+        for i in range(args.members)
+    ])
+    db.commit()
+    user_ids = [row[0] for row in db.query(models.User.id).order_by(models.User.id).all()]
+    sender_id = user_ids[0]
+
+    group = _create_chat(db, models.ChatTypeEnum.group, user_ids)
+    supergroup = _create_chat(db, models.ChatTypeEnum.supergroup, user_ids)
+    group_id, supergroup_id = group.id, supergroup.id
+
+    sockets = []
+    for uid in user_ids[:args.online]:
+        ws = FakeWebSocket()
+        manager.active_connections.setdefault(uid, []).append(ws)
+        sockets.append(ws)
+
+    counter = QueryCounter(engine)
+    print(f"Участников: {args.members}, онлайн: {args.online}, повторов: {args.repeats}\n")
+    print(f"{'Путь':<44}{'group':>20}{'supergroup':>20}")
+
+    def row(title, group_result, super_result):
+        fmt = lambda r: f"{r[0]:8.1f} мс /{r[1]:5.0f} q"
+        print(f"{title:<44}{fmt(group_result):>20}{fmt(super_result):>20}")
+
+    # 1. Рассылка нового сообщения
+    def send(chat_id, legacy: bool):
+        def run():
+            msg = models.Message(chat_id=chat_id, sender_id=sender_id, content=b"hello",
+                                 status=models.MessageStatusEnum.sent)
+            db.add(msg)
+            db.commit()
+            if legacy:
+                _legacy_fanout(db, msg)
+            else:
+                asyncio.run(deliver_new_message(db, msg, {"type": "new_message", "id": msg.id}))
+        return run
+
+    row("Рассылка: прежний цикл по участникам",
+        _measure(send(group_id, legacy=True), counter, args.repeats),
+        _measure(send(supergroup_id, legacy=True), counter, args.repeats))
+    row("Рассылка: deliver_new_message",
+        _measure(send(group_id, legacy=False), counter, args.repeats),
+        _measure(send(supergroup_id, legacy=False), counter, args.repeats))
+    notification_service.push_batcher._pending.clear()
+
+    # 2. Список чатов участника: пользователь только в группе / только в супергруппе
+    def leave(chat_id, user_id):
+        db.execute(models.ChatParticipant.__table__.delete().where(
+            models.ChatParticipant.chat_id == chat_id, models.ChatParticipant.user_id == user_id
+        ))
+        db.commit()
+
+    def chat_list(user_id):
+        def run():
+            db.expunge_all()  # Без кэша сессии, как в отдельном запросе
+            chat_service.get_user_chats(db, user_id)
+        return run
+
+    leave(supergroup_id, user_ids[-1])
+    leave(group_id, user_ids[-2])
+    row("Список чатов участника (get_user_chats)",
+        _measure(chat_list(user_ids[-1]), counter, args.repeats),
+        _measure(chat_list(user_ids[-2]), counter, args.repeats))
+
+    # 3. Прочтение: message_reads на каждое сообщение против watermark
+    last_id = db.query(models.Message.id).order_by(models.Message.id.desc()).first()[0]
+    reader = user_ids[1]
+    for chat_id in (group_id, supergroup_id):
+        db.query(models.ChatParticipant).filter_by(chat_id=chat_id, user_id=reader).update(
+            {models.ChatParticipant.last_read_message_id: 0}
+        )
+    db.commit()
+    row("Прочтение истории (message_reads / watermark)",
+        _measure(lambda: message_service.mark_messages_as_read(db, group_id, reader, last_id), counter, 1),
+        _measure(lambda: message_service.mark_messages_as_read(db, supergroup_id, reader, last_id), counter, 1))
+
+    frames = sum(ws.frames for ws in sockets)
+    print(f"\nКадров WS отправлено фейковым соединениям: {frames}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
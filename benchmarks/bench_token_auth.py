@@ -0,0 +1,56 @@
+"""
+Бенчмарк проверки access токена (security.verify_and_decode_token).
+
+Сравнивает полный jwt.decode + проверку HMAC на каждый запрос (кэш
+сбрасывается перед каждым вызовом) с попаданием в token_cache. Запросы идут
+от --tokens клиентов, каждый со своим токеном, по кругу - как при обычной
+нагрузке, когда клиент весь срок жизни токена ходит с ним.
+
+Запуск (из корня репозитория, нужен .env или переменные окружения):
+    python -m benchmarks.bench_token_auth --tokens 1000 --requests 100000
+"""
+import argparse
+import statistics
+import time
+
+from app.core import security
+
+
+def _measure(tokens, requests: int, cold: bool) -> list:
+    timings = []
+    for i in range(requests):
+        token = tokens[i % len(tokens)]
+        if cold:
+            security.token_cache.clear()
+        started = time.perf_counter()
+        security.verify_and_decode_token(token)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def _report(title: str, timings: list):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{title:<28} mean {statistics.mean(timings):8.2f} µs   p50 {statistics.median(timings):8.2f} µs   p99 {p99:8.2f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=100_000)
+    args = parser.parse_args()
+
+    tokens = [security.create_access_token(user_id, session_id=user_id) for user_id in range(1, args.tokens + 1)]
+
+    cold = _measure(tokens, args.requests, cold=True)
+    security.token_cache.clear()
+    warm = _measure(tokens, args.requests, cold=False)
+
+    print(f"Токенов: {args.tokens}, запросов: {args.requests}")
+    _report("jwt.decode на каждый запрос", cold)
+    _report("token_cache", warm)
+    print(f"Попаданий в кэш: {security.token_cache.hits}, промахов: {security.token_cache.misses}")
+
+
+if __name__ == "__main__":
+    main()
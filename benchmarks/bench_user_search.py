@@ -0,0 +1,126 @@
+"""
+Бенчмарк поиска пользователей: триграммный индекс (app/core/search_index.py)
+против линейного прохода, эквивалентного OR из LIKE '%...%' (скан users).
+
+Скан показан в двух вариантах: "LIMIT" - останавливается на первых 20 совпадениях
+(так работал прежний SQL для частых слов, без ранжирования), "полный" - обходит
+всю таблицу (редкие запросы и опечатки, а также любой поиск с ранжированием).
+
+Генерирует --users синтетических пользователей (имена, юзернеймы, телефоны),
+строит индекс и измеряет время построения, память и задержку запросов.
+
+Запуск (из корня репозитория):
+    python -m benchmarks.bench_user_search --users 1000000
+"""
+import argparse
+import random
+import resource
+import statistics
+import time
+from typing import Optional
+
+from app.core.phone import normalize_phone
+from app.core.search_index import UserSearchIndex, normalize
+
+FIRST_NAMES = ["Иван", "Пётр", "Анна", "Мария", "Алексей", "Дмитрий", "Ольга", "Елена", "Сергей", "Наталья",
+               "Михаил", "Татьяна", "Андрей", "Юлия", "Николай", "John", "Maria", "Alex", "Kate", "David"]
+LAST_NAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов", "Михайлов",
+              "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Smith", "Brown", "Lee", "Garcia", None]
+SYLLABLES = ["ka", "ro", "mi", "ta", "zu", "ne", "lo", "vi", "an", "dr", "ex", "qu", "po", "si", "ty"]
+
+QUERIES = ["иван", "Иван Петров", "петров иван", "@karo", "smith", "мих", "ольга сок", "925", "+7 (925) 12",
+           "dragon", "zzz", "Фёдоров", "alex lee"]
+
+
+def _make_users(count: int):
+    rnd = random.Random(42)
+    for user_id in range(1, count + 1):
+        username = None
+        if rnd.random() < 0.7:
+            username = "".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))) + str(rnd.randint(0, 9999))
+        yield (
+            user_id,
+            username,
+            rnd.choice(FIRST_NAMES),
+            rnd.choice(LAST_NAMES),
+            f"+79{rnd.randint(0, 999_999_999):09d}"
+        )
+
+
+def _linear_search(rows, query: str, limit: Optional[int]):
+    """Аналог прежнего SQL: OR из LIKE по всем колонкам, без ранжирования."""
+    clean = normalize(query.strip().lstrip("@"))
+    phone = normalize_phone(query)
+    parts = clean.split()
+    result = []
+    for user_id, username, first_name, last_name, phone_number in rows:
+        username, first_name, last_name = normalize(username), normalize(first_name), normalize(last_name)
+        match = (len(phone) >= 3 and phone in phone_number) or (username and clean in username)
+        if not match and len(parts) == 1:
+            match = parts[0] in first_name or parts[0] in last_name
+        elif not match and len(parts) >= 2:
+            match = (parts[0] in first_name and parts[1] in last_name) or \
+                    (parts[1] in first_name and parts[0] in last_name)
+        if match:
+            result.append(user_id)
+            if limit and len(result) >= limit:
+                break
+    return result
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--linear-repeats", type=int, default=2)
+    args = parser.parse_args()
+
+    rows = list(_make_users(args.users))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    index = UserSearchIndex()
+    started = time.perf_counter()
+    index.build(rows)
+    build_seconds = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"Пользователей: {args.users}")
+    print(f"Построение индекса: {build_seconds:.1f} с, прирост RSS ~{(rss_after - rss_before) / 1024:.0f} МБ")
+
+    started = time.perf_counter()
+    for i in range(10_000):
+        user_id, username, first_name, last_name, phone = rows[i]
+        index.upsert((user_id, username, first_name, "Обновлёнов", phone))
+    print(f"Обновление профиля: {(time.perf_counter() - started) / 10_000 * 1e6:.1f} мкс\n")
+
+    print(f"{'Запрос':<16}{'индекс p50':>12}{'p99':>10}{'найдено':>9}{'скан LIMIT':>12}{'полный скан':>13}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            found = index.search(query, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        scans = []
+        for limit in (20, None):
+            linear = []
+            for _ in range(args.linear_repeats):
+                started = time.perf_counter()
+                _linear_search(rows, query, limit=limit)
+                linear.append((time.perf_counter() - started) * 1000)
+            scans.append(statistics.median(linear))
+
+        print(f"{query:<16}{statistics.median(timings):>9.2f} мс{_percentile(timings, 0.99):>7.2f} мс"
+              f"{len(found):>9}{scans[0]:>9.1f} мс{scans[1]:>10.0f} мс")
+
+    top = index.search("karo", limit=5)
+    print(f"\nТоп по 'karo' (сначала точный username / префикс): {[rows[uid - 1][1] for uid in top]}")
+
+
+if __name__ == "__main__":
+    main()